@@ -0,0 +1,152 @@
+"""Бенчмарк /reports/course-report на сгенерированных данных.
+
+Запуск из корня проекта: python -m benchmarks.course_report
+
+Для каждого размера курса (студентов на курс) данные создаются в транзакции,
+которая в конце откатывается, так что база не меняется. Старый запрос
+(JOIN записей и оценок с COUNT(DISTINCT ...)) растет как студенты x оценки
+на курс, новый читает сводные таблицы и растет линейно.
+"""
+import asyncio
+import time
+from datetime import timedelta
+import asyncpg
+from fastapi import Response
+import grade_stats
+import report_cache
+from database import init_pool, close_pool
+from routers.reports import get_course_report
+
+COURSES = 20
+GRADES_PER_STUDENT = 10
+STUDENTS_PER_COURSE = [25, 50, 100, 200]
+REPEAT = 5
+
+LEGACY_COURSE_REPORT_SQL = """
+SELECT 
+    c.id as course_id,
+    c.title,
+    c.description,
+    c.duration,
+    CONCAT(t.first_name, ' ', t.last_name) as teacher_name,
+    t.qualification,
+    COUNT(DISTINCT sce.student_id) as enrolled_students,
+    COUNT(DISTINCT g.id) as total_assignments,
+    AVG(g.grade_value) as average_grade
+FROM courses.courses c
+JOIN courses.teachers t ON c.teacher_id = t.id
+LEFT JOIN courses.student_course_enrollment sce ON c.id = sce.course_id
+LEFT JOIN courses.grades g ON c.id = g.course_id
+GROUP BY c.id, c.title, c.description, c.duration, t.id, t.first_name, t.last_name, t.qualification
+ORDER BY c.title
+"""
+
+
+async def seed(conn: asyncpg.Connection, students_per_course: int):
+    """Создать COURSES курсов, на каждый записаны все students_per_course студентов"""
+
+    role_id = await conn.fetchval("SELECT MIN(id) FROM courses.roles")
+
+    async def create_users(prefix: str, count: int):
+        rows = await conn.fetch(
+            """
+            INSERT INTO courses.users (username, password_hash, email, role_id, registration_date_time)
+            SELECT $1 || i, '', $1 || i || '@bench.local', $2, now()
+            FROM generate_series(1, $3) i
+            RETURNING id
+            """,
+            f"bench_{prefix}_{students_per_course}_", role_id, count
+        )
+        return [r['id'] for r in rows]
+
+    teacher_users = await create_users("t", COURSES)
+    teacher_ids = [r['id'] for r in await conn.fetch(
+        """
+        INSERT INTO courses.teachers (user_id, first_name, last_name, qualification)
+        SELECT u, 'Bench', 'Teacher', 'bench' FROM unnest($1::int[]) u
+        RETURNING id
+        """,
+        teacher_users
+    )]
+
+    course_ids = [r['id'] for r in await conn.fetch(
+        """
+        INSERT INTO courses.courses (title, description, duration, teacher_id)
+        SELECT 'bench course ' || t.ord, NULL, $2, t.id
+        FROM unnest($1::int[]) WITH ORDINALITY t(id, ord)
+        RETURNING id
+        """,
+        teacher_ids, timedelta(days=30)
+    )]
+
+    student_users = await create_users("s", students_per_course)
+    student_ids = [r['id'] for r in await conn.fetch(
+        """
+        INSERT INTO courses.students (user_id, first_name, last_name, group_number)
+        SELECT u, 'Bench', 'Student', 'BENCH' FROM unnest($1::int[]) u
+        RETURNING id
+        """,
+        student_users
+    )]
+
+    await conn.execute(
+        """
+        INSERT INTO courses.student_course_enrollment (student_id, course_id, enrollment_date)
+        SELECT s, c, CURRENT_DATE FROM unnest($1::int[]) s CROSS JOIN unnest($2::int[]) c
+        """,
+        student_ids, course_ids
+    )
+
+    await conn.execute(
+        """
+        INSERT INTO courses.grades (student_id, course_id, assignment_title, grade_value, submission_date)
+        SELECT s, c, 'task ' || k, round((2 + random() * 3)::numeric, 1), CURRENT_DATE
+        FROM unnest($1::int[]) s CROSS JOIN unnest($2::int[]) c CROSS JOIN generate_series(1, $3) k
+        """,
+        student_ids, course_ids, GRADES_PER_STUDENT
+    )
+
+    await grade_stats.rebuild(conn)
+    await conn.execute("ANALYZE courses.grades")
+    await conn.execute("ANALYZE courses.student_course_enrollment")
+
+
+async def uncached_course_report(conn: asyncpg.Connection):
+    report_cache.cache.clear()
+    return await get_course_report(Response(), conn)
+
+
+async def best_of(coro_factory) -> float:
+    timings = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        await coro_factory()
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings)
+
+
+async def main():
+    pool = await init_pool()
+    try:
+        async with pool.acquire() as conn:
+            await grade_stats.ensure_schema(conn)
+
+            print(f"{'студентов/курс':>15} {'оценок':>10} {'старый, мс':>12} {'новый, мс':>12}")
+            for students_per_course in STUDENTS_PER_COURSE:
+                tr = conn.transaction()
+                await tr.start()
+                try:
+                    await seed(conn, students_per_course)
+                    legacy = await best_of(lambda: conn.fetch(LEGACY_COURSE_REPORT_SQL))
+                    current = await best_of(lambda: uncached_course_report(conn))
+                finally:
+                    await tr.rollback()
+
+                grades = COURSES * students_per_course * GRADES_PER_STUDENT
+                print(f"{students_per_course:>15} {grades:>10} {legacy:>12.1f} {current:>12.1f}")
+    finally:
+        await close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,223 @@
+"""Число обращений к базе у изменяющих обработчиков.
+
+Запуск из корня проекта: python -m benchmarks.write_round_trips
+
+Обработчики вызываются напрямую с соединением-счетчиком: каждый запрос,
+BEGIN и COMMIT (SAVEPOINT/RELEASE внутри внешней транзакции) - одно
+обращение к серверу. Данные создаются во внешней транзакции, которая
+в конце откатывается, так что база не меняется. Для ошибок проверяется
+и число обращений, и что ответ остался прежним (код и текст).
+
+Те же сценарии с проверкой (одно обращение, прежний ответ) - в
+tests/test_write_round_trips.py.
+"""
+import asyncio
+from datetime import date, datetime, timedelta
+import asyncpg
+from fastapi import HTTPException
+import grade_stats
+import schemas
+from database import init_pool, close_pool
+from routers import courses, enrollments, grades, schedule
+
+# Сколько обращений делали обработчики до перевода на запись одним запросом
+BASELINE = {
+    "create_grade": 7,
+    "create_grade: нет студента": 3,
+    "update_grade": 8,
+    "update_grade: название": 4,
+    "update_grade: нет оценки": 1,
+    "enroll_student": 7,
+    "enroll_student: уже записан": 5,
+    "update_grade (enrollments)": 2,
+    "update_grade (enrollments): нет записи": 1,
+    "update_course": 3,
+    "update_course: нет преподавателя": 2,
+    "create_schedule_item": 4,
+    "create_schedule_item: нет курса": 3,
+    "update_schedule_item": 2,
+    "update_schedule_item: нет элемента": 1,
+    # Раньше изменение одной границы не проверялось и запись проходила
+    "update_schedule_item: конец раньше начала": 2,
+}
+
+_QUERY_METHODS = {"execute", "executemany", "fetch", "fetchrow", "fetchval", "copy_records_to_table"}
+
+
+class CountingConnection:
+    """Обертка над asyncpg.Connection, считающая обращения к серверу"""
+
+    def __init__(self, conn: asyncpg.Connection):
+        self._conn = conn
+        self.round_trips = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self._conn, name)
+        if name not in _QUERY_METHODS:
+            return attr
+
+        async def counted(*args, **kwargs):
+            self.round_trips += 1
+            return await attr(*args, **kwargs)
+        return counted
+
+    def transaction(self, **kwargs):
+        return _CountingTransaction(self, self._conn.transaction(**kwargs))
+
+
+class _CountingTransaction:
+    def __init__(self, counter: CountingConnection, transaction):
+        self._counter = counter
+        self._transaction = transaction
+
+    async def __aenter__(self):
+        self._counter.round_trips += 1
+        await self._transaction.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._counter.round_trips += 1
+        if exc_type is None:
+            await self._transaction.commit()
+        else:
+            await self._transaction.rollback()
+
+
+async def seed(conn: asyncpg.Connection) -> dict:
+    role_id = await conn.fetchval("SELECT MIN(id) FROM courses.roles")
+    user_ids = [r['id'] for r in await conn.fetch(
+        """
+        INSERT INTO courses.users (username, password_hash, email, role_id, registration_date_time)
+        SELECT 'rt_bench_' || i, '', 'rt_bench_' || i || '@bench.local', $1, now()
+        FROM generate_series(1, 3) i
+        RETURNING id
+        """,
+        role_id
+    )]
+    teacher_id = await conn.fetchval(
+        "INSERT INTO courses.teachers (user_id, first_name, last_name, qualification) VALUES ($1, 'Bench', 'Teacher', 'bench') RETURNING id",
+        user_ids[0]
+    )
+    course_id = await conn.fetchval(
+        "INSERT INTO courses.courses (title, duration, teacher_id) VALUES ('bench', $1, $2) RETURNING id",
+        timedelta(days=30), teacher_id
+    )
+    student_id, other_student_id = [r['id'] for r in await conn.fetch(
+        """
+        INSERT INTO courses.students (user_id, first_name, last_name, group_number)
+        SELECT u, 'Bench', 'Student', 'BENCH' FROM unnest($1::int[]) u
+        RETURNING id
+        """,
+        user_ids[1:]
+    )]
+    await conn.execute(
+        "INSERT INTO courses.student_course_enrollment (student_id, course_id, enrollment_date) VALUES ($1, $2, CURRENT_DATE)",
+        student_id, course_id
+    )
+    grade_id = await conn.fetchval(
+        """
+        INSERT INTO courses.grades (student_id, course_id, assignment_title, grade_value, submission_date)
+        VALUES ($1, $2, 'bench', 4, CURRENT_DATE) RETURNING id
+        """,
+        student_id, course_id
+    )
+    schedule_id = await conn.fetchval(
+        "INSERT INTO courses.schedule (course_id, start_date_time, end_date_time) VALUES ($1, $2, $3) RETURNING id",
+        course_id, datetime(2030, 1, 1, 10), datetime(2030, 1, 1, 11)
+    )
+    # Данные вставлены в обход обработчиков - сводки курса пересчитываются
+    await grade_stats.rebuild(conn, course_id)
+    return {
+        "teacher_id": teacher_id,
+        "course_id": course_id,
+        "student_id": student_id,
+        "other_student_id": other_student_id,
+        "grade_id": grade_id,
+        "schedule_id": schedule_id,
+        "missing_id": 2 ** 31 - 1,
+    }
+
+
+def scenarios(ids: dict):
+    """(название, вызов обработчика с соединением)"""
+
+    today = date.today()
+    start = datetime(2030, 2, 1, 10)
+    return [
+        ("create_grade", lambda conn: grades.create_grade(
+            schemas.GradeCreate(student_id=ids["student_id"], course_id=ids["course_id"],
+                                assignment_title="bench 2", grade_value=5, submission_date=today), conn)),
+        ("create_grade: нет студента", lambda conn: grades.create_grade(
+            schemas.GradeCreate(student_id=ids["missing_id"], course_id=ids["course_id"],
+                                assignment_title="bench 2", grade_value=5, submission_date=today), conn)),
+        ("update_grade", lambda conn: grades.update_grade(
+            ids["grade_id"], schemas.GradeUpdate(grade_value=3.5), conn)),
+        ("update_grade: название", lambda conn: grades.update_grade(
+            ids["grade_id"], schemas.GradeUpdate(assignment_title="bench 3"), conn)),
+        ("update_grade: нет оценки", lambda conn: grades.update_grade(
+            ids["missing_id"], schemas.GradeUpdate(grade_value=3.5), conn)),
+        ("enroll_student", lambda conn: enrollments.enroll_student(
+            schemas.EnrollmentCreate(student_id=ids["other_student_id"], course_id=ids["course_id"],
+                                     enrollment_date=today), conn)),
+        ("enroll_student: уже записан", lambda conn: enrollments.enroll_student(
+            schemas.EnrollmentCreate(student_id=ids["student_id"], course_id=ids["course_id"],
+                                     enrollment_date=today), conn)),
+        ("update_grade (enrollments)", lambda conn: enrollments.update_grade(
+            ids["student_id"], ids["course_id"], schemas.EnrollmentUpdate(grade=4.5), conn)),
+        ("update_grade (enrollments): нет записи", lambda conn: enrollments.update_grade(
+            ids["missing_id"], ids["course_id"], schemas.EnrollmentUpdate(grade=4.5), conn)),
+        ("update_course", lambda conn: courses.update_course(
+            ids["course_id"], schemas.CourseUpdate(title="bench 2", teacher_id=ids["teacher_id"]), conn)),
+        ("update_course: нет преподавателя", lambda conn: courses.update_course(
+            ids["course_id"], schemas.CourseUpdate(teacher_id=ids["missing_id"]), conn)),
+        ("create_schedule_item", lambda conn: schedule.create_schedule_item(
+            schemas.ScheduleCreate(course_id=ids["course_id"], start_date_time=start,
+                                   end_date_time=start + timedelta(hours=1)), conn)),
+        ("create_schedule_item: нет курса", lambda conn: schedule.create_schedule_item(
+            schemas.ScheduleCreate(course_id=ids["missing_id"], start_date_time=start,
+                                   end_date_time=start + timedelta(hours=1)), conn)),
+        ("update_schedule_item", lambda conn: schedule.update_schedule_item(
+            ids["schedule_id"], schemas.ScheduleUpdate(end_date_time=datetime(2030, 1, 1, 12)), conn)),
+        ("update_schedule_item: нет элемента", lambda conn: schedule.update_schedule_item(
+            ids["missing_id"], schemas.ScheduleUpdate(end_date_time=datetime(2030, 1, 1, 12)), conn)),
+        ("update_schedule_item: конец раньше начала", lambda conn: schedule.update_schedule_item(
+            ids["schedule_id"], schemas.ScheduleUpdate(end_date_time=datetime(2030, 1, 1, 9)), conn)),
+    ]
+
+
+async def run(conn: asyncpg.Connection, call) -> tuple:
+    counter = CountingConnection(conn)
+    # Ошибка обработчика откатывает только свою точку сохранения
+    savepoint = conn.transaction()
+    await savepoint.start()
+    try:
+        await call(counter)
+        outcome = "ok"
+    except HTTPException as e:
+        outcome = f"{e.status_code} {e.detail}"
+    finally:
+        await savepoint.rollback()
+    return counter.round_trips, outcome
+
+
+async def main():
+    pool = await init_pool()
+    try:
+        async with pool.acquire() as conn:
+            tr = conn.transaction()
+            await tr.start()
+            try:
+                ids = await seed(conn)
+                print(f"{'обработчик':<44} {'было':>5} {'стало':>6}  результат")
+                for name, call in scenarios(ids):
+                    round_trips, outcome = await run(conn, call)
+                    before = BASELINE.get(name, "")
+                    print(f"{name:<44} {before:>5} {round_trips:>6}  {outcome}")
+            finally:
+                await tr.rollback()
+    finally:
+        await close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,56 @@
+import os
+from typing import Iterable, List, Optional, Sequence
+from fastapi import HTTPException, Response, status
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MISSING_IDS_HEADER = "X-Missing-Ids"
+
+# Сколько id можно запросить за раз (и в ?ids=, и в теле POST .../by-ids)
+BULK_IDS_LIMIT = int(os.getenv("BULK_IDS_LIMIT", "1000"))
+
+# Сколько занятий расписания создается одним POST /schedule/bulk
+SCHEDULE_BULK_LIMIT = int(os.getenv("SCHEDULE_BULK_LIMIT", "5000"))
+
+
+def parse_ids(ids: Optional[str]) -> Optional[List[int]]:
+    """Разбор ?ids=1,2,3; None - параметр не передан"""
+
+    if ids is None:
+        return None
+    try:
+        parsed = [int(part) for part in ids.split(",") if part.strip()]
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="ids - список целых чисел через запятую"
+        )
+    return check_ids(parsed)
+
+
+def check_ids(ids: Iterable[int]) -> List[int]:
+    """Убрать повторы с сохранением порядка и проверить лимит"""
+
+    unique = list(dict.fromkeys(ids))
+    if len(unique) > BULK_IDS_LIMIT:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Не больше {BULK_IDS_LIMIT} id за запрос"
+        )
+    return unique
+
+
+def in_order(response: Response, rows: Sequence, ids: Sequence[int], key: str = "id") -> list:
+    """Строки в порядке ids; ненайденные id - в заголовке X-Missing-Ids.
+
+    Запрос WHERE id = ANY($1) возвращает строки в порядке плана, поэтому
+    порядок восстанавливается здесь, за один проход по словарю.
+    """
+
+    by_id = {row[key]: row for row in rows}
+    ordered = [by_id[id_] for id_ in ids if id_ in by_id]
+    missing = [str(id_) for id_ in ids if id_ not in by_id]
+    if missing:
+        response.headers[MISSING_IDS_HEADER] = ",".join(missing)
+    return ordered
@@ -0,0 +1,96 @@
+from datetime import date
+from typing import List, Optional
+import asyncpg
+import grade_stats
+
+# Без уникального индекса ON CONFLICT не от чего срабатывать; NOT EXISTS
+# в запросе ниже защищает от повторов и без него, индекс - от гонок
+_UNIQUE_INDEX_SQL = """
+CREATE UNIQUE INDEX IF NOT EXISTS student_course_enrollment_student_course_key
+ON courses.student_course_enrollment (student_id, course_id)
+"""
+
+# Все пары (студент, курс) одним INSERT ... SELECT; в ответ - кто найден
+# и какие пары созданы, остальные пары уже были записаны
+_ENROLL_SQL = """
+WITH target_students AS (
+    SELECT s.id FROM courses.students s WHERE {students}
+),
+target_courses AS (
+    SELECT c.id FROM courses.courses c WHERE c.id = ANY($2::int[])
+),
+created AS (
+    INSERT INTO courses.student_course_enrollment (student_id, course_id, enrollment_date)
+    SELECT s.id, c.id, $3
+    FROM target_students s
+    CROSS JOIN target_courses c
+    WHERE NOT EXISTS(
+        SELECT 1 FROM courses.student_course_enrollment sce
+        WHERE sce.student_id = s.id AND sce.course_id = c.id
+    )
+    ON CONFLICT DO NOTHING
+    RETURNING student_id, course_id
+)
+SELECT
+    ARRAY(SELECT id FROM target_students ORDER BY id) AS student_ids,
+    ARRAY(SELECT id FROM target_courses ORDER BY id) AS course_ids,
+    ARRAY(SELECT student_id FROM created ORDER BY student_id, course_id) AS created_student_ids,
+    ARRAY(SELECT course_id FROM created ORDER BY student_id, course_id) AS created_course_ids
+"""
+
+
+async def ensure_unique_index(conn: asyncpg.Connection) -> bool:
+    """Уникальность пары (студент, курс); False - в данных уже есть повторы"""
+
+    try:
+        await conn.execute(_UNIQUE_INDEX_SQL)
+    except asyncpg.exceptions.UniqueViolationError:
+        return False
+    return True
+
+
+async def enroll(
+        conn: asyncpg.Connection,
+        course_ids: List[int],
+        enrollment_date: date,
+        student_ids: Optional[List[int]] = None,
+        group_number: Optional[str] = None
+) -> dict:
+    """Записать студентов (по списку id или всю группу) на курсы.
+
+    Вызывать в транзакции: сводки оценок курсов обновляются тут же.
+    """
+
+    if student_ids is not None:
+        sql, students = _ENROLL_SQL.format(students="s.id = ANY($1::int[])"), student_ids
+    else:
+        sql, students = _ENROLL_SQL.format(students="s.group_number = $1"), group_number
+
+    row = await conn.fetchrow(sql, students, course_ids, enrollment_date)
+    created = list(zip(row["created_student_ids"], row["created_course_ids"]))
+    if created:
+        await grade_stats.students_enrolled(conn, [pair[0] for pair in created], [pair[1] for pair in created])
+
+    created_pairs = set(created)
+    found_students = row["student_ids"]
+    found_courses = row["course_ids"]
+    found_student_set = set(found_students)
+    found_course_set = set(found_courses)
+    return {
+        "created": [
+            {"student_id": student_id, "course_id": course_id}
+            for student_id, course_id in sorted(created_pairs)
+        ],
+        "skipped": [
+            {"student_id": student_id, "course_id": course_id}
+            for student_id in found_students
+            for course_id in found_courses
+            if (student_id, course_id) not in created_pairs
+        ],
+        "missing_student_ids": [
+            student_id for student_id in (student_ids or []) if student_id not in found_student_set
+        ],
+        "missing_course_ids": [
+            course_id for course_id in course_ids if course_id not in found_course_set
+        ]
+    }
@@ -0,0 +1,224 @@
+import asyncio
+import os
+import tempfile
+from datetime import timedelta
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+import asyncpg
+from fastapi import HTTPException, status
+from fastapi.responses import FileResponse
+from starlette.background import BackgroundTask
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Сколько строк курсора собирается в один RecordBatch
+BATCH_ROWS = 50_000
+
+FORMATS = {
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+
+def _days(value):
+    return value.days if isinstance(value, timedelta) else value
+
+
+def _float(value):
+    return None if value is None else float(value)
+
+
+class Column:
+    """Колонка выгрузки: имя поля в записи, псевдоним типа arrow и необязательное преобразование"""
+
+    def __init__(self, name: str, type_alias: str, convert: Optional[Callable[[Any], Any]] = None):
+        self.name = name
+        self.type_alias = type_alias
+        self.convert = convert
+
+
+class Dataset:
+    def __init__(self, columns: Sequence[Column], query: str, filters: Sequence[Tuple[str, str]]):
+        """filters - пары (имя параметра запроса, SQL-условие с $n)"""
+
+        self.columns = columns
+        self.query = query
+        self.filters = filters
+
+    def schema(self):
+        return pa.schema([(c.name, pa.type_for_alias(c.type_alias)) for c in self.columns])
+
+
+DATASETS = {
+    "courses": Dataset(
+        [
+            Column("id", "int64"), Column("title", "string"), Column("description", "string"),
+            Column("duration", "int64", _days), Column("teacher_id", "int64"),
+            Column("teacher_name", "string"),
+        ],
+        """
+        SELECT c.id, c.title, c.description, c.duration, c.teacher_id,
+               CONCAT(t.first_name, ' ', t.last_name) as teacher_name
+        FROM courses.courses c
+        JOIN courses.teachers t ON c.teacher_id = t.id
+        WHERE {where}
+        ORDER BY c.id
+        """,
+        [("teacher_id", "c.teacher_id = {}")]
+    ),
+    "students": Dataset(
+        [
+            Column("id", "int64"), Column("user_id", "int64"), Column("first_name", "string"),
+            Column("last_name", "string"), Column("group_number", "string"),
+        ],
+        """
+        SELECT s.id, s.user_id, s.first_name, s.last_name, s.group_number
+        FROM courses.students s
+        WHERE {where}
+        ORDER BY s.id
+        """,
+        [("group_number", "s.group_number = {}")]
+    ),
+    "grades": Dataset(
+        [
+            Column("id", "int64"), Column("student_id", "int64"), Column("course_id", "int64"),
+            Column("assignment_title", "string"), Column("grade_value", "double", _float),
+            Column("submission_date", "date32"),
+        ],
+        """
+        SELECT g.id, g.student_id, g.course_id, g.assignment_title, g.grade_value, g.submission_date
+        FROM courses.grades g
+        WHERE {where}
+        ORDER BY g.id
+        """,
+        [
+            ("course_id", "g.course_id = {}"),
+            ("student_id", "g.student_id = {}"),
+            ("date_from", "g.submission_date >= {}"),
+            ("date_to", "g.submission_date <= {}"),
+        ]
+    ),
+    "schedule": Dataset(
+        [
+            Column("id", "int64"), Column("course_id", "int64"), Column("course_title", "string"),
+            Column("start_date_time", "timestamp[us]"), Column("end_date_time", "timestamp[us]"),
+        ],
+        """
+        SELECT s.id, s.course_id, c.title as course_title, s.start_date_time, s.end_date_time
+        FROM courses.schedule s
+        JOIN courses.courses c ON s.course_id = c.id
+        WHERE {where}
+        ORDER BY s.start_date_time, s.id
+        """,
+        [
+            ("course_id", "s.course_id = {}"),
+            ("date_from", "DATE(s.start_date_time) >= {}"),
+            ("date_to", "DATE(s.start_date_time) <= {}"),
+        ]
+    ),
+    # Успеваемость по паре (курс, студент) из сводных таблиц оценок
+    "performance": Dataset(
+        [
+            Column("course_id", "int64"), Column("student_id", "int64"), Column("group_number", "string"),
+            Column("enrollment_date", "date32"), Column("final_grade", "double", _float),
+            Column("assignments_count", "int64"), Column("average_grade", "double", _float),
+            Column("min_grade", "double", _float), Column("max_grade", "double", _float),
+        ],
+        """
+        SELECT sce.course_id, sce.student_id, s.group_number, sce.enrollment_date,
+               sce.grade as final_grade,
+               COALESCE(gs.grades_count, 0) as assignments_count,
+               gs.grades_sum / NULLIF(gs.grades_count, 0) as average_grade,
+               gs.min_grade, gs.max_grade
+        FROM courses.student_course_enrollment sce
+        JOIN courses.students s ON sce.student_id = s.id
+        LEFT JOIN courses.course_student_grade_stats gs
+            ON gs.course_id = sce.course_id AND gs.student_id = sce.student_id
+        WHERE {where}
+        ORDER BY sce.course_id, sce.student_id
+        """,
+        [
+            ("course_id", "sce.course_id = {}"),
+            ("student_id", "sce.student_id = {}"),
+        ]
+    ),
+}
+
+
+def build_query(dataset: Dataset, params: dict) -> Tuple[str, List[Any]]:
+    conditions = []
+    args = []
+    for name, condition in dataset.filters:
+        value = params.get(name)
+        if value is not None:
+            args.append(value)
+            conditions.append(condition.format(f"${len(args)}"))
+    return dataset.query.format(where=" AND ".join(conditions) or "TRUE"), args
+
+
+def _to_batch(dataset: Dataset, schema, records: List[asyncpg.Record]):
+    arrays = []
+    for index, column in enumerate(dataset.columns):
+        values = [record[index] for record in records]
+        if column.convert is not None:
+            values = [column.convert(v) for v in values]
+        arrays.append(pa.array(values, type=schema.field(index).type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+async def export(pool: asyncpg.Pool, dataset_name: str, fmt: str, params: dict) -> FileResponse:
+    """Выгрузить набор данных в Parquet или Arrow IPC stream.
+
+    Записи читаются курсором пачками по BATCH_ROWS и сразу пишутся во временный
+    файл (запись в отдельном потоке), так что в памяти держится одна пачка.
+    """
+
+    if pa is None:
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Колоночная выгрузка недоступна: не установлен pyarrow"
+        )
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Неизвестный формат: {fmt}")
+    if dataset_name not in DATASETS:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Неизвестный набор данных: {dataset_name}")
+
+    dataset = DATASETS[dataset_name]
+    schema = dataset.schema()
+    query, args = build_query(dataset, params)
+    media_type, extension = FORMATS[fmt]
+
+    fd, path = tempfile.mkstemp(suffix=f".{extension}")
+    os.close(fd)
+    try:
+        if fmt == "parquet":
+            writer = pq.ParquetWriter(path, schema, compression="zstd")
+        else:
+            writer = pa.ipc.new_stream(path, schema)
+
+        try:
+            async with pool.acquire() as conn:
+                async with conn.transaction(readonly=True):
+                    cursor = await conn.cursor(query, *args)
+                    while True:
+                        records = await cursor.fetch(BATCH_ROWS)
+                        if not records:
+                            break
+                        batch = _to_batch(dataset, schema, records)
+                        await asyncio.to_thread(writer.write_batch, batch)
+        finally:
+            await asyncio.to_thread(writer.close)
+    except BaseException:
+        os.remove(path)
+        raise
+
+    return FileResponse(
+        path,
+        media_type=media_type,
+        filename=f"{dataset_name}.{extension}",
+        background=BackgroundTask(os.remove, path)
+    )
@@ -0,0 +1,242 @@
+import asyncio
+import gzip
+import os
+import zlib
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional
+from starlette.datastructures import Headers, MutableHeaders
+from dotenv import load_dotenv
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+load_dotenv()
+
+# Ответы меньше порога не сжимаются: выигрыш меньше накладных расходов
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# Тела (и куски потоков) больше этого размера сжимаются в отдельном потоке,
+# чтобы не занимать цикл событий; zlib и brotli на это время отпускают GIL
+COMPRESSION_OFFLOAD_SIZE = int(os.getenv("COMPRESSION_OFFLOAD_SIZE", str(128 * 1024)))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "5"))
+
+# Порядок предпочтения при равном q в Accept-Encoding
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+_COMPRESSIBLE_TYPES = ("text/", "application/json", "application/x-ndjson", "application/javascript", "application/xml")
+
+
+class _Negotiation:
+    """Выбранное для запроса сжатие и кто хочет получить сжатое тело"""
+
+    __slots__ = ("encoding", "on_encoded")
+
+    def __init__(self, encoding: Optional[str]):
+        self.encoding = encoding
+        self.on_encoded: Optional[Callable[[str, bytes], None]] = None
+
+
+_negotiation: ContextVar[Optional[_Negotiation]] = ContextVar("compression", default=None)
+
+
+def accepted_encoding() -> Optional[str]:
+    """Сжатие, которое middleware применит к ответу текущего запроса"""
+
+    negotiation = _negotiation.get()
+    return negotiation.encoding if negotiation is not None else None
+
+
+def on_encoded(callback: Callable[[str, bytes], None]):
+    """Передать сжатое целиком тело ответа текущего запроса в callback(encoding, body)"""
+
+    negotiation = _negotiation.get()
+    if negotiation is not None:
+        negotiation.on_encoded = callback
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            weights[name.strip().lower()] = q
+
+    default = weights.get("*", 0.0)
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        q = weights.get(encoding, default)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    # Сильный ETag описывает байты, поэтому у сжатого варианта он свой
+    if etag.endswith('"'):
+        return f'{etag[:-1]}-{encoding}"'
+    return etag
+
+
+def strip_etag_encoding(etag: str) -> str:
+    for encoding in ("br", "gzip"):
+        suffix = f'-{encoding}"'
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    # mtime=0: одинаковое тело - одинаковые байты, как и обещает ETag
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+async def compress_async(body: bytes, encoding: str) -> bytes:
+    if len(body) >= COMPRESSION_OFFLOAD_SIZE:
+        return await asyncio.to_thread(compress, body, encoding)
+    return compress(body, encoding)
+
+
+def encoding_headers(headers: MutableHeaders, encoding: str):
+    headers["Content-Encoding"] = encoding
+    headers.add_vary_header("Accept-Encoding")
+    if "etag" in headers:
+        headers["ETag"] = encoded_etag(headers["ETag"], encoding)
+
+
+class _StreamCompressor:
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+            self._zlib = None
+        else:
+            self._brotli = None
+            self._zlib = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes, last: bool) -> bytes:
+        # Каждый кусок сбрасывается сразу, чтобы клиент получал поток по мере генерации
+        if self._brotli is not None:
+            out = self._brotli.process(data)
+            return out + (self._brotli.finish() if last else self._brotli.flush())
+        out = self._zlib.compress(data)
+        return out + self._zlib.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class CompressionMiddleware:
+    """gzip/brotli по Accept-Encoding для текстовых ответов.
+
+    Обычный ответ сжимается целиком, если он не меньше COMPRESSION_MIN_SIZE;
+    потоковый (CSV, NDJSON, JSON-ведомость) - по кускам. Уже сжатые ответы
+    (Content-Encoding задан) и двоичные форматы пропускаются как есть.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        encoding = negotiate(request_headers.get("accept-encoding", ""))
+        negotiation = _Negotiation(encoding)
+        token = _negotiation.set(negotiation)
+        try:
+            if encoding is None:
+                await self.app(scope, receive, send)
+            else:
+                responder = _Responder(send, negotiation, self.minimum_size, request_headers.get("if-none-match", ""))
+                await self.app(scope, receive, responder.send)
+        finally:
+            _negotiation.reset(token)
+
+
+class _Responder:
+    def __init__(self, send, negotiation: _Negotiation, minimum_size: int, if_none_match: str):
+        self._send = send
+        self.if_none_match = if_none_match
+        self.negotiation = negotiation
+        self.encoding = negotiation.encoding
+        self.minimum_size = minimum_size
+        self.start = None
+        self.passthrough = False
+        self.compressor: Optional[_StreamCompressor] = None
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("content-type", "")
+            self.passthrough = (
+                message["status"] < 200
+                or message["status"] in (204, 304)
+                or "content-encoding" in headers
+                or not content_type.startswith(_COMPRESSIBLE_TYPES)
+            )
+            if message["status"] == 304 and "etag" in headers:
+                # 304 повторяет ETag того варианта, который закэширован у клиента
+                etag = encoded_etag(headers["etag"], self.encoding)
+                if etag in self.if_none_match:
+                    MutableHeaders(raw=message["headers"])["ETag"] = etag
+            return
+
+        if message["type"] != "http.response.body":
+            await self._send(message)
+            return
+
+        if self.passthrough:
+            if self.start is not None:
+                await self._send(self.start)
+                self.start = None
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.start is not None and self.compressor is None and not more_body:
+            await self._send_whole(body)
+            return
+
+        if self.compressor is None:
+            self.compressor = _StreamCompressor(self.encoding)
+            headers = MutableHeaders(raw=self.start["headers"])
+            encoding_headers(headers, self.encoding)
+            del headers["Content-Length"]
+            await self._send(self.start)
+            self.start = None
+
+        if len(body) >= COMPRESSION_OFFLOAD_SIZE:
+            data = await asyncio.to_thread(self.compressor.chunk, body, not more_body)
+        else:
+            data = self.compressor.chunk(body, not more_body)
+        await self._send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+    async def _send_whole(self, body: bytes):
+        start, self.start = self.start, None
+        if len(body) < self.minimum_size:
+            await self._send(start)
+            await self._send({"type": "http.response.body", "body": body})
+            return
+
+        data = await compress_async(body, self.encoding)
+        headers = MutableHeaders(raw=start["headers"])
+        encoding_headers(headers, self.encoding)
+        headers["Content-Length"] = str(len(data))
+        await self._send(start)
+        await self._send({"type": "http.response.body", "body": data})
+
+        if self.negotiation.on_encoded is not None:
+            self.negotiation.on_encoded(self.encoding, data)
@@ -0,0 +1,59 @@
+from contextlib import contextmanager
+import asyncpg
+from fastapi import HTTPException, status
+
+# Ограничения, которых нет в исходной схеме. NOT VALID: старые строки
+# не проверяются, но каждая новая запись и каждое изменение - проверяются
+_CONSTRAINTS = {
+    ("schedule", "schedule_time_order_check"): "CHECK (start_date_time < end_date_time) NOT VALID",
+}
+
+# Нарушенное ограничение -> текст ошибки, который раньше давала проверка
+# перед записью. Запись идет одним запросом, а база сама сообщает, что не так.
+MESSAGES = {
+    "grades_student_id_fkey": "Указанный студент не существует",
+    "grades_course_id_fkey": "Указанный курс не существует",
+    "student_course_enrollment_student_id_fkey": "Указанный студент не существует",
+    "student_course_enrollment_course_id_fkey": "Указанный курс не существует",
+    "student_course_enrollment_student_course_key": "Студент уже записан на этот курс",
+    "courses_teacher_id_fkey": "Указанный преподаватель не существует",
+    "schedule_course_id_fkey": "Указанный курс не существует",
+    "schedule_time_order_check": "Время начала должно быть раньше времени окончания",
+    "schedule_series_course_id_fkey": "Указанный курс не существует",
+    "schedule_series_weekdays_check": "Дни недели - числа от 1 (понедельник) до 7 (воскресенье), хотя бы один день",
+    "schedule_series_time_order_check": "Время начала должно быть раньше времени окончания",
+    "schedule_series_date_order_check": "Дата начала серии должна быть не позже даты окончания",
+    "schedule_series_length_check": "Серия не может быть длиннее года",
+}
+
+# Нарушения, означающие конфликт с уже записанными данными - 409
+CONFLICTS = {
+    "schedule_teacher_no_overlap": "Преподаватель уже занят в это время",
+}
+
+
+async def ensure_constraints(conn: asyncpg.Connection):
+    """Добавить недостающие ограничения из _CONSTRAINTS"""
+
+    for (table, name), definition in _CONSTRAINTS.items():
+        exists = await conn.fetchval(
+            "SELECT EXISTS(SELECT 1 FROM pg_constraint WHERE conname = $1 AND conrelid = $2::regclass)",
+            name, f"courses.{table}"
+        )
+        if not exists:
+            await conn.execute(f"ALTER TABLE courses.{table} ADD CONSTRAINT {name} {definition}")
+
+
+@contextmanager
+def translated():
+    """Ошибку ограничения из MESSAGES превратить в 400 с тем же текстом, из CONFLICTS - в 409"""
+
+    try:
+        yield
+    except asyncpg.exceptions.IntegrityConstraintViolationError as e:
+        if e.constraint_name in CONFLICTS:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=CONFLICTS[e.constraint_name])
+        detail = MESSAGES.get(e.constraint_name)
+        if detail is None:
+            raise
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
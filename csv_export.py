@@ -0,0 +1,75 @@
+import csv
+import io
+from typing import AsyncIterator, Sequence, Tuple
+import asyncpg
+from fastapi.responses import StreamingResponse
+
+# Сколько строк курсор забирает с сервера за раз и сколько строк
+# накапливается перед отправкой очередного куска ответа.
+CURSOR_PREFETCH = 1000
+CHUNK_ROWS = 500
+
+
+async def iter_csv_rows(header: Sequence[str], rows: AsyncIterator[Sequence]) -> AsyncIterator[bytes]:
+    """Выгрузить в CSV уже готовые строки, отправляя их кусками по CHUNK_ROWS"""
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    # BOM, чтобы Excel правильно открыл кириллицу
+    buffer.write("\ufeff")
+    writer.writerow(header)
+
+    pending = 0
+    async for row in rows:
+        writer.writerow(["" if value is None else value for value in row])
+        pending += 1
+        if pending >= CHUNK_ROWS:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    yield buffer.getvalue().encode("utf-8")
+
+
+async def iter_csv(
+        pool: asyncpg.Pool,
+        columns: Sequence[Tuple[str, str]],
+        query: str,
+        *args
+) -> AsyncIterator[bytes]:
+    """Построчно выгрузить результат запроса в CSV через серверный курсор.
+
+    columns - пары (заголовок, имя поля в записи).
+    Соединение берется из пула на время выгрузки, память не зависит от числа строк.
+    """
+
+    async def rows():
+        async with pool.acquire() as conn:
+            async with conn.transaction(readonly=True):
+                async for record in conn.cursor(query, *args, prefetch=CURSOR_PREFETCH):
+                    yield [record[key] for _, key in columns]
+
+    async for chunk in iter_csv_rows([title for title, _ in columns], rows()):
+        yield chunk
+
+
+def csv_response(
+        pool: asyncpg.Pool,
+        filename: str,
+        columns: Sequence[Tuple[str, str]],
+        query: str,
+        *args
+) -> StreamingResponse:
+    """StreamingResponse с CSV-выгрузкой запроса"""
+
+    return csv_stream_response(filename, iter_csv(pool, columns, query, *args))
+
+
+def csv_stream_response(filename: str, chunks: AsyncIterator[bytes]) -> StreamingResponse:
+    return StreamingResponse(
+        chunks,
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
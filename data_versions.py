@@ -0,0 +1,121 @@
+import hashlib
+from typing import Optional, Sequence, Tuple
+import asyncpg
+from fastapi import Request
+import compression
+
+# Таблицы, за изменениями которых следим
+TABLES = ("roles", "users", "teachers", "students", "courses", "student_course_enrollment", "grades", "schedule")
+
+# Счетчик изменений на таблицу. Его увеличивает триггер на каждый оператор
+# INSERT/UPDATE/DELETE/TRUNCATE, в той же транзакции, что и само изменение:
+# новая версия становится видна вместе с изменением, при фиксации, а откат
+# откатывает и счетчик. Правки в обход API тоже учитываются.
+#
+# Счетчик таблицы разбит на DATA_VERSION_SHARDS строк, версия - их сумма.
+# Соединение увеличивает строку по номеру своего процесса, поэтому
+# параллельные записи в одну таблицу обычно не ждут блокировку одной строки.
+DATA_VERSION_SHARDS = 16
+
+SCHEMA_SQL = f"""
+CREATE TABLE IF NOT EXISTS courses.data_version_shards (
+    table_name TEXT NOT NULL,
+    shard SMALLINT NOT NULL,
+    version BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (table_name, shard)
+);
+
+CREATE OR REPLACE FUNCTION courses.bump_data_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE courses.data_version_shards SET version = version + 1
+    WHERE table_name = TG_TABLE_NAME AND shard = pg_backend_pid() % {DATA_VERSION_SHARDS};
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# CREATE OR REPLACE TRIGGER есть только с PostgreSQL 14
+_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS {table}_data_version ON courses.{table};
+
+CREATE TRIGGER {table}_data_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON courses.{table}
+FOR EACH STATEMENT EXECUTE FUNCTION courses.bump_data_version()
+"""
+
+# Прежние счетчики - таблица courses.data_versions (строка на таблицу) или
+# последовательности courses.<таблица>_data_version_seq. Их значения
+# переносятся в нулевую строку, чтобы ETag, выданные до обновления,
+# не совпали с новыми при других данных.
+_MIGRATE_TABLE_SQL = """
+UPDATE courses.data_version_shards d
+SET version = d.version + v.version
+FROM courses.data_versions v
+WHERE d.table_name = v.table_name AND d.shard = 0
+"""
+
+_VERSIONS_SQL = """
+SELECT array_agg(version ORDER BY table_name)
+FROM (
+    SELECT table_name, SUM(version)::bigint AS version
+    FROM courses.data_version_shards
+    WHERE table_name = ANY($1::text[])
+    GROUP BY table_name
+) v
+"""
+
+
+async def ensure_schema(conn: asyncpg.Connection):
+    async with conn.transaction():
+        await conn.execute(SCHEMA_SQL)
+        await conn.execute(
+            """
+            INSERT INTO courses.data_version_shards (table_name, shard)
+            SELECT t, s FROM unnest($1::text[]) t, generate_series(0, $2 - 1) s
+            ON CONFLICT DO NOTHING
+            """,
+            list(TABLES), DATA_VERSION_SHARDS
+        )
+        for table in TABLES:
+            await conn.execute(_TRIGGER_SQL.format(table=table))
+
+        if await conn.fetchval("SELECT to_regclass('courses.data_versions') IS NOT NULL"):
+            await conn.execute(_MIGRATE_TABLE_SQL)
+            await conn.execute("DROP TABLE courses.data_versions")
+        for table in TABLES:
+            sequence = f"courses.{table}_data_version_seq"
+            if await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", sequence):
+                await conn.execute(
+                    """
+                    UPDATE courses.data_version_shards
+                    SET version = version + COALESCE(pg_sequence_last_value($1::regclass), 0)
+                    WHERE table_name = $2 AND shard = 0
+                    """,
+                    sequence, table
+                )
+                await conn.execute(f"DROP SEQUENCE {sequence}")
+
+
+async def versions(conn: asyncpg.Connection, tables: Sequence[str]) -> Tuple[int, ...]:
+    """Версии таблиц - один запрос по первичному ключу маленькой таблицы"""
+
+    return tuple(await conn.fetchval(_VERSIONS_SQL, list(tables)) or ())
+
+
+def etag(request: Request, table_versions: Tuple[int, ...]) -> str:
+    """Сильный ETag: ответ определяется адресом, параметрами и версиями данных"""
+
+    query = sorted(request.query_params.multi_items())
+    digest = hashlib.sha1(repr((request.url.path, query, table_versions)).encode("utf-8")).hexdigest()
+    return f'"{digest}"'
+
+
+def matches(if_none_match: Optional[str], current: str) -> bool:
+    # Для If-None-Match сравнение слабое: W/ у присланного тега не учитывается,
+    # как и суффикс сжатого варианта (-gzip, -br) - данные за ним те же
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(
+        compression.strip_etag_encoding(tag.removeprefix("W/")) == current for tag in tags
+    )
@@ -1,9 +1,11 @@
 import os
-from fastapi import Request, HTTPException, status, Depends
+from fastapi import Request, Response, HTTPException, status, Depends
 import jwt
 import asyncpg
 from typing import List, Optional, AsyncGenerator
 from dotenv import load_dotenv
+import data_versions
+import includes
 
 load_dotenv()
 
@@ -20,6 +22,52 @@ async def get_connection(request: Request) -> AsyncGenerator[asyncpg.Connection,
     async with pool.acquire() as conn:
         yield conn
 
+def get_pool(request: Request) -> asyncpg.Pool:
+    """
+    dependency: пул соединений для обработчиков, которым соединение нужно дольше запроса (стриминг).
+    """
+    pool = getattr(request.app.state, "pool", None)
+    if pool is None:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database pool is not initialized")
+    return pool
+
+def get_report_jobs(request: Request):
+    """
+    dependency: менеджер фоновых отчетов request.app.state.report_jobs.
+    """
+    jobs = getattr(request.app.state, "report_jobs", None)
+    if jobs is None:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Report jobs are not initialized")
+    return jobs
+
+def get_report_renderer(request: Request):
+    """
+    dependency: пул рендеринга отчетов request.app.state.report_renderer.
+    """
+    renderer = getattr(request.app.state, "report_renderer", None)
+    if renderer is None:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Report renderer is not initialized")
+    return renderer
+
+def conditional_get(*tables: str, relations: Optional[dict] = None):
+    """
+    dependency: ETag по версиям таблиц tables. Если клиент прислал тот же ETag
+    в If-None-Match, отвечаем 304 до выполнения обработчика и его запросов.
+    relations - связи ?include= маршрута (includes.COURSES и т.п.): таблицы
+    запрошенных связей тоже входят в ETag.
+    """
+    async def check(request: Request, response: Response, conn: asyncpg.Connection = Depends(get_connection)):
+        watched = tables
+        if relations is not None:
+            names = includes.parse(relations, request.query_params.get("include"))
+            watched = tuple(dict.fromkeys(tables + includes.tables(relations, names)))
+        etag = data_versions.etag(request, await data_versions.versions(conn, watched))
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if data_versions.matches(request.headers.get("If-None-Match"), etag):
+            raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        response.headers.update(headers)
+    return check
+
 def get_token_from_header(request: Request) -> Optional[str]:
     auth = request.headers.get("Authorization")
     if not auth:
@@ -0,0 +1,40 @@
+import json
+import os
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Any
+from dotenv import load_dotenv
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+load_dotenv()
+
+# Быстрый путь ответов: строки из базы кодируются в JSON напрямую, без
+# проверки каждой строки моделью pydantic. Включается явно.
+FAST_JSON_RESPONSES = os.getenv("FAST_JSON_RESPONSES", "0").lower() in ("1", "true", "yes")
+
+
+def _default(value: Any) -> Any:
+    # numeric из базы - float в схемах ответа
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime) and value.utcoffset() == timedelta(0):
+        # pydantic пишет нулевое смещение как Z
+        return value.replace(tzinfo=None).isoformat() + "Z"
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Тип {type(value).__name__} не сериализуется в JSON")
+
+
+def dumps(content: Any) -> bytes:
+    """JSON в тех же байтах, что дает pydantic: компактно, без экранирования не-ASCII.
+
+    orjson используется, если установлен; иначе - стандартный json.
+    """
+
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_UTC_Z)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":"), allow_nan=False).encode("utf-8")
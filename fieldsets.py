@@ -0,0 +1,297 @@
+from collections import OrderedDict
+from operator import itemgetter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type
+from fastapi import HTTPException, Response, status
+from pydantic import BaseModel, TypeAdapter, create_model
+import fast_json
+import schemas
+
+# Выбор полей: имя поля -> None для обычного поля или выбор полей вложенного объекта
+Selection = Dict[str, Any]
+
+# Сколько наборов полей помнит каждый кэш (mapper, модель, адаптер):
+# наборы выбирает клиент, поэтому кэши ограничены
+CACHE_SIZE = 256
+
+
+class _Cache(OrderedDict):
+    """Кэш с вытеснением давно не использованных наборов полей"""
+
+    def __init__(self, size: int = CACHE_SIZE):
+        super().__init__()
+        self.size = size
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        self.move_to_end(key)
+        return self[key]
+
+    def put(self, key, value):
+        self[key] = value
+        self.move_to_end(key)
+        if len(self) > self.size:
+            self.popitem(last=False)
+
+
+class Fieldset:
+    """Поля ответа сущности и SQL-выражения, из которых они читаются.
+
+    ?fields=id,last_name,user.email сужает и SELECT, и модель ответа:
+    невыбранные столбцы не читаются из базы, не декодируются и не
+    сериализуются. Имя вложенного объекта без точки (user) выбирает все
+    его поля. Без ?fields= выбираются все поля модели.
+
+    Форма ответа объявляется один раз: SELECT строится из выбора полей,
+    а строки собираются во вложенные объекты функцией, скомпилированной
+    под этот выбор (mapper) и читающей Record по позициям.
+    """
+
+    def __init__(self, model: Type[BaseModel], columns: Dict[str, str], nested: Optional[Dict[str, "Fieldset"]] = None):
+        self.model = model
+        self.columns = columns
+        self.nested = nested or {}
+        self._adapters = _Cache()
+        self._models = _Cache()
+        self._mappers = _Cache()
+
+    def full(self) -> Selection:
+        """Все поля в порядке модели - тот же порядок ключей, что в ответе pydantic"""
+
+        selection: Selection = {}
+        for name in self.model.model_fields:
+            if name in self.columns:
+                selection[name] = None
+            elif name in self.nested:
+                selection[name] = self.nested[name].full()
+        return selection
+
+    def parse(self, fields: Optional[str]) -> Selection:
+        """Разбор ?fields=; без параметра - все поля"""
+
+        paths = [part.strip().split(".") for part in (fields or "").split(",") if part.strip()]
+        if not paths:
+            return self.full()
+
+        unknown: List[str] = []
+        selection = self._parse(paths, "", unknown)
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Неизвестные поля: {', '.join(unknown)}"
+            )
+        return selection
+
+    def _parse(self, paths: List[List[str]], prefix: str, unknown: List[str]) -> Selection:
+        """Выбор в порядке полей модели, а не в порядке ?fields=: ответ
+        всегда одной формы, и fields=a,b и fields=b,a - один набор"""
+
+        selection: Selection = {}
+        nested_paths: Dict[str, List[List[str]]] = {}
+        for head, *rest in paths:
+            if head in self.columns and not rest:
+                selection[head] = None
+            elif head in self.nested:
+                nested_paths.setdefault(head, []).append(rest)
+            else:
+                unknown.append(prefix + ".".join([head, *rest]))
+
+        for name, sub_paths in nested_paths.items():
+            fieldset = self.nested[name]
+            if not all(sub_paths):
+                selection[name] = fieldset.full()
+            else:
+                selection[name] = fieldset._parse(sub_paths, f"{prefix}{name}.", unknown)
+        return {name: selection[name] for name in self.model.model_fields if name in selection}
+
+    def select(self, selection: Selection, keyset=None) -> str:
+        """Список столбцов для SELECT.
+
+        Колонки курсора (pagination.Keyset) читаются всегда: по ним строится
+        X-Next-Cursor, даже если в ответ они не попадают.
+        """
+
+        columns = self._select(selection, "")
+        if keyset is not None:
+            columns.extend(
+                f"{expression} AS {field}"
+                for expression, field, _ in keyset.columns
+                if field not in selection or selection[field] is not None
+            )
+        return ", ".join(columns)
+
+    def _select(self, selection: Selection, prefix: str) -> List[str]:
+        columns = []
+        for name, sub in selection.items():
+            if sub is None:
+                columns.append(f"{self.columns[name]} AS {prefix}{name}")
+            else:
+                columns.extend(self.nested[name]._select(sub, f"{prefix}{name}__"))
+        return columns
+
+    def mapper(self, selection: Selection) -> Callable[[Any], dict]:
+        """Функция строка -> вложенный объект для столбцов из select(selection).
+
+        Столбцы идут в SELECT в порядке обхода выбора, поэтому каждое поле
+        читается по заранее известному индексу: поля одного уровня - одним
+        itemgetter, вложенные объекты - своими функциями.
+        """
+
+        key = _key(selection)
+        mapper = self._mappers.get(key)
+        if mapper is None:
+            mapper, _ = self._compile(selection, 0)
+            self._mappers.put(key, mapper)
+        return mapper
+
+    def _compile(self, selection: Selection, index: int) -> Tuple[Callable[[Any], dict], int]:
+        parts = []
+        for name, sub in selection.items():
+            if sub is None:
+                parts.append((name, itemgetter(index)))
+                index += 1
+            else:
+                build_nested, index = self.nested[name]._compile(sub, index)
+                parts.append((name, build_nested))
+
+        if len(parts) > 1 and all(sub is None for sub in selection.values()):
+            # Плоский объект: все поля одним itemgetter
+            names = list(selection)
+            get = itemgetter(*range(index - len(names), index))
+
+            def build(row):
+                return dict(zip(names, get(row)))
+        else:
+            def build(row):
+                return {name: part(row) for name, part in parts}
+        return build, index
+
+    def build(self, selection: Selection, row) -> dict:
+        return self.mapper(selection)(row)
+
+    def build_all(self, selection: Selection, rows: Sequence) -> List[dict]:
+        return list(map(self.mapper(selection), rows))
+
+    def response_model(self, selection: Selection, extra: Optional[Dict[str, Any]] = None) -> Type[BaseModel]:
+        """Модель ответа только с выбранными полями; строится один раз на набор полей.
+
+        extra - дополнительные поля (имя -> тип), например связи из ?include=
+        """
+
+        key = (_key(selection), tuple(extra or ()))
+        model = self._models.get(key)
+        if model is None:
+            definitions = {}
+            for name, sub in selection.items():
+                if sub is None:
+                    field = self.model.model_fields[name]
+                    definitions[name] = (field.annotation, ... if field.is_required() else field.default)
+                else:
+                    definitions[name] = (Optional[self.nested[name].response_model(sub)], None)
+            for name, annotation in (extra or {}).items():
+                definitions[name] = (annotation, ...)
+            model = create_model(f"{self.model.__name__}Fields", **definitions)
+            self._models.put(key, model)
+        return model
+
+    def respond(
+        self,
+        selection: Selection,
+        content,
+        response: Optional[Response] = None,
+        extra: Optional[Dict[str, Any]] = None
+    ) -> Response:
+        """Ответ по суженной модели; content - словарь или список словарей из build.
+
+        При FAST_JSON_RESPONSES build уже дал словари в форме и порядке модели,
+        и они кодируются сразу, без проверки pydantic. Заголовки, уже
+        выставленные на response (курсор, общее число), переносятся.
+        extra - типы дополнительных полей, см. response_model.
+        """
+
+        headers = dict(response.headers) if response is not None else None
+        if fast_json.FAST_JSON_RESPONSES:
+            return Response(content=fast_json.dumps(content), media_type="application/json", headers=headers)
+
+        many = isinstance(content, list)
+        key = (_key(selection), tuple(extra or ()), many)
+        adapter = self._adapters.get(key)
+        if adapter is None:
+            model = self.response_model(selection, extra)
+            adapter = TypeAdapter(List[model] if many else model)
+            self._adapters.put(key, adapter)
+
+        body = adapter.dump_json(adapter.validate_python(content))
+        return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _key(selection: Selection):
+    """Ключ кэша с сохранением порядка: от порядка полей зависят позиции столбцов"""
+
+    return tuple((name, None if sub is None else _key(sub)) for name, sub in selection.items())
+
+
+USER = Fieldset(schemas.User, {
+    "id": "u.id",
+    "username": "u.username",
+    "email": "u.email",
+    "role_id": "u.role_id",
+    "registration_date_time": "u.registration_date_time",
+    "photo_url": "u.photo_url",
+})
+
+# Вложенные объекты в оценках, записях и расписании
+STUDENT = Fieldset(schemas.Student, {
+    "id": "s.id",
+    "user_id": "s.user_id",
+    "first_name": "s.first_name",
+    "last_name": "s.last_name",
+    "group_number": "s.group_number",
+})
+
+TEACHER = Fieldset(schemas.Teacher, {
+    "id": "t.id",
+    "user_id": "t.user_id",
+    "first_name": "t.first_name",
+    "last_name": "t.last_name",
+    "qualification": "t.qualification",
+    "bio": "t.bio",
+})
+
+# duration хранится как interval, в ответе - число дней
+COURSE = Fieldset(schemas.Course, {
+    "id": "c.id",
+    "title": "c.title",
+    "description": "c.description",
+    "duration": "EXTRACT(DAY FROM c.duration)::int",
+    "teacher_id": "c.teacher_id",
+})
+
+# В списках студентов и преподавателей user_id берется из users: так же
+# работают и схемы, где id студента совпадает с id пользователя
+STUDENTS = Fieldset(schemas.StudentWithUser, {**STUDENT.columns, "user_id": "u.id"}, {"user": USER})
+TEACHERS = Fieldset(schemas.TeacherWithUser, {**TEACHER.columns, "user_id": "u.id"}, {"user": USER})
+COURSES = Fieldset(schemas.CourseWithTeacher, COURSE.columns, {"teacher": TEACHER})
+
+GRADES = Fieldset(schemas.GradeWithDetails, {
+    "id": "g.id",
+    "student_id": "g.student_id",
+    "course_id": "g.course_id",
+    "assignment_title": "g.assignment_title",
+    "grade_value": "g.grade_value",
+    "submission_date": "g.submission_date",
+}, {"student": STUDENT, "course": COURSE})
+
+ENROLLMENTS = Fieldset(schemas.EnrollmentWithDetails, {
+    "student_id": "sce.student_id",
+    "course_id": "sce.course_id",
+    "enrollment_date": "sce.enrollment_date",
+    "grade": "sce.grade",
+}, {"student": STUDENT, "course": COURSE})
+
+SCHEDULE = Fieldset(schemas.ScheduleWithCourse, {
+    "id": "s.id",
+    "course_id": "s.course_id",
+    "start_date_time": "s.start_date_time",
+    "end_date_time": "s.end_date_time",
+}, {"course": COURSE})
@@ -0,0 +1,113 @@
+from typing import Any, List, Optional
+import asyncpg
+
+PERCENTILES = (("p10", 0.1), ("p25", 0.25), ("median", 0.5), ("p75", 0.75), ("p90", 0.9))
+
+DEFAULT_BINS = 10
+MAX_BINS = 100
+
+# Вся статистика считается в базе за один проход по столбцу оценок:
+# в приложение приходит одна строка, а не 100k+ значений.
+# {where} - условие на courses.grades g, {scope} - на сводку gs (для z-оценок).
+_DISTRIBUTION_SQL = """
+WITH g AS MATERIALIZED (
+    SELECT g.grade_value::float8 AS v
+    FROM courses.grades g
+    WHERE {where}
+),
+s AS (
+    SELECT
+        COUNT(*) AS grades_count,
+        AVG(v) AS mean,
+        STDDEV_POP(v) AS std,
+        MIN(v) AS min_grade,
+        MAX(v) AS max_grade,
+        percentile_cont($2::float8[]) WITHIN GROUP (ORDER BY v) AS percentiles
+    FROM g
+)
+SELECT
+    s.*,
+    ARRAY(
+        SELECT COUNT(g.v)
+        FROM generate_series(1, $3::int) b
+        LEFT JOIN g ON b = CASE
+            WHEN s.max_grade > s.min_grade THEN LEAST(width_bucket(g.v, s.min_grade, s.max_grade, $3::int), $3::int)
+            ELSE 1
+        END
+        GROUP BY b
+        ORDER BY b
+    ) AS histogram
+FROM s
+"""
+
+_STUDENTS_SQL = """
+SELECT
+    st.id as student_id,
+    CONCAT(st.first_name, ' ', st.last_name) as student_name,
+    st.group_number,
+    SUM(gs.grades_count)::bigint as grades_count,
+    SUM(gs.grades_sum) / NULLIF(SUM(gs.grades_count), 0) as average_grade
+FROM courses.course_student_grade_stats gs
+JOIN courses.students st ON gs.student_id = st.id
+WHERE {scope} AND gs.grades_count > 0
+GROUP BY st.id
+ORDER BY average_grade DESC, st.id
+"""
+
+
+async def distribution(
+        conn: asyncpg.Connection,
+        where: str,
+        scope: str,
+        key: Any,
+        bins: int = DEFAULT_BINS
+) -> dict:
+    """Гистограмма, процентили, стандартное отклонение и z-оценки студентов.
+
+    where и scope используют единственный параметр $1 = key.
+    z-оценка студента - отклонение его среднего от среднего по всем
+    оценкам выборки в единицах стандартного отклонения.
+    """
+
+    stats = await conn.fetchrow(_DISTRIBUTION_SQL.format(where=where), key, [p for _, p in PERCENTILES], bins)
+    students = await conn.fetch(_STUDENTS_SQL.format(scope=scope), key)
+
+    mean = stats['mean']
+    std = stats['std']
+    histogram: List[dict] = []
+    if stats['grades_count']:
+        low, high = stats['min_grade'], stats['max_grade']
+        width = (high - low) / bins
+        for index, count in enumerate(stats['histogram']):
+            histogram.append({
+                "from": low + index * width,
+                "to": high if index == bins - 1 else low + (index + 1) * width,
+                "count": count
+            })
+
+    return {
+        "grades_count": stats['grades_count'],
+        "mean": mean,
+        "std": std,
+        "min_grade": stats['min_grade'],
+        "max_grade": stats['max_grade'],
+        "percentiles": {
+            name: value
+            for (name, _), value in zip(PERCENTILES, stats['percentiles'] or [None] * len(PERCENTILES))
+        },
+        "histogram": histogram,
+        "students": [
+            {
+                **dict(row),
+                "average_grade": float(row['average_grade']),
+                "z_score": _z_score(float(row['average_grade']), mean, std)
+            }
+            for row in students
+        ]
+    }
+
+
+def _z_score(value: float, mean: Optional[float], std: Optional[float]) -> Optional[float]:
+    if mean is None or not std:
+        return None
+    return (value - mean) / std
@@ -0,0 +1,165 @@
+import csv
+import io
+import json
+import os
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, List, Tuple
+import asyncpg
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+from dotenv import load_dotenv
+import grade_stats
+import schemas
+
+load_dotenv()
+
+# Сколько оценок принимается за один запрос
+GRADES_IMPORT_LIMIT = int(os.getenv("GRADES_IMPORT_LIMIT", "50000"))
+
+COLUMNS = ("student_id", "course_id", "assignment_title", "grade_value", "submission_date")
+
+# grade_value в таблице - numeric(4,2): значение вне диапазона сорвало бы весь COPY
+_GRADE_STEP = Decimal("0.01")
+_GRADE_LIMIT = Decimal("100")
+
+# Проверка сразу всех пар (студент, курс) одним запросом: возвращаются
+# только пары с проблемами, поэтому на корректной загрузке ответ пустой
+_CHECK_PAIRS_SQL = """
+SELECT
+    p.student_id,
+    p.course_id,
+    s.id IS NOT NULL AS student_exists,
+    c.id IS NOT NULL AS course_exists,
+    e.enrolled
+FROM unnest($1::int[], $2::int[]) AS p(student_id, course_id)
+LEFT JOIN courses.students s ON s.id = p.student_id
+LEFT JOIN courses.courses c ON c.id = p.course_id
+CROSS JOIN LATERAL (
+    SELECT EXISTS(
+        SELECT 1 FROM courses.student_course_enrollment sce
+        WHERE sce.student_id = p.student_id AND sce.course_id = p.course_id
+    ) AS enrolled
+) e
+WHERE s.id IS NULL OR c.id IS NULL OR NOT e.enrolled
+"""
+
+
+def parse_body(body: bytes, content_type: str) -> List[Any]:
+    """Строки загрузки из тела запроса: JSON-массив объектов или CSV с заголовком.
+
+    В CSV заголовок - имена полей (student_id,course_id,assignment_title,
+    grade_value,submission_date), разделитель - запятая, точка с запятой или табуляция.
+    """
+
+    if "csv" in content_type:
+        try:
+            text = body.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="CSV должен быть в кодировке UTF-8")
+        header = text.split("\n", 1)[0]
+        try:
+            dialect = csv.Sniffer().sniff(header, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        items = list(csv.DictReader(io.StringIO(text), dialect=dialect))
+    else:
+        try:
+            items = json.loads(body)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Тело запроса - не JSON")
+        if isinstance(items, dict):
+            items = items.get("grades")
+        if not isinstance(items, list):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Ожидается массив оценок или объект {\"grades\": [...]}"
+            )
+
+    if len(items) > GRADES_IMPORT_LIMIT:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Не больше {GRADES_IMPORT_LIMIT} оценок за запрос"
+        )
+    return items
+
+
+def validate_rows(items: List[Any]) -> Tuple[List[Tuple[int, tuple]], Dict[int, List[str]]]:
+    """Проверка формата каждой строки.
+
+    Возвращает (номер строки, запись для COPY) для корректных строк
+    и ошибки по номерам строк (с 1, без заголовка CSV).
+    """
+
+    records: List[Tuple[int, tuple]] = []
+    errors: Dict[int, List[str]] = {}
+
+    for number, item in enumerate(items, start=1):
+        if not isinstance(item, dict):
+            errors[number] = ["Строка должна быть объектом"]
+            continue
+        try:
+            grade = schemas.GradeCreate.model_validate(item)
+        except ValidationError as e:
+            errors[number] = [f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()]
+            continue
+
+        try:
+            value = Decimal(str(grade.grade_value)).quantize(_GRADE_STEP)
+        except InvalidOperation:
+            value = None
+        if value is None or not value.is_finite() or abs(value) >= _GRADE_LIMIT:
+            errors[number] = [f"grade_value: должно быть меньше {_GRADE_LIMIT} по модулю"]
+            continue
+
+        records.append((number, (grade.student_id, grade.course_id, grade.assignment_title, value, grade.submission_date)))
+
+    return records, errors
+
+
+async def check_references(conn: asyncpg.Connection, records: List[Tuple[int, tuple]], errors: Dict[int, List[str]]) -> List[Tuple[int, tuple]]:
+    """Существование студентов, курсов и запись на курс - один запрос на всю загрузку"""
+
+    pairs = list(dict.fromkeys((record[0], record[1]) for _, record in records))
+    if not pairs:
+        return records
+
+    problems: Dict[Tuple[int, int], List[str]] = {}
+    for row in await conn.fetch(_CHECK_PAIRS_SQL, [p[0] for p in pairs], [p[1] for p in pairs]):
+        messages = []
+        if not row["student_exists"]:
+            messages.append(f"Студент {row['student_id']} не существует")
+        if not row["course_exists"]:
+            messages.append(f"Курс {row['course_id']} не существует")
+        if row["student_exists"] and row["course_exists"] and not row["enrolled"]:
+            messages.append(f"Студент {row['student_id']} не записан на курс {row['course_id']}")
+        problems[(row["student_id"], row["course_id"])] = messages
+
+    valid = []
+    for number, record in records:
+        messages = problems.get((record[0], record[1]))
+        if messages:
+            errors[number] = messages
+        else:
+            valid.append((number, record))
+    return valid
+
+
+async def load(conn: asyncpg.Connection, records: List[tuple]):
+    """Запись оценок бинарным COPY и обновление сводок. Вызывать в транзакции."""
+
+    await conn.copy_records_to_table("grades", schema_name="courses", columns=COLUMNS, records=records)
+    await grade_stats.grades_added(
+        conn,
+        [record[0] for record in records],
+        [record[1] for record in records],
+        [record[3] for record in records]
+    )
+
+
+def report(total: int, inserted: int, errors: Dict[int, List[str]]) -> dict:
+    return {
+        "total": total,
+        "inserted": inserted,
+        "rejected": len(errors),
+        "errors": [{"row": number, "errors": errors[number]} for number in sorted(errors)]
+    }
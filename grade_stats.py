@@ -0,0 +1,496 @@
+import asyncio
+import sys
+from decimal import Decimal
+from typing import List, Optional
+import asyncpg
+
+# Сводные таблицы оценок: по паре (курс, студент) и по курсу целиком.
+# Сводка курса учитывает только студентов, записанных на курс,
+# так же как и отчеты, которые строятся от student_course_enrollment.
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS courses.course_student_grade_stats (
+    course_id INTEGER NOT NULL,
+    student_id INTEGER NOT NULL,
+    grades_count INTEGER NOT NULL DEFAULT 0,
+    grades_sum NUMERIC NOT NULL DEFAULT 0,
+    min_grade NUMERIC,
+    max_grade NUMERIC,
+    PRIMARY KEY (course_id, student_id)
+);
+
+CREATE TABLE IF NOT EXISTS courses.course_grade_stats (
+    course_id INTEGER PRIMARY KEY,
+    students_count INTEGER NOT NULL DEFAULT 0,
+    grades_count INTEGER NOT NULL DEFAULT 0,
+    grades_sum NUMERIC NOT NULL DEFAULT 0,
+    min_grade NUMERIC,
+    max_grade NUMERIC
+);
+"""
+
+_REBUILD_STUDENT_STATS_SQL = """
+INSERT INTO courses.course_student_grade_stats
+    (course_id, student_id, grades_count, grades_sum, min_grade, max_grade)
+SELECT course_id, student_id, COUNT(*),
+       SUM(grade_value::numeric), MIN(grade_value::numeric), MAX(grade_value::numeric)
+FROM courses.grades
+{where}
+GROUP BY course_id, student_id
+"""
+
+_REBUILD_COURSE_STATS_SQL = """
+INSERT INTO courses.course_grade_stats
+    (course_id, students_count, grades_count, grades_sum, min_grade, max_grade)
+SELECT
+    sce.course_id,
+    COUNT(*),
+    COALESCE(SUM(cs.grades_count), 0),
+    COALESCE(SUM(cs.grades_sum), 0),
+    MIN(cs.min_grade),
+    MAX(cs.max_grade)
+FROM courses.student_course_enrollment sce
+LEFT JOIN courses.course_student_grade_stats cs
+    ON cs.course_id = sce.course_id AND cs.student_id = sce.student_id
+{where}
+GROUP BY sce.course_id
+"""
+
+
+def _numeric(value) -> Decimal:
+    """Значение оценки в NUMERIC без артефактов двоичного float"""
+
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+async def ensure_schema(conn: asyncpg.Connection) -> bool:
+    """Создать сводные таблицы, если их нет. Новые таблицы сразу заполняются."""
+
+    exists = await conn.fetchval("SELECT to_regclass('courses.course_grade_stats') IS NOT NULL")
+    if exists:
+        return False
+
+    async with conn.transaction():
+        await conn.execute(SCHEMA_SQL)
+        await rebuild(conn)
+    return True
+
+
+async def rebuild(conn: asyncpg.Connection, course_id: Optional[int] = None):
+    """Пересчитать сводные таблицы с нуля (все курсы или один курс)"""
+
+    async with conn.transaction():
+        if course_id is None:
+            await conn.execute("DELETE FROM courses.course_student_grade_stats")
+            await conn.execute("DELETE FROM courses.course_grade_stats")
+            await conn.execute(_REBUILD_STUDENT_STATS_SQL.format(where=""))
+            await conn.execute(_REBUILD_COURSE_STATS_SQL.format(where=""))
+        else:
+            await conn.execute("DELETE FROM courses.course_student_grade_stats WHERE course_id = $1", course_id)
+            await conn.execute("DELETE FROM courses.course_grade_stats WHERE course_id = $1", course_id)
+            await conn.execute(_REBUILD_STUDENT_STATS_SQL.format(where="WHERE course_id = $1"), course_id)
+            await conn.execute(_REBUILD_COURSE_STATS_SQL.format(where="WHERE sce.course_id = $1"), course_id)
+
+
+async def check(conn: asyncpg.Connection) -> List[dict]:
+    """Сравнить сводные таблицы с исходными данными, вернуть расхождения"""
+
+    student_rows = await conn.fetch(
+        """
+        WITH actual AS (
+            SELECT course_id, student_id, COUNT(*) AS grades_count, SUM(grade_value::numeric) AS grades_sum,
+                   MIN(grade_value::numeric) AS min_grade, MAX(grade_value::numeric) AS max_grade
+            FROM courses.grades
+            GROUP BY course_id, student_id
+        ),
+        stored AS (
+            SELECT * FROM courses.course_student_grade_stats WHERE grades_count > 0
+        )
+        SELECT
+            COALESCE(a.course_id, s.course_id) AS course_id,
+            COALESCE(a.student_id, s.student_id) AS student_id,
+            a.grades_count AS actual_count, s.grades_count AS stored_count,
+            a.grades_sum AS actual_sum, s.grades_sum AS stored_sum,
+            a.min_grade AS actual_min, s.min_grade AS stored_min,
+            a.max_grade AS actual_max, s.max_grade AS stored_max
+        FROM actual a
+        FULL JOIN stored s ON a.course_id = s.course_id AND a.student_id = s.student_id
+        WHERE a.grades_count IS DISTINCT FROM s.grades_count
+           OR a.grades_sum IS DISTINCT FROM s.grades_sum
+           OR a.min_grade IS DISTINCT FROM s.min_grade
+           OR a.max_grade IS DISTINCT FROM s.max_grade
+        """
+    )
+
+    course_rows = await conn.fetch(
+        """
+        WITH actual AS (
+            SELECT sce.course_id, COUNT(DISTINCT sce.student_id) AS students_count,
+                   COUNT(g.id) AS grades_count, COALESCE(SUM(g.grade_value::numeric), 0) AS grades_sum,
+                   MIN(g.grade_value::numeric) AS min_grade, MAX(g.grade_value::numeric) AS max_grade
+            FROM courses.student_course_enrollment sce
+            LEFT JOIN courses.grades g ON g.student_id = sce.student_id AND g.course_id = sce.course_id
+            GROUP BY sce.course_id
+        ),
+        stored AS (
+            SELECT * FROM courses.course_grade_stats WHERE students_count > 0
+        )
+        SELECT
+            COALESCE(a.course_id, s.course_id) AS course_id,
+            a.students_count AS actual_students, s.students_count AS stored_students,
+            a.grades_count AS actual_count, s.grades_count AS stored_count,
+            a.grades_sum AS actual_sum, s.grades_sum AS stored_sum,
+            a.min_grade AS actual_min, s.min_grade AS stored_min,
+            a.max_grade AS actual_max, s.max_grade AS stored_max
+        FROM actual a
+        FULL JOIN stored s ON a.course_id = s.course_id
+        WHERE a.students_count IS DISTINCT FROM s.students_count
+           OR a.grades_count IS DISTINCT FROM s.grades_count
+           OR a.grades_sum IS DISTINCT FROM s.grades_sum
+           OR a.min_grade IS DISTINCT FROM s.min_grade
+           OR a.max_grade IS DISTINCT FROM s.max_grade
+        """
+    )
+
+    mismatches = [{"level": "student", **dict(row)} for row in student_rows]
+    mismatches += [{"level": "course", **dict(row)} for row in course_rows]
+    return mismatches
+
+
+async def grade_added(conn: asyncpg.Connection, student_id: int, course_id: int, value: float):
+    """Учесть новую оценку в сводках. Вызывать в транзакции записи оценки."""
+
+    await conn.execute(
+        """
+        INSERT INTO courses.course_student_grade_stats AS cs
+            (course_id, student_id, grades_count, grades_sum, min_grade, max_grade)
+        VALUES ($1, $2, 1, $3, $3, $3)
+        ON CONFLICT (course_id, student_id) DO UPDATE SET
+            grades_count = cs.grades_count + 1,
+            grades_sum = cs.grades_sum + EXCLUDED.grades_sum,
+            min_grade = LEAST(cs.min_grade, EXCLUDED.min_grade),
+            max_grade = GREATEST(cs.max_grade, EXCLUDED.max_grade)
+        """,
+        course_id, student_id, _numeric(value)
+    )
+
+    await conn.execute(
+        """
+        UPDATE courses.course_grade_stats
+        SET grades_count = grades_count + 1,
+            grades_sum = grades_sum + $3,
+            min_grade = LEAST(min_grade, $3),
+            max_grade = GREATEST(max_grade, $3)
+        WHERE course_id = $1
+          AND EXISTS(
+              SELECT 1 FROM courses.student_course_enrollment
+              WHERE course_id = $1 AND student_id = $2
+          )
+        """,
+        course_id, student_id, _numeric(value)
+    )
+
+
+# Обновление сводок частью того же оператора, что и запись: CTE added -
+# новые оценки (student_id, course_id, grade_value). Сводка курса учитывает
+# только записанных на курс студентов, как и в grade_added.
+_GRADES_ADDED_CTES = """
+student_stats AS (
+    INSERT INTO courses.course_student_grade_stats AS cs
+        (course_id, student_id, grades_count, grades_sum, min_grade, max_grade)
+    SELECT course_id, student_id, COUNT(*), SUM(grade_value::numeric),
+           MIN(grade_value::numeric), MAX(grade_value::numeric)
+    FROM added
+    GROUP BY course_id, student_id
+    ON CONFLICT (course_id, student_id) DO UPDATE SET
+        grades_count = cs.grades_count + EXCLUDED.grades_count,
+        grades_sum = cs.grades_sum + EXCLUDED.grades_sum,
+        min_grade = LEAST(cs.min_grade, EXCLUDED.min_grade),
+        max_grade = GREATEST(cs.max_grade, EXCLUDED.max_grade)
+),
+course_stats AS (
+    UPDATE courses.course_grade_stats t
+    SET grades_count = t.grades_count + new.grades_count,
+        grades_sum = t.grades_sum + new.grades_sum,
+        min_grade = LEAST(t.min_grade, new.min_grade),
+        max_grade = GREATEST(t.max_grade, new.max_grade)
+    FROM (
+        SELECT a.course_id, COUNT(*) AS grades_count, SUM(a.grade_value::numeric) AS grades_sum,
+               MIN(a.grade_value::numeric) AS min_grade, MAX(a.grade_value::numeric) AS max_grade
+        FROM added a
+        WHERE EXISTS(
+            SELECT 1 FROM courses.student_course_enrollment sce
+            WHERE sce.course_id = a.course_id AND sce.student_id = a.student_id
+        )
+        GROUP BY a.course_id
+    ) new
+    WHERE t.course_id = new.course_id
+)
+"""
+
+# То же для новых записей на курсы: CTE enrolled - пары (student_id, course_id)
+_STUDENTS_ENROLLED_CTES = """
+course_stats AS (
+    INSERT INTO courses.course_grade_stats AS t
+        (course_id, students_count, grades_count, grades_sum, min_grade, max_grade)
+    SELECT e.course_id, COUNT(*), COALESCE(SUM(cs.grades_count), 0), COALESCE(SUM(cs.grades_sum), 0),
+           MIN(cs.min_grade), MAX(cs.max_grade)
+    FROM enrolled e
+    LEFT JOIN courses.course_student_grade_stats cs
+        ON cs.course_id = e.course_id AND cs.student_id = e.student_id
+    GROUP BY e.course_id
+    ON CONFLICT (course_id) DO UPDATE SET
+        students_count = t.students_count + EXCLUDED.students_count,
+        grades_count = t.grades_count + EXCLUDED.grades_count,
+        grades_sum = t.grades_sum + EXCLUDED.grades_sum,
+        min_grade = LEAST(t.min_grade, EXCLUDED.min_grade),
+        max_grade = GREATEST(t.max_grade, EXCLUDED.max_grade)
+)
+"""
+
+
+def with_grades_added(insert_sql: str) -> str:
+    """Запись оценок и обновление сводок одним оператором.
+
+    insert_sql - INSERT ... RETURNING (или SELECT) с колонками student_id,
+    course_id, grade_value; результат запроса - его строки.
+    """
+
+    return f"WITH added AS ({insert_sql}),{_GRADES_ADDED_CTES}SELECT * FROM added"
+
+
+def with_students_enrolled(insert_sql: str) -> str:
+    """Запись на курсы и обновление сводок курсов одним оператором.
+
+    insert_sql - INSERT ... RETURNING (или SELECT) с колонками student_id, course_id.
+    """
+
+    return f"WITH enrolled AS ({insert_sql}),{_STUDENTS_ENROLLED_CTES}SELECT * FROM enrolled"
+
+
+# Изменение значения одной оценки: CTE changed - строка UPDATE ... RETURNING
+# с id, student_id, course_id, grade_value и old_grade_value. Все части
+# оператора видят данные до изменения, поэтому минимум и максимум
+# пересчитываются по остальным оценкам пары (остальным студентам курса)
+# плюс новое значение.
+_GRADE_CHANGED_CTES = """
+pair AS (
+    SELECT ch.student_id, ch.course_id,
+           ch.grade_value::numeric - ch.old_grade_value::numeric AS delta,
+           LEAST(ch.grade_value::numeric, other.min_grade) AS min_grade,
+           GREATEST(ch.grade_value::numeric, other.max_grade) AS max_grade
+    FROM changed ch
+    CROSS JOIN LATERAL (
+        SELECT MIN(g.grade_value::numeric) AS min_grade, MAX(g.grade_value::numeric) AS max_grade
+        FROM courses.grades g
+        WHERE g.course_id = ch.course_id AND g.student_id = ch.student_id AND g.id <> ch.id
+    ) other
+),
+student_stats AS (
+    UPDATE courses.course_student_grade_stats cs
+    SET grades_sum = cs.grades_sum + p.delta,
+        min_grade = p.min_grade,
+        max_grade = p.max_grade
+    FROM pair p
+    WHERE cs.course_id = p.course_id AND cs.student_id = p.student_id
+),
+course_stats AS (
+    UPDATE courses.course_grade_stats t
+    SET grades_sum = t.grades_sum + p.delta,
+        min_grade = LEAST(p.min_grade, other.min_grade),
+        max_grade = GREATEST(p.max_grade, other.max_grade)
+    FROM pair p
+    CROSS JOIN LATERAL (
+        SELECT MIN(cs.min_grade) AS min_grade, MAX(cs.max_grade) AS max_grade
+        FROM courses.course_student_grade_stats cs
+        JOIN courses.student_course_enrollment sce
+            ON sce.course_id = cs.course_id AND sce.student_id = cs.student_id
+        WHERE cs.course_id = p.course_id AND cs.student_id <> p.student_id
+    ) other
+    WHERE t.course_id = p.course_id
+      AND EXISTS(
+          SELECT 1 FROM courses.student_course_enrollment sce
+          WHERE sce.course_id = p.course_id AND sce.student_id = p.student_id
+      )
+)
+"""
+
+
+def with_grade_changed(update_sql: str) -> str:
+    """Изменение одной оценки и пересчет сводок одним оператором.
+
+    update_sql - UPDATE ... RETURNING с колонками id, student_id, course_id,
+    grade_value и old_grade_value (значение до изменения).
+    """
+
+    return f"WITH changed AS ({update_sql}),{_GRADE_CHANGED_CTES}SELECT * FROM changed"
+
+
+async def grades_added(conn: asyncpg.Connection, student_ids: List[int], course_ids: List[int], values: List[Decimal]):
+    """Учесть пачку новых оценок в сводках одним запросом, а не двумя на оценку"""
+
+    await conn.execute(
+        with_grades_added(
+            "SELECT * FROM unnest($1::int[], $2::int[], $3::numeric[]) AS new(student_id, course_id, grade_value)"
+        ),
+        student_ids, course_ids, [_numeric(value) for value in values]
+    )
+
+
+async def grade_removed(conn: asyncpg.Connection, student_id: int, course_id: int, value: float):
+    """Убрать оценку из сводок. Вызывать после удаления строки, в той же транзакции.
+
+    Минимум и максимум пересчитываются только если удаленное значение было граничным.
+    """
+
+    await conn.execute(
+        """
+        UPDATE courses.course_student_grade_stats
+        SET grades_count = grades_count - 1,
+            grades_sum = grades_sum - $3,
+            min_grade = CASE WHEN $3 > min_grade THEN min_grade ELSE (
+                SELECT MIN(grade_value::numeric) FROM courses.grades WHERE course_id = $1 AND student_id = $2
+            ) END,
+            max_grade = CASE WHEN $3 < max_grade THEN max_grade ELSE (
+                SELECT MAX(grade_value::numeric) FROM courses.grades WHERE course_id = $1 AND student_id = $2
+            ) END
+        WHERE course_id = $1 AND student_id = $2
+        """,
+        course_id, student_id, _numeric(value)
+    )
+
+    await conn.execute(
+        """
+        UPDATE courses.course_grade_stats
+        SET grades_count = grades_count - 1,
+            grades_sum = grades_sum - $3,
+            min_grade = CASE WHEN $3 > min_grade THEN min_grade ELSE (
+                SELECT MIN(cs.min_grade)
+                FROM courses.course_student_grade_stats cs
+                JOIN courses.student_course_enrollment sce
+                    ON sce.course_id = cs.course_id AND sce.student_id = cs.student_id
+                WHERE cs.course_id = $1
+            ) END,
+            max_grade = CASE WHEN $3 < max_grade THEN max_grade ELSE (
+                SELECT MAX(cs.max_grade)
+                FROM courses.course_student_grade_stats cs
+                JOIN courses.student_course_enrollment sce
+                    ON sce.course_id = cs.course_id AND sce.student_id = cs.student_id
+                WHERE cs.course_id = $1
+            ) END
+        WHERE course_id = $1
+          AND EXISTS(
+              SELECT 1 FROM courses.student_course_enrollment
+              WHERE course_id = $1 AND student_id = $2
+          )
+        """,
+        course_id, student_id, _numeric(value)
+    )
+
+
+async def grade_changed(conn: asyncpg.Connection, student_id: int, course_id: int, old_value: float, new_value: float):
+    """Учесть изменение значения оценки"""
+
+    if old_value == new_value:
+        return
+    await grade_removed(conn, student_id, course_id, old_value)
+    await grade_added(conn, student_id, course_id, new_value)
+
+
+async def student_enrolled(conn: asyncpg.Connection, student_id: int, course_id: int):
+    """Добавить уже имеющиеся оценки студента в сводку курса"""
+
+    await conn.execute(
+        """
+        INSERT INTO courses.course_grade_stats AS t
+            (course_id, students_count, grades_count, grades_sum, min_grade, max_grade)
+        SELECT $1, 1, COALESCE(cs.grades_count, 0), COALESCE(cs.grades_sum, 0), cs.min_grade, cs.max_grade
+        FROM (SELECT 1) AS one
+        LEFT JOIN courses.course_student_grade_stats cs ON cs.course_id = $1 AND cs.student_id = $2
+        ON CONFLICT (course_id) DO UPDATE SET
+            students_count = t.students_count + 1,
+            grades_count = t.grades_count + EXCLUDED.grades_count,
+            grades_sum = t.grades_sum + EXCLUDED.grades_sum,
+            min_grade = LEAST(t.min_grade, EXCLUDED.min_grade),
+            max_grade = GREATEST(t.max_grade, EXCLUDED.max_grade)
+        """,
+        course_id, student_id
+    )
+
+
+async def students_enrolled(conn: asyncpg.Connection, student_ids: List[int], course_ids: List[int]):
+    """То же для пачки новых записей (пары student_ids[i], course_ids[i]) одним запросом"""
+
+    await conn.execute(
+        with_students_enrolled("SELECT * FROM unnest($1::int[], $2::int[]) AS new(student_id, course_id)"),
+        student_ids, course_ids
+    )
+
+
+async def student_unenrolled(conn: asyncpg.Connection, course_id: int):
+    """Пересчитать сводку курса после отписки студента (O(студентов курса))"""
+
+    await conn.execute(
+        """
+        UPDATE courses.course_grade_stats t
+        SET students_count = a.students_count,
+            grades_count = a.grades_count,
+            grades_sum = a.grades_sum,
+            min_grade = a.min_grade,
+            max_grade = a.max_grade
+        FROM (
+            SELECT
+                COUNT(*) AS students_count,
+                COALESCE(SUM(cs.grades_count), 0) AS grades_count,
+                COALESCE(SUM(cs.grades_sum), 0) AS grades_sum,
+                MIN(cs.min_grade) AS min_grade,
+                MAX(cs.max_grade) AS max_grade
+            FROM courses.student_course_enrollment sce
+            LEFT JOIN courses.course_student_grade_stats cs
+                ON cs.course_id = sce.course_id AND cs.student_id = sce.student_id
+            WHERE sce.course_id = $1
+        ) a
+        WHERE t.course_id = $1
+        """,
+        course_id
+    )
+
+
+async def student_deleted(conn: asyncpg.Connection, student_id: int, course_ids: List[int]):
+    """Убрать удаленного студента из сводок курсов, на которые он был записан"""
+
+    await conn.execute("DELETE FROM courses.course_student_grade_stats WHERE student_id = $1", student_id)
+    for course_id in course_ids:
+        await student_unenrolled(conn, course_id)
+
+
+async def _main(argv: List[str]) -> int:
+    from database import init_pool, close_pool
+
+    if not argv or argv[0] not in ("rebuild", "check"):
+        print("Использование: python grade_stats.py rebuild [course_id] | check")
+        return 2
+
+    pool = await init_pool()
+    try:
+        async with pool.acquire() as conn:
+            created = await ensure_schema(conn)
+            if argv[0] == "rebuild":
+                if not created:
+                    await rebuild(conn, int(argv[1]) if len(argv) > 1 else None)
+                print("Сводные таблицы оценок пересчитаны")
+                return 0
+
+            mismatches = await check(conn)
+            for m in mismatches:
+                print(m)
+            if mismatches:
+                print(f"Найдено расхождений: {len(mismatches)}")
+                return 1
+            print("Сводные таблицы оценок согласованы")
+            return 0
+    finally:
+        await close_pool()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
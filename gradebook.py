@@ -0,0 +1,179 @@
+import asyncio
+import json
+import os
+import tempfile
+from decimal import Decimal
+from typing import Any, AsyncIterator, List
+import asyncpg
+from fastapi import HTTPException, status
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from csv_export import CHUNK_ROWS, CURSOR_PREFETCH, csv_stream_response, iter_csv_rows
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+FORMATS = ("json", "csv", "xlsx")
+
+# Колонки-задания в порядке первой сдачи
+_ASSIGNMENTS_SQL = """
+SELECT assignment_title
+FROM courses.grades
+WHERE course_id = $1
+GROUP BY assignment_title
+ORDER BY MIN(submission_date), assignment_title
+"""
+
+# Одна строка на зачисленного студента; при повторной сдаче задания
+# в массивах остаются обе оценки, и при раскладке по колонкам побеждает последняя
+_ROWS_SQL = """
+SELECT
+    s.id as student_id,
+    s.last_name,
+    s.first_name,
+    s.group_number,
+    sce.grade as final_grade,
+    array_agg(g.assignment_title ORDER BY g.submission_date, g.id) FILTER (WHERE g.id IS NOT NULL) as titles,
+    array_agg(g.grade_value ORDER BY g.submission_date, g.id) FILTER (WHERE g.id IS NOT NULL) as grade_values
+FROM courses.student_course_enrollment sce
+JOIN courses.students s ON sce.student_id = s.id
+LEFT JOIN courses.grades g ON g.course_id = sce.course_id AND g.student_id = sce.student_id
+WHERE sce.course_id = $1
+GROUP BY s.id, sce.grade
+ORDER BY s.last_name, s.first_name, s.id
+"""
+
+_STUDENT_HEADERS = ["ID", "Фамилия", "Имя", "Группа"]
+_FINAL_HEADER = "Итоговая оценка"
+
+
+def _cell(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+async def iter_gradebook(pool: asyncpg.Pool, course_id: int) -> AsyncIterator[List[Any]]:
+    """Первым элементом отдает список заданий, затем строки ведомости:
+    [id, фамилия, имя, группа, оценки по заданиям..., итоговая оценка].
+
+    Строки читаются курсором и раскладываются по колонкам по одной,
+    так что память зависит от числа заданий, но не от числа студентов.
+    """
+
+    async with pool.acquire() as conn:
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            assignments = [row['assignment_title'] for row in await conn.fetch(_ASSIGNMENTS_SQL, course_id)]
+            yield assignments
+
+            column = {title: index for index, title in enumerate(assignments)}
+            async for record in conn.cursor(_ROWS_SQL, course_id, prefetch=CURSOR_PREFETCH):
+                grades = [None] * len(assignments)
+                for title, value in zip(record['titles'] or (), record['grade_values'] or ()):
+                    grades[column[title]] = _cell(value)
+                yield [
+                    record['student_id'], record['last_name'], record['first_name'], record['group_number'],
+                    *grades, _cell(record['final_grade'])
+                ]
+
+
+async def _iter_json(pool: asyncpg.Pool, course_id: int, course_title: str) -> AsyncIterator[bytes]:
+    rows = iter_gradebook(pool, course_id)
+    assignments = await anext(rows)
+    head = {"course_id": course_id, "course_title": course_title, "assignments": assignments}
+    # Открываем объект и массив students, строки дописываем по мере чтения
+    yield (json.dumps(head, ensure_ascii=False)[:-1] + ', "students": [').encode("utf-8")
+
+    count = len(assignments)
+    parts = []
+    # Разделитель ставится перед каждой пачкой, кроме первой: после
+    # последней строки сразу закрывается массив
+    separator = ""
+    async for row in rows:
+        student = {
+            "student_id": row[0],
+            "last_name": row[1],
+            "first_name": row[2],
+            "group_number": row[3],
+            "grades": row[4:4 + count],
+            "final_grade": row[-1]
+        }
+        parts.append(json.dumps(student, ensure_ascii=False, default=str))
+        if len(parts) >= CHUNK_ROWS:
+            yield (separator + ",".join(parts)).encode("utf-8")
+            separator = ","
+            parts = []
+
+    tail = separator + ",".join(parts) if parts else ""
+    yield (tail + "]}").encode("utf-8")
+
+
+async def _iter_csv(pool: asyncpg.Pool, course_id: int) -> AsyncIterator[bytes]:
+    rows = iter_gradebook(pool, course_id)
+    assignments = await anext(rows)
+    async for chunk in iter_csv_rows(_STUDENT_HEADERS + assignments + [_FINAL_HEADER], rows):
+        yield chunk
+
+
+async def _write_xlsx(pool: asyncpg.Pool, course_id: int, path: str):
+    # write_only: строки сразу уходят во временный XML, а не держатся в памяти
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Ведомость")
+
+    rows = iter_gradebook(pool, course_id)
+    assignments = await anext(rows)
+    sheet.append(_STUDENT_HEADERS + assignments + [_FINAL_HEADER])
+
+    batch = []
+    async for row in rows:
+        batch.append(row)
+        if len(batch) >= CHUNK_ROWS:
+            await asyncio.to_thread(_append_rows, sheet, batch)
+            batch = []
+    await asyncio.to_thread(_append_rows, sheet, batch)
+    await asyncio.to_thread(workbook.save, path)
+
+
+def _append_rows(sheet, rows: List[List[Any]]):
+    for row in rows:
+        sheet.append(row)
+
+
+async def export(pool: asyncpg.Pool, course_id: int, course_title: str, fmt: str):
+    """Ведомость курса: студенты x задания.
+
+    JSON и CSV стримятся по мере чтения курсора. XLSX - zip-архив,
+    поэтому он сначала собирается во временном файле.
+    """
+
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Неизвестный формат: {fmt}")
+
+    filename = f"gradebook_{course_id}"
+    if fmt == "json":
+        return StreamingResponse(_iter_json(pool, course_id, course_title), media_type="application/json")
+    if fmt == "csv":
+        return csv_stream_response(f"{filename}.csv", _iter_csv(pool, course_id))
+
+    if openpyxl is None:
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Выгрузка в XLSX недоступна: не установлен openpyxl"
+        )
+
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        await _write_xlsx(pool, course_id, path)
+    except BaseException:
+        os.remove(path)
+        raise
+
+    return FileResponse(
+        path,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        filename=f"{filename}.xlsx",
+        background=BackgroundTask(os.remove, path)
+    )
@@ -0,0 +1,205 @@
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import asyncpg
+from fastapi import HTTPException, status
+import fieldsets
+import schemas
+
+
+class Relation:
+    """Связанные данные, которые подгружаются к странице через ?include=.
+
+    Один запрос на связь для всех родителей страницы сразу
+    (WHERE родитель = ANY($1)), без запроса на каждую строку. Запрос
+    возвращает столбец parent_id, по нему результаты раскладываются по
+    родителям; у родителя без связанных строк - default(id).
+    """
+
+    def __init__(
+        self,
+        annotation: Any,
+        sql: str,
+        build: Callable[[Any], Any],
+        tables: Sequence[str],
+        many: bool = True,
+        default: Optional[Callable[[int], Any]] = None
+    ):
+        self.annotation = annotation
+        self.sql = sql
+        self.build = build
+        self.tables = tuple(tables)
+        self.many = many
+        self.default = default or ((lambda parent_id: []) if many else (lambda parent_id: None))
+
+    async def load(self, conn: asyncpg.Connection, ids: List[int]) -> Dict[int, Any]:
+        rows = await conn.fetch(self.sql, ids)
+        loaded: Dict[int, Any] = {}
+        for row in rows:
+            if self.many:
+                loaded.setdefault(row["parent_id"], []).append(self.build(row))
+            else:
+                loaded[row["parent_id"]] = self.build(row)
+        return loaded
+
+
+def _collection(fieldset: fieldsets.Fieldset, selection: fieldsets.Selection, source: str, parent: str, order_by: str, tables: Sequence[str]) -> Relation:
+    # parent_id идет последним: mapper читает поля выбора по позициям с нуля
+    sql = f"""
+        SELECT {fieldset.select(selection)}, {parent} AS parent_id
+        {source}
+        WHERE {parent} = ANY($1::int[])
+        ORDER BY {order_by}
+    """
+    return Relation(List[fieldset.response_model(selection)], sql, fieldset.mapper(selection), tables)
+
+
+def _without(fieldset: fieldsets.Fieldset, *names: str) -> fieldsets.Selection:
+    return {name: sub for name, sub in fieldset.full().items() if name not in names}
+
+
+def _course_statistics(row) -> dict:
+    return {
+        "course_id": row["course_id"],
+        "total_students": row["total_students"] or 0,
+        "total_assignments": row["total_assignments"] or 0,
+        "average_grade": float(row["average_grade"] or 0),
+        "min_grade": float(row["min_grade"] or 0),
+        "max_grade": float(row["max_grade"] or 0)
+    }
+
+
+def _empty_course_statistics(course_id: int) -> dict:
+    return {
+        "course_id": course_id,
+        "total_students": 0,
+        "total_assignments": 0,
+        "average_grade": 0.0,
+        "min_grade": 0.0,
+        "max_grade": 0.0
+    }
+
+
+COURSES: Dict[str, Relation] = {
+    # Записи на курс со студентами - то же, что /courses/{id}/students
+    "students": _collection(
+        fieldsets.ENROLLMENTS,
+        _without(fieldsets.ENROLLMENTS, "course"),
+        "FROM courses.student_course_enrollment sce JOIN courses.students s ON sce.student_id = s.id",
+        "sce.course_id",
+        "sce.enrollment_date DESC, sce.id",
+        ("student_course_enrollment", "students")
+    ),
+    "grades": _collection(
+        fieldsets.GRADES,
+        _without(fieldsets.GRADES, "course"),
+        "FROM courses.grades g JOIN courses.students s ON g.student_id = s.id",
+        "g.course_id",
+        "g.submission_date DESC, g.id",
+        ("grades", "students")
+    ),
+    "schedule": _collection(
+        fieldsets.SCHEDULE,
+        _without(fieldsets.SCHEDULE, "course"),
+        "FROM courses.schedule s",
+        "s.course_id",
+        "s.start_date_time, s.id",
+        ("schedule",)
+    ),
+    "statistics": Relation(
+        schemas.CourseStatistics,
+        """
+        SELECT
+            course_id AS parent_id,
+            course_id,
+            students_count AS total_students,
+            grades_count AS total_assignments,
+            grades_sum / NULLIF(grades_count, 0) AS average_grade,
+            min_grade,
+            max_grade
+        FROM courses.course_grade_stats
+        WHERE course_id = ANY($1::int[])
+        """,
+        _course_statistics,
+        ("student_course_enrollment", "grades"),
+        many=False,
+        default=_empty_course_statistics
+    ),
+}
+
+STUDENTS: Dict[str, Relation] = {
+    # Записи студента на курсы вместе с курсами
+    "courses": _collection(
+        fieldsets.ENROLLMENTS,
+        _without(fieldsets.ENROLLMENTS, "student"),
+        "FROM courses.student_course_enrollment sce JOIN courses.courses c ON sce.course_id = c.id",
+        "sce.student_id",
+        "sce.enrollment_date DESC, sce.id",
+        ("student_course_enrollment", "courses")
+    ),
+    "grades": _collection(
+        fieldsets.GRADES,
+        _without(fieldsets.GRADES, "student"),
+        "FROM courses.grades g JOIN courses.courses c ON g.course_id = c.id",
+        "g.student_id",
+        "g.submission_date DESC, g.id",
+        ("grades", "courses")
+    ),
+}
+
+TEACHERS: Dict[str, Relation] = {
+    "courses": _collection(
+        fieldsets.COURSE,
+        fieldsets.COURSE.full(),
+        "FROM courses.courses c",
+        "c.teacher_id",
+        "c.id",
+        ("courses",)
+    ),
+    "schedule": _collection(
+        fieldsets.SCHEDULE,
+        fieldsets.SCHEDULE.full(),
+        "FROM courses.schedule s JOIN courses.courses c ON s.course_id = c.id",
+        "c.teacher_id",
+        "s.start_date_time, s.id",
+        ("schedule", "courses")
+    ),
+}
+
+
+def parse(relations: Dict[str, Relation], include: Optional[str]) -> Tuple[str, ...]:
+    """Разбор ?include=students,schedule; порядок и повторы не важны"""
+
+    names = tuple(dict.fromkeys(part.strip() for part in (include or "").split(",") if part.strip()))
+    unknown = [name for name in names if name not in relations]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Неизвестные связи: {', '.join(unknown)}. Доступны: {', '.join(relations)}"
+        )
+    return names
+
+
+def annotations(relations: Dict[str, Relation], names: Sequence[str]) -> Dict[str, Any]:
+    """Типы полей-связей для Fieldset.respond(extra=...)"""
+
+    return {name: relations[name].annotation for name in names}
+
+
+def tables(relations: Dict[str, Relation], names: Sequence[str]) -> Tuple[str, ...]:
+    return tuple(table for name in names for table in relations[name].tables)
+
+
+async def expand(conn: asyncpg.Connection, relations: Dict[str, Relation], names: Sequence[str], ids: Sequence[int], items: List[dict]):
+    """Дописать в items (объекты страницы, в порядке ids) выбранные связи.
+
+    Запросов столько, сколько связей, а не строк; все на одном соединении.
+    """
+
+    if not names:
+        return
+    unique_ids = list(dict.fromkeys(ids))
+    for name in names:
+        relation = relations[name]
+        loaded = await relation.load(conn, unique_ids)
+        for parent_id, item in zip(ids, items):
+            value = loaded.get(parent_id)
+            item[name] = relation.default(parent_id) if value is None else value
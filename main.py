@@ -5,6 +5,17 @@ from routers import roles, users, teachers, schedule, students, grades, courses,
 from contextlib import asynccontextmanager
 import asyncpg
 import os
+import bulk_enrollment
+import constraints
+import data_versions
+import grade_stats
+import pagination
+import schedule_conflicts
+import schedule_series
+import text_search
+from report_jobs import ReportJobManager
+from report_render import ReportRenderer
+from compression import CompressionMiddleware
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -20,11 +31,34 @@ async def lifespan(app: FastAPI):
     DATABASE_URL = os.getenv("DATABASE_URL")
     app.state.pool = await asyncpg.create_pool(DATABASE_URL, min_size=5, max_size=20)
 
+    async with app.state.pool.acquire() as conn:
+        if await grade_stats.ensure_schema(conn):
+            print("Сводные таблицы оценок созданы и заполнены")
+        await data_versions.ensure_schema(conn)
+        if await schedule_series.ensure_schema(conn):
+            print("Таблица серий расписания создана")
+        await constraints.ensure_constraints(conn)
+        if not await schedule_conflicts.ensure_schema(conn):
+            print("В расписании есть пересекающиеся занятия преподавателей: ограничение не создано")
+        await pagination.ensure_indexes(conn)
+        if not await text_search.ensure_indexes(conn):
+            print("Расширение pg_trgm недоступно: фильтр search= в списках работает без индекса")
+        if not await bulk_enrollment.ensure_unique_index(conn):
+            print("В записях на курсы есть повторы пар (студент, курс): уникальный индекс не создан")
+
+    app.state.report_jobs = ReportJobManager(DATABASE_URL)
+    await app.state.report_jobs.start()
+
+    app.state.report_renderer = ReportRenderer()
+    app.state.report_renderer.start()
+
     os.makedirs(UPLOADS_DIR, exist_ok=True)
 
     yield
 
     print("Остановка приложения...")
+    app.state.report_renderer.stop()
+    await app.state.report_jobs.stop()
     await app.state.pool.close()
 
 
@@ -35,6 +69,8 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+app.add_middleware(CompressionMiddleware)
+
 app.include_router(roles.router)
 app.include_router(users.router)
 app.include_router(teachers.router)
@@ -0,0 +1,128 @@
+import base64
+import binascii
+import json
+import os
+from datetime import date, datetime
+from typing import Any, Callable, List, Sequence, Tuple
+import asyncpg
+from fastapi import HTTPException, Response, status
+from dotenv import load_dotenv
+
+load_dotenv()
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+TOTAL_COUNT_HEADER = "X-Total-Count"
+TOTAL_COUNT_TYPE_HEADER = "X-Total-Count-Type"
+
+# До скольких строк общее число считается точно; дальше - оценка планировщика
+LIST_COUNT_EXACT_LIMIT = int(os.getenv("LIST_COUNT_EXACT_LIMIT", "10000"))
+
+# Индексы под порядок списков: без них курсор все равно упирается в сортировку
+_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS grades_submission_date_id_idx ON courses.grades (submission_date, id)",
+    "CREATE INDEX IF NOT EXISTS student_course_enrollment_enrollment_date_id_idx"
+    " ON courses.student_course_enrollment (enrollment_date, id)",
+    "CREATE INDEX IF NOT EXISTS schedule_start_date_time_id_idx ON courses.schedule (start_date_time, id)",
+]
+
+
+async def ensure_indexes(conn: asyncpg.Connection):
+    for statement in _INDEXES:
+        await conn.execute(statement)
+
+
+class Keyset:
+    """Порядок списка для курсорной пагинации.
+
+    columns - тройки (SQL-выражение, имя поля в записи, разбор значения из курсора);
+    последняя колонка должна быть уникальной (id), чтобы порядок был полным.
+    Курсор - значения колонок последней строки страницы; следующая страница
+    начинается сравнением кортежей и читается по индексу с нужного места,
+    поэтому глубокие страницы стоят столько же, сколько первая.
+    """
+
+    def __init__(self, name: str, columns: Sequence[Tuple[str, str, Callable[[Any], Any]]], descending: bool = False):
+        self.name = name
+        self.columns = columns
+        self.descending = descending
+
+    @property
+    def order_by(self) -> str:
+        direction = " DESC" if self.descending else ""
+        return ", ".join(f"{expression}{direction}" for expression, _, _ in self.columns)
+
+    def condition(self, param_count: int) -> str:
+        """Условие "после курсора" с параметрами начиная с $param_count"""
+
+        expressions = ", ".join(expression for expression, _, _ in self.columns)
+        placeholders = ", ".join(f"${param_count + i}" for i in range(len(self.columns)))
+        operator = "<" if self.descending else ">"
+        return f" AND ({expressions}) {operator} ({placeholders})"
+
+    def encode(self, record) -> str:
+        values = [_plain(record[field]) for _, field, _ in self.columns]
+        raw = json.dumps([self.name, values], separators=(",", ":")).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+    def decode(self, cursor: str) -> List[Any]:
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            name, values = json.loads(raw)
+            if name != self.name or len(values) != len(self.columns):
+                raise ValueError(name)
+            return [parse(value) for (_, _, parse), value in zip(self.columns, values)]
+        except (binascii.Error, ValueError, TypeError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Неверный курсор")
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def set_next_cursor(response: Response, keyset: Keyset, rows: Sequence, limit: int):
+    """Курсор следующей страницы в заголовке X-Next-Cursor, если страница полная"""
+
+    if limit > 0 and len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = keyset.encode(rows[-1])
+
+
+async def set_total_count(response: Response, conn: asyncpg.Connection, query: str, params: Sequence):
+    """Общее число строк списка в X-Total-Count, вид подсчета - в X-Total-Count-Type.
+
+    query - запрос списка с фильтрами, но без курсора, сортировки и LIMIT.
+    Сначала берется оценка планировщика по статистике таблиц (EXPLAIN без
+    выполнения). Если она небольшая, строки считаются точно, но COUNT все
+    равно ограничен LIST_COUNT_EXACT_LIMIT строками: полного COUNT(*) по
+    большой таблице не бывает ни при какой оценке.
+    """
+
+    plan = json.loads(await conn.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *params))
+    estimate = int(plan[0]["Plan"]["Plan Rows"])
+
+    if estimate <= LIST_COUNT_EXACT_LIMIT:
+        count = await conn.fetchval(
+            f"SELECT COUNT(*) FROM ({query} LIMIT {LIST_COUNT_EXACT_LIMIT + 1}) list_rows",
+            *params
+        )
+        if count <= LIST_COUNT_EXACT_LIMIT:
+            response.headers[TOTAL_COUNT_HEADER] = str(count)
+            response.headers[TOTAL_COUNT_TYPE_HEADER] = "exact"
+            return
+        estimate = max(estimate, count)
+
+    response.headers[TOTAL_COUNT_HEADER] = str(estimate)
+    response.headers[TOTAL_COUNT_TYPE_HEADER] = "estimated"
+
+
+GRADES = Keyset("grades", [("g.submission_date", "submission_date", date.fromisoformat), ("g.id", "id", int)], descending=True)
+ENROLLMENTS = Keyset(
+    "enrollments",
+    [("sce.enrollment_date", "enrollment_date", date.fromisoformat), ("sce.id", "id", int)],
+    descending=True
+)
+SCHEDULE = Keyset("schedule", [("s.start_date_time", "start_date_time", datetime.fromisoformat), ("s.id", "id", int)])
+STUDENTS = Keyset("students", [("s.id", "id", int)])
+TEACHERS = Keyset("teachers", [("t.id", "id", int)])
+COURSES = Keyset("courses", [("c.id", "id", int)])
@@ -0,0 +1,216 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+from fastapi import Depends, Response
+from dotenv import load_dotenv
+import compression
+
+load_dotenv()
+
+REPORT_CACHE_TTL = int(os.getenv("REPORT_CACHE_TTL", "60"))
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "512"))
+
+
+class _Entry:
+    __slots__ = ("value", "tags", "created_at", "encoded")
+
+    def __init__(self, value: Any, tags: frozenset, created_at: float):
+        self.value = value
+        self.tags = tags
+        self.created_at = created_at
+        # Сжатые тела ответа по Content-Encoding: повторно не сжимаются
+        self.encoded: Dict[str, bytes] = {}
+
+
+class ReportCache:
+    """LRU-кэш отчетов с TTL и инвалидацией по тегам.
+
+    Теги описывают данные, из которых собран отчет: "course:5", "student:7",
+    "schedule" и т.п. Изменяющие обработчики вызывают invalidate() с тегами
+    затронутых сущностей, и вытесняются только зависящие от них записи.
+    """
+
+    def __init__(self, ttl: int = REPORT_CACHE_TTL, max_entries: int = REPORT_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._by_tag: Dict[str, set] = {}
+        # Номер последней инвалидации по каждому тегу: отчет, который начали
+        # считать до инвалидации, не должен попасть в кэш после нее.
+        self._seq = 0
+        self._tag_seq: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def begin(self) -> int:
+        """Номер инвалидации на момент начала расчета отчета, передается в set()"""
+
+        return self._seq
+
+    def get(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """Вернуть (значение, возраст в секундах) или None"""
+
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        age = time.monotonic() - entry.created_at
+        if age > self.ttl:
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value, age
+
+    def set(self, key: Hashable, value: Any, tags: Iterable[str], since: int) -> Optional[_Entry]:
+        tags = frozenset(tags)
+        if self.max_entries <= 0:
+            return None
+        if any(self._tag_seq.get(tag, -1) > since for tag in tags):
+            return None
+
+        if key in self._entries:
+            self._remove(key)
+        entry = self._entries[key] = _Entry(value, tags, time.monotonic())
+        for tag in tags:
+            self._by_tag.setdefault(tag, set()).add(key)
+
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+        return entry
+
+    def entry(self, key: Hashable) -> Optional[_Entry]:
+        """Запись без учета в статистике и без проверки TTL"""
+
+        return self._entries.get(key)
+
+    def tags_of(self, key: Hashable) -> Optional[frozenset]:
+        """Теги записи, если она есть в кэше (без учета в статистике)"""
+
+        entry = self._entries.get(key)
+        return None if entry is None else entry.tags
+
+    def invalidate(self, *tags: str):
+        """Удалить все записи, собранные из данных с указанными тегами"""
+
+        self._seq += 1
+        for tag in tags:
+            self._tag_seq[tag] = self._seq
+            for key in self._by_tag.pop(tag, set()):
+                if key in self._entries:
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._by_tag.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+    def _remove(self, key: Hashable):
+        entry = self._entries.pop(key)
+        for tag in entry.tags:
+            keys = self._by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_tag[tag]
+
+
+cache = ReportCache()
+
+
+def _from_http() -> bool:
+    return True
+
+
+# Параметр обработчика отчета: FastAPI подставляет True только при вызове
+# маршрута по HTTP. При прямом вызове (рендер в XLSX/PDF, фоновые задачи)
+# остается значение по умолчанию - маркер Depends, а не True, и сжатые тела
+# из кэша не отдаются и не запоминаются: вызывающему нужен сам отчет, а
+# Accept-Encoding в контексте относится к чужому ответу.
+HTTP = Depends(_from_http)
+
+
+def lookup(response: Response, key: Hashable, http: bool = False) -> Optional[Any]:
+    """Отдать отчет из кэша и проставить заголовки.
+
+    Age - сколько секунд назад отчет был рассчитан на сервере; браузер
+    кэшировать ответ не должен, чтобы инвалидация была видна сразу.
+    Готовый сжатый Response вместо отчета возвращается только при http=True.
+    """
+
+    hit = cache.get(key)
+    if hit is None:
+        response.headers["X-Cache"] = "MISS"
+        response.headers["Age"] = "0"
+        response.headers["Cache-Control"] = "private, no-cache"
+        return None
+
+    value, age = hit
+    response.headers["X-Cache"] = "HIT"
+    response.headers["Age"] = str(int(age))
+    response.headers["Cache-Control"] = "private, no-cache"
+
+    encoding = compression.accepted_encoding() if http is True else None
+    if encoding is None:
+        return value
+
+    entry = cache.entry(key)
+    body = entry.encoded.get(encoding)
+    if body is None:
+        # Первый запрос с таким Accept-Encoding: сжатое middleware тело запоминаем
+        compression.on_encoded(_attach(entry))
+        return value
+
+    # Готовое сжатое тело: middleware видит Content-Encoding и не трогает ответ
+    cached = Response(content=body, media_type="application/json", headers=dict(response.headers))
+    compression.encoding_headers(cached.headers, encoding)
+    return cached
+
+
+def store(key: Hashable, value: Any, tags: Iterable[str], since: int, http: bool = False) -> Any:
+    entry = cache.set(key, value, tags, since)
+    if entry is not None and http is True:
+        compression.on_encoded(_attach(entry))
+    return value
+
+
+def _attach(entry: _Entry):
+    def attach(encoding: str, body: bytes):
+        entry.encoded[encoding] = body
+    return attach
+
+
+def course_tag(course_id: int) -> str:
+    return f"course:{course_id}"
+
+
+def student_tag(student_id: int) -> str:
+    return f"student:{student_id}"
+
+
+# Теги для данных, которые не привязаны к одной сущности
+COURSES_TAG = "courses"
+TEACHERS_TAG = "teachers"
+SCHEDULE_TAG = "schedule"
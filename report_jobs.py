@@ -0,0 +1,218 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncpg
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+REPORT_JOB_WORKERS = int(os.getenv("REPORT_JOB_WORKERS", "2"))
+REPORT_JOB_QUEUE_SIZE = int(os.getenv("REPORT_JOB_QUEUE_SIZE", "100"))
+REPORT_JOB_DIR = os.getenv("REPORT_JOB_DIR", os.path.join(BASE_DIR, "report_jobs"))
+REPORT_JOB_MAX_BYTES = int(os.getenv("REPORT_JOB_MAX_BYTES", str(200 * 1024 * 1024)))
+REPORT_JOB_TTL = int(os.getenv("REPORT_JOB_TTL", str(24 * 60 * 60)))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+EXPIRED = "expired"
+
+Runner = Callable[[asyncpg.Connection], Awaitable[Any]]
+
+
+class ReportJob:
+    def __init__(self, report: str, params: Dict[str, Any], runner: Runner):
+        self.id = uuid.uuid4().hex
+        self.report = report
+        self.params = params
+        self.runner = runner
+        self.status = QUEUED
+        self.error: Optional[str] = None
+        self.result_size: Optional[int] = None
+        self.created_at = datetime.now()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.finished_monotonic: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "report": self.report,
+            "params": self.params,
+            "status": self.status,
+            "error": self.error,
+            "result_size": self.result_size,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class ReportJobManager:
+    """Очередь тяжелых отчетов с ограниченным числом фоновых исполнителей.
+
+    У исполнителей свой пул соединений, поэтому аналитика не занимает
+    соединения основного пула и не задерживает обычные запросы.
+    Результаты пишутся в JSON-файлы; общий объем и срок хранения ограничены.
+    Каждый процесс пишет в свой подкаталог results_dir и удаляет только
+    созданные им файлы: рабочие процессы не трогают результаты друг друга.
+    """
+
+    def __init__(
+            self,
+            dsn: str,
+            workers: int = REPORT_JOB_WORKERS,
+            queue_size: int = REPORT_JOB_QUEUE_SIZE,
+            results_dir: str = REPORT_JOB_DIR,
+            max_bytes: int = REPORT_JOB_MAX_BYTES,
+            ttl: int = REPORT_JOB_TTL
+    ):
+        self.dsn = dsn
+        self.workers = workers
+        self.results_dir = results_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.jobs: Dict[str, ReportJob] = {}
+        self._queue: "asyncio.Queue[ReportJob]" = asyncio.Queue(maxsize=queue_size)
+        self._tasks = []
+        self._pool: Optional[asyncpg.Pool] = None
+        self._dir: Optional[str] = None
+
+    async def start(self):
+        # Метаданные задач хранятся в памяти, поэтому каталог результатов
+        # новый на каждый запуск
+        os.makedirs(self.results_dir, exist_ok=True)
+        self._dir = tempfile.mkdtemp(prefix=f"{os.getpid()}-", dir=self.results_dir)
+
+        self._pool = await asyncpg.create_pool(self.dsn, min_size=0, max_size=self.workers)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+        self._remove_results()
+
+    def submit(self, report: str, params: Dict[str, Any], runner: Runner) -> ReportJob:
+        job = ReportJob(report, params, runner)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise HTTPException(status_code=503, detail="Очередь отчетов переполнена, повторите позже")
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> ReportJob:
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Задача не найдена")
+        return job
+
+    def result_path(self, job: ReportJob) -> str:
+        return os.path.join(self._dir, f"{job.id}.json")
+
+    def _remove_results(self):
+        """Удалить файлы задач этого процесса и его подкаталог"""
+
+        if self._dir is None:
+            return
+        for job in self.jobs.values():
+            path = self.result_path(job)
+            for name in (path, path + ".tmp"):
+                try:
+                    os.remove(name)
+                except FileNotFoundError:
+                    pass
+        try:
+            os.rmdir(self._dir)
+        except OSError:
+            pass
+        self._dir = None
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: ReportJob):
+        job.status = RUNNING
+        job.started_at = datetime.now()
+        try:
+            async with self._pool.acquire() as conn:
+                result = await job.runner(conn)
+            size = await asyncio.to_thread(self._write_result, job, result)
+        except asyncio.CancelledError:
+            raise
+        except HTTPException as e:
+            job.status = FAILED
+            job.error = str(e.detail)
+        except Exception as e:
+            job.status = FAILED
+            job.error = f"{type(e).__name__}: {e}"
+        else:
+            job.status = DONE
+            job.result_size = size
+        finally:
+            job.runner = None
+            job.finished_at = datetime.now()
+            job.finished_monotonic = time.monotonic()
+
+        self._apply_retention()
+
+    def _write_result(self, job: ReportJob, result: Any) -> int:
+        path = self.result_path(job)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(jsonable_encoder(result), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return os.path.getsize(path)
+
+    def _expire(self, job: ReportJob):
+        try:
+            os.remove(self.result_path(job))
+        except FileNotFoundError:
+            pass
+        job.status = EXPIRED
+        job.result_size = None
+
+    def _apply_retention(self):
+        """Удалить просроченные результаты и самые старые, пока объем больше лимита"""
+
+        now = time.monotonic()
+        finished = sorted(
+            (job for job in self.jobs.values() if job.finished_monotonic is not None),
+            key=lambda job: job.finished_monotonic
+        )
+
+        for job in finished:
+            if now - job.finished_monotonic > self.ttl:
+                if job.status == DONE:
+                    self._expire(job)
+                # Метаданные держим еще один срок, чтобы клиент увидел "expired"
+                if now - job.finished_monotonic > 2 * self.ttl:
+                    del self.jobs[job.id]
+
+        total = sum(job.result_size or 0 for job in finished if job.status == DONE)
+        for job in finished:
+            if total <= self.max_bytes:
+                break
+            if job.status == DONE:
+                total -= job.result_size or 0
+                self._expire(job)
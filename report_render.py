@@ -0,0 +1,254 @@
+import asyncio
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, List, Optional, Sequence, Tuple
+from fastapi import HTTPException, status
+from dotenv import load_dotenv
+
+try:
+    import openpyxl
+    from openpyxl.styles import Font
+except ImportError:
+    openpyxl = None
+
+try:
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table as PdfTable, TableStyle
+except ImportError:
+    pdfmetrics = None
+
+load_dotenv()
+
+REPORT_RENDER_WORKERS = int(os.getenv("REPORT_RENDER_WORKERS", "2"))
+REPORT_RENDER_QUEUE_SIZE = int(os.getenv("REPORT_RENDER_QUEUE_SIZE", "20"))
+# Шрифт с кириллицей для PDF: встроенные шрифты reportlab ее не содержат
+REPORT_PDF_FONT = os.getenv("REPORT_PDF_FONT", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf")
+
+FORMATS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "pdf": "application/pdf",
+}
+
+# (заголовок, названия колонок, строки)
+Table = Tuple[str, Sequence[str], List[Sequence[Any]]]
+
+
+def _cell(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _rows(items, fields: Sequence[str]) -> List[list]:
+    return [[_cell(item.get(field)) for field in fields] for item in items]
+
+
+# Раскладка отчетов в таблицы. Выполняется в основном процессе и дешева,
+# в пул процессов уходят только готовые таблицы из простых значений.
+
+def _students_by_course(report: dict) -> Tuple[str, List[Table]]:
+    fields = ["student_id", "last_name", "first_name", "group_number", "enrollment_date",
+              "final_grade", "assignments_count", "average_grade"]
+    headers = ["ID", "Фамилия", "Имя", "Группа", "Дата зачисления", "Итоговая оценка", "Оценок", "Средний балл"]
+    title = f"Студенты курса «{report['course_title']}»"
+    return title, [(f"Всего студентов: {report['total_students']}", headers, _rows(report['students'], fields))]
+
+
+def _performance_report(report: dict) -> Tuple[str, List[Table]]:
+    summary = report['performance_summary']
+    summary_table = (
+        "Сводка",
+        ["Всего", "Отлично", "Хорошо", "Удовлетворительно", "Неудовлетворительно"],
+        [[summary['total_students'], summary['excellent'], summary['good'],
+          summary['satisfactory'], summary['unsatisfactory']]]
+    )
+    fields = ["student_id", "student_name", "group_number", "assignments_completed", "average_grade",
+              "min_grade", "max_grade", "final_grade", "performance_level"]
+    headers = ["ID", "Студент", "Группа", "Оценок", "Средний балл", "Мин.", "Макс.", "Итоговая оценка", "Уровень"]
+    title = f"Успеваемость по курсу «{report['course_title']}»"
+    return title, [summary_table, ("Студенты", headers, _rows(report['students'], fields))]
+
+
+def _student_performance(report: dict) -> Tuple[str, List[Table]]:
+    student = report['student']
+    overall = report['overall_statistics']
+    summary_table = (
+        "Общая статистика",
+        ["Группа", "Логин", "Email", "Курсов", "Оценок", "Средний балл"],
+        [[student['group_number'], student['username'], student['email'],
+          overall['total_courses'], overall['total_assignments'], overall['overall_average']]]
+    )
+    fields = ["course_title", "teacher_name", "enrollment_date", "final_grade", "assignments_count",
+              "average_grade", "min_grade", "max_grade"]
+    headers = ["Курс", "Преподаватель", "Дата зачисления", "Итоговая оценка", "Оценок",
+               "Средний балл", "Мин.", "Макс."]
+    title = f"Ведомость успеваемости: {student['name']}"
+    return title, [summary_table, ("Курсы", headers, _rows(report['courses'], fields))]
+
+
+def _schedule_report(report: dict) -> Tuple[str, List[Table]]:
+    fields = ["course_title", "teacher_name", "start_time", "end_time", "duration_hours", "enrolled_students"]
+    headers = ["Дата", "Курс", "Преподаватель", "Начало", "Конец", "Часов", "Студентов"]
+    rows = []
+    for day, lessons in report['schedule_by_day'].items():
+        rows.extend([day] + row for row in _rows(lessons, fields))
+    title = f"Расписание с {report['start_date']} по {report['end_date']}"
+    return title, [("Занятия", headers, rows)]
+
+
+LAYOUTS = {
+    "students-by-course": _students_by_course,
+    "performance-report": _performance_report,
+    "student-performance": _student_performance,
+    "schedule-report": _schedule_report,
+}
+
+
+# Рендеринг: функции верхнего уровня, чтобы их можно было отправить в процесс пула
+
+def render_xlsx(title: str, tables: List[Table]) -> bytes:
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "Отчет"
+    bold = Font(bold=True)
+
+    sheet.append([title])
+    sheet.cell(row=1, column=1).font = Font(bold=True, size=14)
+    for caption, headers, rows in tables:
+        sheet.append([])
+        sheet.append([caption])
+        sheet.cell(row=sheet.max_row, column=1).font = bold
+        sheet.append(list(headers))
+        for cell in sheet[sheet.max_row]:
+            cell.font = bold
+        for row in rows:
+            sheet.append(list(row))
+
+    for column in sheet.iter_cols(min_row=3):
+        width = max((len(str(cell.value)) for cell in column if cell.value is not None), default=0)
+        sheet.column_dimensions[column[0].column_letter].width = min(max(width + 2, 8), 50)
+
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def _pdf_font() -> str:
+    if "ReportFont" in pdfmetrics.getRegisteredFontNames():
+        return "ReportFont"
+    try:
+        pdfmetrics.registerFont(TTFont("ReportFont", REPORT_PDF_FONT))
+    except Exception:
+        return "Helvetica"
+    return "ReportFont"
+
+
+def _pdf_text(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return f"{value:.2f}".rstrip("0").rstrip(".")
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M")
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%d")
+    return str(value)
+
+
+def render_pdf(title: str, tables: List[Table]) -> bytes:
+    font = _pdf_font()
+    styles = getSampleStyleSheet()
+    heading = styles["Heading1"].clone("ReportTitle", fontName=font)
+    caption_style = styles["Heading3"].clone("ReportCaption", fontName=font)
+
+    buffer = io.BytesIO()
+    document = SimpleDocTemplate(buffer, pagesize=landscape(A4), title=title)
+    story = [Paragraph(title, heading)]
+    for caption, headers, rows in tables:
+        story.append(Paragraph(caption, caption_style))
+        data = [list(headers)] + [[_pdf_text(value) for value in row] for row in rows]
+        table = PdfTable(data, repeatRows=1)
+        table.setStyle(TableStyle([
+            ("FONTNAME", (0, 0), (-1, -1), font),
+            ("FONTSIZE", (0, 0), (-1, -1), 8),
+            ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
+            ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
+            ("VALIGN", (0, 0), (-1, -1), "TOP"),
+        ]))
+        story.append(table)
+        story.append(Spacer(1, 12))
+
+    document.build(story)
+    return buffer.getvalue()
+
+
+_RENDERERS = {
+    "xlsx": render_xlsx,
+    "pdf": render_pdf,
+}
+
+
+def check_format(fmt: str):
+    """400 для неизвестного формата, 501 если не установлена нужная библиотека"""
+
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Неизвестный формат: {fmt}")
+    if fmt == "xlsx" and openpyxl is None:
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Выгрузка в XLSX недоступна: не установлен openpyxl"
+        )
+    if fmt == "pdf" and pdfmetrics is None:
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Выгрузка в PDF недоступна: не установлен reportlab"
+        )
+
+
+class ReportRenderer:
+    """Пул процессов для рендеринга отчетов в XLSX/PDF.
+
+    Рендеринг занимает процессор, поэтому выполняется вне цикла событий
+    в ограниченном числе процессов; число ожидающих задач тоже ограничено.
+    """
+
+    def __init__(self, workers: int = REPORT_RENDER_WORKERS, queue_size: int = REPORT_RENDER_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.pending = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self):
+        # spawn: дочерние процессы не наследуют цикл событий и соединения с базой
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def render(self, fmt: str, report: str, result: dict) -> bytes:
+        if self.pending >= self.workers + self.queue_size:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Слишком много отчетов в очереди на рендеринг, повторите позже"
+            )
+
+        title, tables = LAYOUTS[report](result)
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, _RENDERERS[fmt], title, tables)
+        finally:
+            self.pending -= 1
@@ -1,9 +1,16 @@
-from fastapi import APIRouter, HTTPException, Query, status, Depends
+from fastapi import APIRouter, HTTPException, Query, status, Depends, Response
 from typing import List, Optional
 import asyncpg
 from datetime import timedelta
 import schemas
-from dependencies import get_connection
+import pagination
+import fieldsets
+import includes
+import bulk
+import text_search
+import report_cache
+import constraints
+from dependencies import conditional_get, get_connection
 
 router = APIRouter(
     prefix="/courses",
@@ -19,37 +26,91 @@ async def create_course(
 ):
     duration = timedelta(days=data.duration)
 
-    row = await conn.fetchrow(
-        """
-        INSERT INTO courses.courses (title, description, teacher_id, duration)
-        VALUES ($1, $2, $3, $4)
-        RETURNING *
-        """,
-        data.title,
-        data.description,
-        data.teacher_id,
-        duration
-    )
+    with constraints.translated():
+        row = await conn.fetchrow(
+            """
+            INSERT INTO courses.courses (title, description, teacher_id, duration)
+            VALUES ($1, $2, $3, $4)
+            RETURNING *
+            """,
+            data.title,
+            data.description,
+            data.teacher_id,
+            duration
+        )
 
     course = dict(row)
 
     if isinstance(course["duration"], timedelta):
         course["duration"] = course["duration"].days
 
+    report_cache.cache.invalidate(report_cache.COURSES_TAG)
     return course
 
 
-@router.get("/", response_model=List[schemas.CourseWithTeacher])
+async def _get_courses_by_ids(
+        conn: asyncpg.Connection,
+        response: Response,
+        ids: List[int],
+        fields: Optional[str],
+        include: Optional[str]
+):
+    """Курсы по списку id одним запросом, в порядке ids"""
+
+    selection = fieldsets.COURSES.parse(fields)
+    relations = includes.parse(includes.COURSES, include)
+
+    rows = await conn.fetch(
+        f"""
+        SELECT {fieldsets.COURSES.select(selection, pagination.COURSES)}
+        FROM courses.courses c
+        JOIN courses.teachers t ON c.teacher_id = t.id
+        WHERE c.id = ANY($1::int[])
+        """,
+        ids
+    )
+    rows = bulk.in_order(response, rows, ids)
+
+    items = fieldsets.COURSES.build_all(selection, rows)
+    await includes.expand(conn, includes.COURSES, relations, [row["id"] for row in rows], items)
+    return fieldsets.COURSES.respond(selection, items, response, includes.annotations(includes.COURSES, relations))
+
+
+@router.get(
+    "/",
+    response_model=List[schemas.CourseWithTeacher],
+    dependencies=[Depends(conditional_get("courses", "teachers", relations=includes.COURSES))]
+)
 async def get_courses(
+        response: Response,
         skip: int = Query(0, ge=0),
         limit: int = Query(100, le=1000),
+        cursor: Optional[str] = None,
+        with_total: bool = False,
         search: Optional[str] = None,
         teacher_id: Optional[int] = None,
+        fields: Optional[str] = None,
+        include: Optional[str] = None,
+        ids: Optional[str] = None,
         conn: asyncpg.Connection = Depends(get_connection)
 ):
-    """Получить список курсов"""
-    query = """
-        SELECT c.*, t.first_name, t.last_name, t.qualification
+    """Получить список курсов.
+
+    include=students,grades,schedule,statistics - связанные данные для всей
+    страницы, по одному запросу на связь.
+    ids=1,2,3 - только эти курсы, в том же порядке; фильтры и страницы
+    не применяются, ненайденные id - в X-Missing-Ids
+    """
+
+    if ids is not None:
+        return await _get_courses_by_ids(conn, response, bulk.parse_ids(ids), fields, include)
+
+    selection = fieldsets.COURSES.parse(fields)
+    relations = includes.parse(includes.COURSES, include)
+    columns = fieldsets.COURSES.select(selection, pagination.COURSES)
+
+    query = f"""
+        SELECT {columns}
         FROM courses.courses c
         JOIN courses.teachers t ON c.teacher_id = t.id
         WHERE 1=1
@@ -67,35 +128,67 @@ async def get_courses(
         params.append(teacher_id)
         param_count += 1
 
-    query += f" ORDER BY c.id OFFSET ${param_count} LIMIT ${param_count + 1}"
+    if with_total:
+        await pagination.set_total_count(response, conn, query, params)
+
+    if cursor:
+        query += pagination.COURSES.condition(param_count)
+        params.extend(pagination.COURSES.decode(cursor))
+        param_count += len(pagination.COURSES.columns)
+
+    query += f" ORDER BY {pagination.COURSES.order_by} OFFSET ${param_count} LIMIT ${param_count + 1}"
     params.extend([skip, limit])
 
     rows = await conn.fetch(query, *params)
 
-    courses = []
-    for row in rows:
-        course_dict = dict(row)
-        if isinstance(course_dict.get("duration"), timedelta):
-            course_dict["duration"] = course_dict["duration"].days
+    pagination.set_next_cursor(response, pagination.COURSES, rows, limit)
+
+    items = fieldsets.COURSES.build_all(selection, rows)
+    await includes.expand(conn, includes.COURSES, relations, [row["id"] for row in rows], items)
+    return fieldsets.COURSES.respond(selection, items, response, includes.annotations(includes.COURSES, relations))
+
 
-        course_dict['teacher'] = {
-            'id': row['teacher_id'],
-            'first_name': row['first_name'],
-            'last_name': row['last_name'],
-            'qualification': row['qualification']
-        }
-        courses.append(course_dict)
+@router.post("/by-ids", response_model=List[schemas.CourseWithTeacher])
+async def get_courses_by_ids(
+        data: schemas.IdsRequest,
+        response: Response,
+        fields: Optional[str] = None,
+        include: Optional[str] = None,
+        conn: asyncpg.Connection = Depends(get_connection)
+):
+    """Курсы по списку id в теле запроса - для длинных списков, не влезающих в URL"""
+
+    return await _get_courses_by_ids(conn, response, bulk.check_ids(data.ids), fields, include)
+
+
+@router.get("/search")
+async def search_courses(
+        q: str = Query(..., min_length=1),
+        limit: Optional[int] = Query(None, ge=1, le=100),
+        autocomplete: bool = False,
+        conn: asyncpg.Connection = Depends(get_connection)
+):
+    """Поиск курсов по названию и описанию.
 
-    return courses
+    autocomplete=true - подсказки по началу строки для поля ввода
+    """
+
+    if autocomplete:
+        return await text_search.autocomplete(conn, "courses", q, limit or text_search.AUTOCOMPLETE_LIMIT)
+    return await text_search.search(conn, "courses", q, limit or 20)
 
 
 @router.get("/{course_id}", response_model=schemas.CourseWithTeacher)
-async def get_course(course_id: int, conn: asyncpg.Connection = Depends(get_connection)):
+async def get_course(course_id: int, fields: Optional[str] = None, include: Optional[str] = None, conn: asyncpg.Connection = Depends(get_connection)):
     """Получить курс по ID"""
 
+    selection = fieldsets.COURSES.parse(fields)
+    relations = includes.parse(includes.COURSES, include)
+    columns = fieldsets.COURSES.select(selection)
+
     row = await conn.fetchrow(
-        """
-        SELECT c.*, t.first_name, t.last_name, t.qualification, t.bio
+        f"""
+        SELECT {columns}
         FROM courses.courses c
         JOIN courses.teachers t ON c.teacher_id = t.id
         WHERE c.id = $1
@@ -109,43 +202,15 @@ async def get_course(course_id: int, conn: asyncpg.Connection = Depends(get_conn
             detail="Курс не найден"
         )
 
-    course_dict = dict(row)
-    course_dict['teacher'] = {
-        'id': row['teacher_id'],
-        'first_name': row['first_name'],
-        'last_name': row['last_name'],
-        'qualification': row['qualification'],
-        'bio': row['bio']
-    }
-
-    return course_dict
+    item = fieldsets.COURSES.build(selection, row)
+    await includes.expand(conn, includes.COURSES, relations, [course_id], [item])
+    return fieldsets.COURSES.respond(selection, item, extra=includes.annotations(includes.COURSES, relations))
 
 
 @router.put("/{course_id}", response_model=schemas.Course)
 async def update_course(course_id: int, course_update: schemas.CourseUpdate, conn: asyncpg.Connection = Depends(get_connection)):
     """Обновить данные курса"""
 
-    existing = await conn.fetchrow(
-        "SELECT id FROM courses.courses WHERE id = $1",
-        course_id
-    )
-    if not existing:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Курс не найден"
-        )
-
-    if course_update.teacher_id is not None:
-        teacher_exists = await conn.fetchval(
-            "SELECT EXISTS(SELECT 1 FROM courses.teachers WHERE id = $1)",
-            course_update.teacher_id
-        )
-        if not teacher_exists:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Указанный преподаватель не существует"
-            )
-
     update_fields = []
     params = []
     param_count = 1
@@ -162,7 +227,7 @@ async def update_course(course_id: int, course_update: schemas.CourseUpdate, con
 
     if course_update.duration is not None:
         update_fields.append(f"duration = ${param_count}")
-        params.append(course_update.duration)
+        params.append(timedelta(days=course_update.duration))
         param_count += 1
 
     if course_update.teacher_id is not None:
@@ -170,32 +235,47 @@ async def update_course(course_id: int, course_update: schemas.CourseUpdate, con
         params.append(course_update.teacher_id)
         param_count += 1
 
-    if not update_fields:
+    if update_fields:
+        params.append(course_id)
+        # Несуществующий преподаватель - нарушение внешнего ключа, а не отдельный запрос
+        with constraints.translated():
+            row = await conn.fetchrow(
+                f"""
+                UPDATE courses.courses
+                SET {', '.join(update_fields)}
+                WHERE id = ${param_count}
+                RETURNING *
+                """,
+                *params
+            )
+    else:
         row = await conn.fetchrow("SELECT * FROM courses.courses WHERE id = $1", course_id)
-        return dict(row)
 
-    params.append(course_id)
+    if not row:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Курс не найден"
+        )
+
+    course = dict(row)
 
-    row = await conn.fetchrow(
-        f"""
-        UPDATE courses.courses
-        SET {', '.join(update_fields)}
-        WHERE id = ${param_count}
-        RETURNING *
-        """,
-        *params
-    )
+    if isinstance(course["duration"], timedelta):
+        course["duration"] = course["duration"].days
 
-    return dict(row)
+    if update_fields:
+        report_cache.cache.invalidate(report_cache.course_tag(course_id))
+    return course
 
 
 @router.get("/{course_id}/students", response_model=List[schemas.EnrollmentWithDetails])
-async def get_course_students(course_id: int, conn: asyncpg.Connection = Depends(get_connection)):
+async def get_course_students(course_id: int, fields: Optional[str] = None, conn: asyncpg.Connection = Depends(get_connection)):
     """Получить студентов курса"""
 
+    selection = fieldsets.ENROLLMENTS.parse(fields)
+
     rows = await conn.fetch(
-        """
-        SELECT sce.*, s.first_name, s.last_name, s.group_number, c.title, c.description
+        f"""
+        SELECT {fieldsets.ENROLLMENTS.select(selection)}
         FROM courses.student_course_enrollment sce
         JOIN courses.students s ON sce.student_id = s.id
         JOIN courses.courses c ON sce.course_id = c.id
@@ -205,23 +285,7 @@ async def get_course_students(course_id: int, conn: asyncpg.Connection = Depends
         course_id
     )
 
-    enrollments = []
-    for row in rows:
-        enrollment_dict = dict(row)
-        enrollment_dict['student'] = {
-            'id': row['student_id'],
-            'first_name': row['first_name'],
-            'last_name': row['last_name'],
-            'group_number': row['group_number']
-        }
-        enrollment_dict['course'] = {
-            'id': row['course_id'],
-            'title': row['title'],
-            'description': row['description']
-        }
-        enrollments.append(enrollment_dict)
-
-    return enrollments
+    return fieldsets.ENROLLMENTS.respond(selection, fieldsets.ENROLLMENTS.build_all(selection, rows))
 
 
 @router.get("/{course_id}/grades")
@@ -259,35 +323,37 @@ async def get_course_statistics(course_id: int, conn: asyncpg.Connection = Depen
     stats = await conn.fetchrow(
         """
         SELECT 
-            COUNT(DISTINCT sce.student_id) as total_students,
-            COUNT(DISTINCT g.id) as total_assignments,
-            AVG(g.grade_value) as average_grade,
-            MIN(g.grade_value) as min_grade,
-            MAX(g.grade_value) as max_grade
-        FROM courses.student_course_enrollment sce
-        LEFT JOIN courses.grades g ON sce.student_id = g.student_id AND sce.course_id = g.course_id
-        WHERE sce.course_id = $1
+            students_count as total_students,
+            grades_count as total_assignments,
+            grades_sum / NULLIF(grades_count, 0) as average_grade,
+            min_grade,
+            max_grade
+        FROM courses.course_grade_stats
+        WHERE course_id = $1
         """,
         course_id
     )
+    stats = stats or {}
 
     return {
         "course_id": course_id,
-        "total_students": stats["total_students"] or 0,
-        "total_assignments": stats["total_assignments"] or 0,
-        "average_grade": float(stats["average_grade"] or 0),
-        "min_grade": float(stats["min_grade"] or 0),
-        "max_grade": float(stats["max_grade"] or 0)
+        "total_students": stats.get("total_students") or 0,
+        "total_assignments": stats.get("total_assignments") or 0,
+        "average_grade": float(stats.get("average_grade") or 0),
+        "min_grade": float(stats.get("min_grade") or 0),
+        "max_grade": float(stats.get("max_grade") or 0)
     }
 
 @router.get("/{course_id}/students", response_model=List[schemas.EnrollmentWithDetails])
-async def get_course_students(course_id: int, conn: asyncpg.Connection = Depends(get_connection)):
+async def get_course_students(course_id: int, fields: Optional[str] = None, conn: asyncpg.Connection = Depends(get_connection)):
     """Получить студентов курса"""
 
+    selection = fieldsets.ENROLLMENTS.parse(fields)
+
     try:
         rows = await conn.fetch(
-            """
-            SELECT sce.*, s.first_name, s.last_name, s.group_number, c.title, c.description
+            f"""
+            SELECT {fieldsets.ENROLLMENTS.select(selection)}
             FROM courses.student_course_enrollment sce
             JOIN courses.students s ON sce.student_id = s.id
             JOIN courses.courses c ON sce.course_id = c.id
@@ -299,23 +365,7 @@ async def get_course_students(course_id: int, conn: asyncpg.Connection = Depends
     except asyncpg.exceptions.UndefinedTableError:
         return []
 
-    enrollments = []
-    for row in rows:
-        enrollment_dict = dict(row)
-        enrollment_dict['student'] = {
-            'id': row['student_id'],
-            'first_name': row['first_name'],
-            'last_name': row['last_name'],
-            'group_number': row['group_number']
-        }
-        enrollment_dict['course'] = {
-            'id': row['course_id'],
-            'title': row['title'],
-            'description': row['description']
-        }
-        enrollments.append(enrollment_dict)
-
-    return enrollments
+    return fieldsets.ENROLLMENTS.respond(selection, fieldsets.ENROLLMENTS.build_all(selection, rows))
 
 @router.post("/", response_model=schemas.Course, status_code=status.HTTP_201_CREATED)
 async def create_course(course: schemas.CourseCreate, conn: asyncpg.Connection = Depends(get_connection)):
@@ -330,4 +380,6 @@ async def create_course(course: schemas.CourseCreate, conn: asyncpg.Connection =
             """,
             course.title, course.description, course.duration, course.teacher_id
         )
-        return dict(row)
+
+    report_cache.cache.invalidate(report_cache.COURSES_TAG)
+    return dict(row)
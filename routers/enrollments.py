@@ -1,7 +1,15 @@
-from fastapi import APIRouter, HTTPException, Query, status, Depends
+from fastapi import APIRouter, HTTPException, Query, status, Depends, Response
 from typing import List, Optional
 import asyncpg
+from datetime import date
 import schemas
+import bulk
+import bulk_enrollment
+import pagination
+import fieldsets
+import grade_stats
+import constraints
+import report_cache
 from dependencies import get_connection
 
 router = APIRouter(
@@ -15,63 +23,98 @@ router = APIRouter(
 async def enroll_student(enrollment: schemas.EnrollmentCreate, conn: asyncpg.Connection = Depends(get_connection)):
     """Записать студента на курс"""
 
-    async with conn.transaction():
-        student_exists = await conn.fetchval(
-            "SELECT EXISTS(SELECT 1 FROM courses.students WHERE id = $1)",
-            enrollment.student_id
+    # Один оператор: несуществующие студент или курс - нарушение внешнего
+    # ключа, повторная запись - пустой результат (NOT EXISTS / ON CONFLICT)
+    with constraints.translated():
+        row = await conn.fetchrow(
+            grade_stats.with_students_enrolled(
+                """
+                INSERT INTO courses.student_course_enrollment (student_id, course_id, enrollment_date)
+                SELECT $1::int, $2::int, $3::date
+                WHERE NOT EXISTS(
+                    SELECT 1 FROM courses.student_course_enrollment
+                    WHERE student_id = $1 AND course_id = $2
+                )
+                ON CONFLICT DO NOTHING
+                RETURNING student_id, course_id, enrollment_date, grade
+                """
+            ),
+            enrollment.student_id, enrollment.course_id, enrollment.enrollment_date
         )
-        if not student_exists:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Указанный студент не существует"
-            )
+    if not row:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Студент уже записан на этот курс"
+        )
+
+    report_cache.cache.invalidate(report_cache.course_tag(enrollment.course_id), report_cache.student_tag(enrollment.student_id))
+    return dict(row)
 
-        course_exists = await conn.fetchval(
-            "SELECT EXISTS(SELECT 1 FROM courses.courses WHERE id = $1)",
-            enrollment.course_id
+
+@router.post("/bulk", response_model=schemas.BulkEnrollmentReport)
+async def enroll_students_bulk(
+        data: schemas.BulkEnrollmentCreate,
+        response: Response,
+        conn: asyncpg.Connection = Depends(get_connection)
+):
+    """Записать группу или список студентов на один или несколько курсов.
+
+    Все пары пишутся одним INSERT ... SELECT; уже записанные пары
+    пропускаются и попадают в skipped, ненайденные студенты и курсы -
+    в missing_student_ids и missing_course_ids.
+    """
+
+    if (data.student_ids is None) == (data.group_number is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Укажите либо student_ids, либо group_number"
+        )
+    if not data.course_ids:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Укажите хотя бы один курс"
         )
-        if not course_exists:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Указанный курс не существует"
-            )
 
-        existing_enrollment = await conn.fetchrow(
-            """
-            SELECT id FROM courses.student_course_enrollment 
-            WHERE student_id = $1 AND course_id = $2
-            """,
-            enrollment.student_id, enrollment.course_id
+    course_ids = bulk.check_ids(data.course_ids)
+    student_ids = bulk.check_ids(data.student_ids) if data.student_ids is not None else None
+
+    async with conn.transaction():
+        result = await bulk_enrollment.enroll(
+            conn,
+            course_ids,
+            data.enrollment_date or date.today(),
+            student_ids=student_ids,
+            group_number=data.group_number
         )
-        if existing_enrollment:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Студент уже записан на этот курс"
-            )
 
-        row = await conn.fetchrow(
-            """
-            INSERT INTO courses.student_course_enrollment (student_id, course_id, enrollment_date)
-            VALUES ($1, $2, $3)
-            RETURNING student_id, course_id, enrollment_date, grade
-            """,
-            enrollment.student_id, enrollment.course_id, enrollment.enrollment_date
+    if result["created"]:
+        report_cache.cache.invalidate(
+            *{report_cache.course_tag(pair["course_id"]) for pair in result["created"]},
+            *{report_cache.student_tag(pair["student_id"]) for pair in result["created"]}
         )
-        return dict(row)
+        response.status_code = status.HTTP_201_CREATED
+    return result
 
 
 @router.get("/", response_model=List[schemas.EnrollmentWithDetails])
 async def get_enrollments(
+        response: Response,
         skip: int = Query(0, ge=0),
         limit: int = Query(100, le=1000),
+        cursor: Optional[str] = None,
+        with_total: bool = False,
         student_id: Optional[int] = None,
         course_id: Optional[int] = None,
+        fields: Optional[str] = None,
         conn: asyncpg.Connection = Depends(get_connection)
 ):
     """Получить список записей на курсы"""
 
-    query = """
-        SELECT sce.*, s.first_name, s.last_name, s.group_number, c.title, c.description
+    selection = fieldsets.ENROLLMENTS.parse(fields)
+    columns = fieldsets.ENROLLMENTS.select(selection, pagination.ENROLLMENTS)
+
+    query = f"""
+        SELECT {columns}
         FROM courses.student_course_enrollment sce
         JOIN courses.students s ON sce.student_id = s.id
         JOIN courses.courses c ON sce.course_id = c.id
@@ -90,28 +133,22 @@ async def get_enrollments(
         params.append(course_id)
         param_count += 1
 
-    query += f" ORDER BY sce.enrollment_date DESC OFFSET ${param_count} LIMIT ${param_count + 1}"
+    if with_total:
+        await pagination.set_total_count(response, conn, query, params)
+
+    if cursor:
+        query += pagination.ENROLLMENTS.condition(param_count)
+        params.extend(pagination.ENROLLMENTS.decode(cursor))
+        param_count += len(pagination.ENROLLMENTS.columns)
+
+    query += f" ORDER BY {pagination.ENROLLMENTS.order_by} OFFSET ${param_count} LIMIT ${param_count + 1}"
     params.extend([skip, limit])
 
     rows = await conn.fetch(query, *params)
 
-    enrollments = []
-    for row in rows:
-        enrollment_dict = dict(row)
-        enrollment_dict['student'] = {
-            'id': row['student_id'],
-            'first_name': row['first_name'],
-            'last_name': row['last_name'],
-            'group_number': row['group_number']
-        }
-        enrollment_dict['course'] = {
-            'id': row['course_id'],
-            'title': row['title'],
-            'description': row['description']
-        }
-        enrollments.append(enrollment_dict)
-
-    return enrollments
+    pagination.set_next_cursor(response, pagination.ENROLLMENTS, rows, limit)
+
+    return fieldsets.ENROLLMENTS.respond(selection, fieldsets.ENROLLMENTS.build_all(selection, rows), response)
 
 
 @router.put("/", response_model=schemas.Enrollment)
@@ -123,19 +160,6 @@ async def update_grade(
 ):
     """Обновить оценку студента за курс"""
 
-    existing = await conn.fetchrow(
-        """
-        SELECT student_id, course_id FROM courses.student_course_enrollment 
-        WHERE student_id = $1 AND course_id = $2
-        """,
-        student_id, course_id
-    )
-    if not existing:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Запись на курс не найдена"
-        )
-
     row = await conn.fetchrow(
         """
         UPDATE courses.student_course_enrollment
@@ -145,6 +169,13 @@ async def update_grade(
         """,
         grade_update.grade, student_id, course_id
     )
+    if not row:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Запись на курс не найдена"
+        )
+
+    report_cache.cache.invalidate(report_cache.course_tag(course_id), report_cache.student_tag(student_id))
     return dict(row)
 
 
@@ -156,34 +187,46 @@ async def unenroll_student(
 ):
     """Отписать студента от курса"""
 
-    result = await conn.execute(
-        """
-        DELETE FROM courses.student_course_enrollment 
-        WHERE student_id = $1 AND course_id = $2
-        """,
-        student_id, course_id
-    )
-
-    if result == "DELETE 0":
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Запись на курс не найдена"
+    async with conn.transaction():
+        result = await conn.execute(
+            """
+            DELETE FROM courses.student_course_enrollment 
+            WHERE student_id = $1 AND course_id = $2
+            """,
+            student_id, course_id
         )
 
+        if result == "DELETE 0":
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Запись на курс не найдена"
+            )
+
+        await grade_stats.student_unenrolled(conn, course_id)
+
+    report_cache.cache.invalidate(report_cache.course_tag(course_id), report_cache.student_tag(student_id))
+
     return {"message": "Студент успешно отписан от курса"}
 
 @router.get("/", response_model=List[schemas.EnrollmentWithDetails])
 async def get_enrollments(
+        response: Response,
         skip: int = Query(0, ge=0),
         limit: int = Query(100, le=1000),
+        cursor: Optional[str] = None,
+        with_total: bool = False,
         student_id: Optional[int] = None,
         course_id: Optional[int] = None,
+        fields: Optional[str] = None,
         conn: asyncpg.Connection = Depends(get_connection)
 ):
     """Получить список записей на курсы"""
 
-    query = """
-        SELECT sce.*, s.first_name, s.last_name, s.group_number, c.title, c.description
+    selection = fieldsets.ENROLLMENTS.parse(fields)
+    columns = fieldsets.ENROLLMENTS.select(selection, pagination.ENROLLMENTS)
+
+    query = f"""
+        SELECT {columns}
         FROM courses.student_course_enrollment sce
         JOIN courses.students s ON sce.student_id = s.id
         JOIN courses.courses c ON sce.course_id = c.id
@@ -202,7 +245,15 @@ async def get_enrollments(
         params.append(course_id)
         param_count += 1
 
-    query += f" ORDER BY sce.enrollment_date DESC OFFSET ${param_count} LIMIT ${param_count + 1}"
+    if with_total:
+        await pagination.set_total_count(response, conn, query, params)
+
+    if cursor:
+        query += pagination.ENROLLMENTS.condition(param_count)
+        params.extend(pagination.ENROLLMENTS.decode(cursor))
+        param_count += len(pagination.ENROLLMENTS.columns)
+
+    query += f" ORDER BY {pagination.ENROLLMENTS.order_by} OFFSET ${param_count} LIMIT ${param_count + 1}"
     params.extend([skip, limit])
 
     try:
@@ -210,20 +261,6 @@ async def get_enrollments(
     except asyncpg.exceptions.UndefinedTableError:
         return []
 
-    enrollments = []
-    for row in rows:
-        enrollment_dict = dict(row)
-        enrollment_dict['student'] = {
-            'id': row['student_id'],
-            'first_name': row['first_name'],
-            'last_name': row['last_name'],
-            'group_number': row['group_number']
-        }
-        enrollment_dict['course'] = {
-            'id': row['course_id'],
-            'title': row['title'],
-            'description': row['description']
-        }
-        enrollments.append(enrollment_dict)
-
-    return enrollments
+    pagination.set_next_cursor(response, pagination.ENROLLMENTS, rows, limit)
+
+    return fieldsets.ENROLLMENTS.respond(selection, fieldsets.ENROLLMENTS.build_all(selection, rows), response)
@@ -1,8 +1,15 @@
-from fastapi import APIRouter, HTTPException, Query, status, Depends
+from fastapi import APIRouter, HTTPException, Query, Request, status, Depends, Response
 from typing import List, Optional
 import asyncpg
 from datetime import date
 import schemas
+import pagination
+import fieldsets
+import bulk
+import grade_import
+import grade_stats
+import constraints
+import report_cache
 from dependencies import get_connection
 
 router = APIRouter(
@@ -16,53 +23,121 @@ router = APIRouter(
 async def create_grade(grade: schemas.GradeCreate, conn: asyncpg.Connection = Depends(get_connection)):
     """Создать оценку"""
 
-    async with conn.transaction():
-        student_exists = await conn.fetchval(
-            "SELECT EXISTS(SELECT 1 FROM courses.students WHERE id = $1)",
-            grade.student_id
+    # Запись и сводки - один оператор; несуществующие студент или курс
+    # приходят нарушением внешнего ключа с прежним текстом ошибки
+    with constraints.translated():
+        row = await conn.fetchrow(
+            grade_stats.with_grades_added(
+                """
+                INSERT INTO courses.grades (student_id, course_id, assignment_title, grade_value, submission_date)
+                VALUES ($1, $2, $3, $4, $5)
+                RETURNING id, student_id, course_id, assignment_title, grade_value, submission_date
+                """
+            ),
+            grade.student_id, grade.course_id, grade.assignment_title,
+            grade.grade_value, grade.submission_date
         )
-        if not student_exists:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Указанный студент не существует"
-            )
 
-        course_exists = await conn.fetchval(
-            "SELECT EXISTS(SELECT 1 FROM courses.courses WHERE id = $1)",
-            grade.course_id
-        )
-        if not course_exists:
+    report_cache.cache.invalidate(report_cache.course_tag(row['course_id']), report_cache.student_tag(row['student_id']))
+    return dict(row)
+
+
+async def _get_grades_by_ids(conn: asyncpg.Connection, response: Response, ids: List[int], fields: Optional[str]):
+    """Оценки по списку id одним запросом, в порядке ids"""
+
+    selection = fieldsets.GRADES.parse(fields)
+
+    rows = await conn.fetch(
+        f"""
+        SELECT {fieldsets.GRADES.select(selection, pagination.GRADES)}
+        FROM courses.grades g
+        JOIN courses.students s ON g.student_id = s.id
+        JOIN courses.courses c ON g.course_id = c.id
+        WHERE g.id = ANY($1::int[])
+        """,
+        ids
+    )
+    rows = bulk.in_order(response, rows, ids)
+
+    return fieldsets.GRADES.respond(selection, fieldsets.GRADES.build_all(selection, rows), response)
+
+
+@router.post(
+    "/bulk",
+    response_model=schemas.GradeImportReport,
+    openapi_extra={"requestBody": {"content": {"application/json": {}, "text/csv": {}}}}
+)
+async def import_grades(
+        request: Request,
+        response: Response,
+        atomic: bool = False,
+        conn: asyncpg.Connection = Depends(get_connection)
+):
+    """Загрузить пачку оценок из JSON-массива или CSV (Content-Type: text/csv).
+
+    Формат строк проверяется в приложении, студенты, курсы и запись на курс -
+    одним запросом на всю пачку, корректные строки пишутся одним COPY.
+    В ответе - ошибки по номерам строк. atomic=true - при любой ошибке
+    не записывается ничего и возвращается 422 с тем же отчетом.
+    """
+
+    items = grade_import.parse_body(await request.body(), request.headers.get("content-type", ""))
+    records, errors = grade_import.validate_rows(items)
+    records = await grade_import.check_references(conn, records, errors)
+
+    if errors and atomic:
+        response.status_code = status.HTTP_422_UNPROCESSABLE_CONTENT
+        return grade_import.report(len(items), 0, errors)
+
+    rows = [record for _, record in records]
+    if rows:
+        try:
+            async with conn.transaction():
+                await grade_import.load(conn, rows)
+        except asyncpg.exceptions.ForeignKeyViolationError:
             raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Указанный курс не существует"
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Студент или курс удален во время загрузки, повторите запрос"
             )
 
-        row = await conn.fetchrow(
-            """
-            INSERT INTO courses.grades (student_id, course_id, assignment_title, grade_value, submission_date)
-            VALUES ($1, $2, $3, $4, $5)
-            RETURNING id, student_id, course_id, assignment_title, grade_value, submission_date
-            """,
-            grade.student_id, grade.course_id, grade.assignment_title,
-            grade.grade_value, grade.submission_date
+        report_cache.cache.invalidate(
+            *{report_cache.course_tag(row[1]) for row in rows},
+            *{report_cache.student_tag(row[0]) for row in rows}
         )
-        return dict(row)
+
+    response.status_code = status.HTTP_201_CREATED if rows else status.HTTP_200_OK
+    return grade_import.report(len(items), len(rows), errors)
 
 
 @router.get("/", response_model=List[schemas.GradeWithDetails])
 async def get_grades(
+        response: Response,
         skip: int = Query(0, ge=0),
         limit: int = Query(100, le=1000),
+        cursor: Optional[str] = None,
+        with_total: bool = False,
         student_id: Optional[int] = None,
         course_id: Optional[int] = None,
         date_from: Optional[date] = None,
         date_to: Optional[date] = None,
+        fields: Optional[str] = None,
+        ids: Optional[str] = None,
         conn: asyncpg.Connection = Depends(get_connection)
 ):
-    """Получить список оценок"""
+    """Получить список оценок.
+
+    ids=1,2,3 - только эти оценки, в том же порядке; фильтры и страницы
+    не применяются, ненайденные id - в X-Missing-Ids
+    """
+
+    if ids is not None:
+        return await _get_grades_by_ids(conn, response, bulk.parse_ids(ids), fields)
+
+    selection = fieldsets.GRADES.parse(fields)
+    columns = fieldsets.GRADES.select(selection, pagination.GRADES)
 
-    query = """
-        SELECT g.*, s.first_name, s.last_name, s.group_number, c.title as course_title
+    query = f"""
+        SELECT {columns}
         FROM courses.grades g
         JOIN courses.students s ON g.student_id = s.id
         JOIN courses.courses c ON g.course_id = c.id
@@ -91,36 +166,46 @@ async def get_grades(
         params.append(date_to)
         param_count += 1
 
-    query += f" ORDER BY g.submission_date DESC OFFSET ${param_count} LIMIT ${param_count + 1}"
+    if with_total:
+        await pagination.set_total_count(response, conn, query, params)
+
+    if cursor:
+        query += pagination.GRADES.condition(param_count)
+        params.extend(pagination.GRADES.decode(cursor))
+        param_count += len(pagination.GRADES.columns)
+
+    query += f" ORDER BY {pagination.GRADES.order_by} OFFSET ${param_count} LIMIT ${param_count + 1}"
     params.extend([skip, limit])
 
     rows = await conn.fetch(query, *params)
 
-    grades = []
-    for row in rows:
-        grade_dict = dict(row)
-        grade_dict['student'] = {
-            'id': row['student_id'],
-            'first_name': row['first_name'],
-            'last_name': row['last_name'],
-            'group_number': row['group_number']
-        }
-        grade_dict['course'] = {
-            'id': row['course_id'],
-            'title': row['course_title']
-        }
-        grades.append(grade_dict)
+    pagination.set_next_cursor(response, pagination.GRADES, rows, limit)
+
+    return fieldsets.GRADES.respond(selection, fieldsets.GRADES.build_all(selection, rows), response)
 
-    return grades
+
+@router.post("/by-ids", response_model=List[schemas.GradeWithDetails])
+async def get_grades_by_ids(
+        data: schemas.IdsRequest,
+        response: Response,
+        fields: Optional[str] = None,
+        conn: asyncpg.Connection = Depends(get_connection)
+):
+    """Оценки по списку id в теле запроса - для длинных списков, не влезающих в URL"""
+
+    return await _get_grades_by_ids(conn, response, bulk.check_ids(data.ids), fields)
 
 
 @router.get("/{grade_id}", response_model=schemas.GradeWithDetails)
-async def get_grade(grade_id: int, conn: asyncpg.Connection = Depends(get_connection)):
+async def get_grade(grade_id: int, fields: Optional[str] = None, conn: asyncpg.Connection = Depends(get_connection)):
     """Получить оценку по ID"""
 
+    selection = fieldsets.GRADES.parse(fields)
+    columns = fieldsets.GRADES.select(selection)
+
     row = await conn.fetchrow(
-        """
-        SELECT g.*, s.first_name, s.last_name, s.group_number, c.title as course_title
+        f"""
+        SELECT {columns}
         FROM courses.grades g
         JOIN courses.students s ON g.student_id = s.id
         JOIN courses.courses c ON g.course_id = c.id
@@ -135,35 +220,13 @@ async def get_grade(grade_id: int, conn: asyncpg.Connection = Depends(get_connec
             detail="Оценка не найдена"
         )
 
-    grade_dict = dict(row)
-    grade_dict['student'] = {
-        'id': row['student_id'],
-        'first_name': row['first_name'],
-        'last_name': row['last_name'],
-        'group_number': row['group_number']
-    }
-    grade_dict['course'] = {
-        'id': row['course_id'],
-        'title': row['course_title']
-    }
-
-    return grade_dict
+    return fieldsets.GRADES.respond(selection, fieldsets.GRADES.build(selection, row))
 
 
 @router.put("/{grade_id}", response_model=schemas.Grade)
 async def update_grade(grade_id: int, grade_update: schemas.GradeUpdate, conn: asyncpg.Connection = Depends(get_connection)):
     """Обновить оценку"""
 
-    existing = await conn.fetchrow(
-        "SELECT id FROM courses.grades WHERE id = $1",
-        grade_id
-    )
-    if not existing:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Оценка не найдена"
-        )
-
     update_fields = []
     params = []
     param_count = 1
@@ -185,20 +248,34 @@ async def update_grade(grade_id: int, grade_update: schemas.GradeUpdate, conn: a
 
     if not update_fields:
         row = await conn.fetchrow("SELECT * FROM courses.grades WHERE id = $1", grade_id)
+        if not row:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Оценка не найдена"
+            )
         return dict(row)
 
     params.append(grade_id)
 
-    row = await conn.fetchrow(
-        f"""
-        UPDATE courses.grades
+    update_sql = f"""
+        UPDATE courses.grades g
         SET {', '.join(update_fields)}
-        WHERE id = ${param_count}
-        RETURNING *
-        """,
-        *params
-    )
+        FROM (SELECT id, grade_value FROM courses.grades WHERE id = ${param_count} FOR UPDATE) old
+        WHERE g.id = old.id
+        RETURNING g.*, old.grade_value AS old_grade_value
+    """
+    # Без нового значения сводки не меняются; иначе пересчет идет в том же операторе
+    if grade_update.grade_value is not None:
+        update_sql = grade_stats.with_grade_changed(update_sql)
 
+    row = await conn.fetchrow(update_sql, *params)
+    if not row:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Оценка не найдена"
+        )
+
+    report_cache.cache.invalidate(report_cache.course_tag(row['course_id']), report_cache.student_tag(row['student_id']))
     return dict(row)
 
 
@@ -206,17 +283,22 @@ async def update_grade(grade_id: int, grade_update: schemas.GradeUpdate, conn: a
 async def delete_grade(grade_id: int, conn: asyncpg.Connection = Depends(get_connection)):
     """Удалить оценку"""
 
-    result = await conn.execute(
-        "DELETE FROM courses.grades WHERE id = $1",
-        grade_id
-    )
-
-    if result == "DELETE 0":
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Оценка не найдена"
+    async with conn.transaction():
+        row = await conn.fetchrow(
+            "DELETE FROM courses.grades WHERE id = $1 RETURNING student_id, course_id, grade_value",
+            grade_id
         )
 
+        if not row:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Оценка не найдена"
+            )
+
+        await grade_stats.grade_removed(conn, row['student_id'], row['course_id'], row['grade_value'])
+
+    report_cache.cache.invalidate(report_cache.course_tag(row['course_id']), report_cache.student_tag(row['student_id']))
+
 
 @router.get("/average/{student_id}/{course_id}")
 async def get_average_grade(student_id: int, course_id: int, conn: asyncpg.Connection = Depends(get_connection)):
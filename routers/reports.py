@@ -1,7 +1,23 @@
-from fastapi import APIRouter, HTTPException, Query, status, Depends
+from fastapi import APIRouter, HTTPException, Query, Request, status, Depends, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import List, Optional
+import json
+from collections import Counter
 import asyncpg
 from datetime import date, datetime
-from dependencies import get_connection
+import schemas
+from dependencies import conditional_get, get_connection, get_pool, get_report_jobs, get_report_renderer
+from csv_export import csv_response
+import columnar_export
+import data_versions
+import grade_distribution
+import gradebook
+import report_cache
+import report_jobs
+import report_render
+from report_cache import course_tag, student_tag, COURSES_TAG, TEACHERS_TAG, SCHEDULE_TAG
 
 router = APIRouter(
     prefix="/reports",
@@ -10,10 +26,19 @@ router = APIRouter(
 )
 
 
-@router.get("/students-by-course/{course_id}")
-async def get_students_by_course_report(course_id: int, conn: asyncpg.Connection = Depends(get_connection)):
+@router.get(
+    "/students-by-course/{course_id}",
+    dependencies=[Depends(conditional_get("courses", "students", "student_course_enrollment", "grades"))]
+)
+async def get_students_by_course_report(course_id: int, response: Response, conn: asyncpg.Connection = Depends(get_connection), http: bool = report_cache.HTTP):
     """Отчет: Список студентов по курсу"""
 
+    key = ("students-by-course", course_id)
+    cached = report_cache.lookup(response, key, http)
+    if cached is not None:
+        return cached
+    since = report_cache.cache.begin()
+
     rows = await conn.fetch(
         """
         SELECT 
@@ -23,13 +48,12 @@ async def get_students_by_course_report(course_id: int, conn: asyncpg.Connection
             s.group_number,
             sce.enrollment_date,
             sce.grade as final_grade,
-            COUNT(g.id) as assignments_count,
-            AVG(g.grade_value) as average_grade
+            COALESCE(gs.grades_count, 0) as assignments_count,
+            gs.grades_sum / NULLIF(gs.grades_count, 0) as average_grade
         FROM courses.student_course_enrollment sce
         JOIN courses.students s ON sce.student_id = s.id
-        LEFT JOIN courses.grades g ON sce.student_id = g.student_id AND sce.course_id = g.course_id
+        LEFT JOIN courses.course_student_grade_stats gs ON sce.student_id = gs.student_id AND sce.course_id = gs.course_id
         WHERE sce.course_id = $1
-        GROUP BY s.id, s.first_name, s.last_name, s.group_number, sce.enrollment_date, sce.grade
         ORDER BY s.last_name, s.first_name
         """,
         course_id
@@ -46,7 +70,7 @@ async def get_students_by_course_report(course_id: int, conn: asyncpg.Connection
             detail="Курс не найден"
         )
 
-    return {
+    result = {
         "course_id": course_id,
         "course_title": course_info['title'],
         "course_description": course_info['description'],
@@ -54,34 +78,44 @@ async def get_students_by_course_report(course_id: int, conn: asyncpg.Connection
         "total_students": len(rows),
         "students": [dict(row) for row in rows]
     }
+    tags = [course_tag(course_id)] + [student_tag(row['student_id']) for row in rows]
+    return report_cache.store(key, result, tags, since, http)
 
 
-@router.get("/performance-report/{course_id}")
-async def get_performance_report(course_id: int, conn: asyncpg.Connection = Depends(get_connection)):
+@router.get(
+    "/performance-report/{course_id}",
+    dependencies=[Depends(conditional_get("courses", "students", "student_course_enrollment", "grades"))]
+)
+async def get_performance_report(course_id: int, response: Response, conn: asyncpg.Connection = Depends(get_connection), http: bool = report_cache.HTTP):
     """Отчет по успеваемости студентов"""
 
+    key = ("performance-report", course_id)
+    cached = report_cache.lookup(response, key, http)
+    if cached is not None:
+        return cached
+    since = report_cache.cache.begin()
+
     rows = await conn.fetch(
         """
         SELECT 
             s.id as student_id,
             CONCAT(s.first_name, ' ', s.last_name) as student_name,
             s.group_number,
-            COUNT(g.id) as assignments_completed,
-            AVG(g.grade_value) as average_grade,
-            MIN(g.grade_value) as min_grade,
-            MAX(g.grade_value) as max_grade,
+            COALESCE(gs.grades_count, 0) as assignments_completed,
+            gs.grades_sum / NULLIF(gs.grades_count, 0) as average_grade,
+            gs.min_grade,
+            gs.max_grade,
             sce.grade as final_grade,
             CASE 
-                WHEN AVG(g.grade_value) >= 4.5 THEN 'Отлично'
-                WHEN AVG(g.grade_value) >= 3.5 THEN 'Хорошо'
-                WHEN AVG(g.grade_value) >= 2.5 THEN 'Удовлетворительно'
+                WHEN gs.grades_sum / NULLIF(gs.grades_count, 0) >= 4.5 THEN 'Отлично'
+                WHEN gs.grades_sum / NULLIF(gs.grades_count, 0) >= 3.5 THEN 'Хорошо'
+                WHEN gs.grades_sum / NULLIF(gs.grades_count, 0) >= 2.5 THEN 'Удовлетворительно'
                 ELSE 'Неудовлетворительно'
             END as performance_level
         FROM courses.student_course_enrollment sce
         JOIN courses.students s ON sce.student_id = s.id
-        LEFT JOIN courses.grades g ON sce.student_id = g.student_id AND sce.course_id = g.course_id
+        LEFT JOIN courses.course_student_grade_stats gs ON sce.student_id = gs.student_id AND sce.course_id = gs.course_id
         WHERE sce.course_id = $1
-        GROUP BY s.id, s.first_name, s.last_name, s.group_number, sce.grade
         ORDER BY average_grade DESC NULLS LAST
         """,
         course_id
@@ -92,25 +126,122 @@ async def get_performance_report(course_id: int, conn: asyncpg.Connection = Depe
         course_id
     )
 
-    return {
+    levels = Counter(row['performance_level'] for row in rows)
+    result = {
         "course_id": course_id,
         "course_title": course_info['title'] if course_info else "Неизвестный курс",
         "generated_at": datetime.now(),
         "performance_summary": {
             "total_students": len(rows),
-            "excellent": len([r for r in rows if r['performance_level'] == 'Отлично']),
-            "good": len([r for r in rows if r['performance_level'] == 'Хорошо']),
-            "satisfactory": len([r for r in rows if r['performance_level'] == 'Удовлетворительно']),
-            "unsatisfactory": len([r for r in rows if r['performance_level'] == 'Неудовлетворительно'])
+            "excellent": levels['Отлично'],
+            "good": levels['Хорошо'],
+            "satisfactory": levels['Удовлетворительно'],
+            "unsatisfactory": levels['Неудовлетворительно']
         },
         "students": [dict(row) for row in rows]
     }
+    tags = [course_tag(course_id)] + [student_tag(row['student_id']) for row in rows]
+    return report_cache.store(key, result, tags, since, http)
+
+
+@router.get(
+    "/grade-distribution/{course_id}",
+    dependencies=[Depends(conditional_get("courses", "students", "student_course_enrollment", "grades"))]
+)
+async def get_grade_distribution(
+        course_id: int,
+        response: Response,
+        bins: int = Query(grade_distribution.DEFAULT_BINS, ge=1, le=grade_distribution.MAX_BINS),
+        conn: asyncpg.Connection = Depends(get_connection),
+        http: bool = report_cache.HTTP
+):
+    """Распределение оценок по курсу"""
+
+    key = ("grade-distribution", course_id, bins)
+    cached = report_cache.lookup(response, key, http)
+    if cached is not None:
+        return cached
+    since = report_cache.cache.begin()
+
+    course_info = await conn.fetchrow("SELECT title FROM courses.courses WHERE id = $1", course_id)
+    if not course_info:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Курс не найден"
+        )
+
+    stats = await grade_distribution.distribution(
+        conn, "g.course_id = $1", "gs.course_id = $1", course_id, bins
+    )
+
+    result = {
+        "course_id": course_id,
+        "course_title": course_info['title'],
+        "generated_at": datetime.now(),
+        **stats
+    }
+    tags = [course_tag(course_id)] + [student_tag(row['student_id']) for row in stats['students']]
+    return report_cache.store(key, result, tags, since, http)
 
 
-@router.get("/course-report")
-async def get_course_report(conn: asyncpg.Connection = Depends(get_connection)):
+@router.get(
+    "/grade-distribution/group/{group_number}",
+    dependencies=[Depends(conditional_get("students", "student_course_enrollment", "grades"))]
+)
+async def get_group_grade_distribution(
+        group_number: str,
+        response: Response,
+        bins: int = Query(grade_distribution.DEFAULT_BINS, ge=1, le=grade_distribution.MAX_BINS),
+        conn: asyncpg.Connection = Depends(get_connection),
+        http: bool = report_cache.HTTP
+):
+    """Распределение оценок студентов группы по всем курсам"""
+
+    key = ("grade-distribution-group", group_number, bins)
+    cached = report_cache.lookup(response, key, http)
+    if cached is not None:
+        return cached
+    since = report_cache.cache.begin()
+
+    stats = await grade_distribution.distribution(
+        conn,
+        "g.student_id IN (SELECT id FROM courses.students WHERE group_number = $1)",
+        "st.group_number = $1",
+        group_number,
+        bins
+    )
+    course_ids = await conn.fetch(
+        """
+        SELECT DISTINCT gs.course_id
+        FROM courses.course_student_grade_stats gs
+        JOIN courses.students st ON gs.student_id = st.id
+        WHERE st.group_number = $1
+        """,
+        group_number
+    )
+
+    result = {
+        "group_number": group_number,
+        "generated_at": datetime.now(),
+        **stats
+    }
+    tags = [course_tag(row['course_id']) for row in course_ids] + [student_tag(row['student_id']) for row in stats['students']]
+    return report_cache.store(key, result, tags, since, http)
+
+
+@router.get(
+    "/course-report",
+    dependencies=[Depends(conditional_get("courses", "teachers", "student_course_enrollment", "grades"))]
+)
+async def get_course_report(response: Response, conn: asyncpg.Connection = Depends(get_connection), http: bool = report_cache.HTTP):
     """Отчет по курсам и преподавателям"""
 
+    key = ("course-report",)
+    cached = report_cache.lookup(response, key, http)
+    if cached is not None:
+        return cached
+    since = report_cache.cache.begin()
+
     rows = await conn.fetch(
         """
         SELECT 
@@ -120,33 +251,48 @@ async def get_course_report(conn: asyncpg.Connection = Depends(get_connection)):
             c.duration,
             CONCAT(t.first_name, ' ', t.last_name) as teacher_name,
             t.qualification,
-            COUNT(DISTINCT sce.student_id) as enrolled_students,
-            COUNT(DISTINCT g.id) as total_assignments,
-            AVG(g.grade_value) as average_grade
+            COALESCE(cgs.students_count, 0) as enrolled_students,
+            COALESCE(gs.grades_count, 0) as total_assignments,
+            gs.grades_sum / NULLIF(gs.grades_count, 0) as average_grade
         FROM courses.courses c
         JOIN courses.teachers t ON c.teacher_id = t.id
-        LEFT JOIN courses.student_course_enrollment sce ON c.id = sce.course_id
-        LEFT JOIN courses.grades g ON c.id = g.course_id
-        GROUP BY c.id, c.title, c.description, c.duration, t.id, t.first_name, t.last_name, t.qualification
+        LEFT JOIN courses.course_grade_stats cgs ON c.id = cgs.course_id
+        LEFT JOIN (
+            SELECT course_id, SUM(grades_count) as grades_count, SUM(grades_sum) as grades_sum
+            FROM courses.course_student_grade_stats
+            GROUP BY course_id
+        ) gs ON c.id = gs.course_id
         ORDER BY c.title
         """
     )
 
-    return {
+    result = {
         "generated_at": datetime.now(),
         "total_courses": len(rows),
         "courses": [dict(row) for row in rows]
     }
+    tags = [COURSES_TAG, TEACHERS_TAG] + [course_tag(row['course_id']) for row in rows]
+    return report_cache.store(key, result, tags, since, http)
 
 
-@router.get("/schedule-report/{start_date}/{end_date}")
-async def get_schedule_report(start_date: date, end_date: date, conn: asyncpg.Connection = Depends(get_connection)):
+@router.get(
+    "/schedule-report/{start_date}/{end_date}",
+    dependencies=[Depends(conditional_get("schedule", "courses", "teachers", "users", "students", "student_course_enrollment", "grades"))]
+)
+async def get_schedule_report(start_date: date, end_date: date, response: Response, conn: asyncpg.Connection = Depends(get_connection), http: bool = report_cache.HTTP):
     """Отчет: Расписание курсов и занятий"""
 
+    key = ("schedule-report", start_date, end_date)
+    cached = report_cache.lookup(response, key, http)
+    if cached is not None:
+        return cached
+    since = report_cache.cache.begin()
+
     rows = await conn.fetch(
         """
         SELECT 
             DATE(s.start_date_time) as schedule_date,
+            c.id as course_id,
             c.title as course_title,
             CONCAT(t.first_name, ' ', t.last_name) as teacher_name,
             s.start_date_time,
@@ -158,7 +304,7 @@ async def get_schedule_report(start_date: date, end_date: date, conn: asyncpg.Co
         JOIN courses.teachers t ON c.teacher_id = t.id
         LEFT JOIN courses.student_course_enrollment sce ON c.id = sce.course_id
         WHERE DATE(s.start_date_time) BETWEEN $1 AND $2
-        GROUP BY DATE(s.start_date_time), c.title, t.first_name, t.last_name, 
+        GROUP BY DATE(s.start_date_time), c.id, c.title, t.first_name, t.last_name, 
                  s.start_date_time, s.end_date_time
         ORDER BY s.start_date_time
         """,
@@ -180,27 +326,94 @@ async def get_schedule_report(start_date: date, end_date: date, conn: asyncpg.Co
             'enrolled_students': row['enrolled_students']
         })
 
-    return {
+    result = {
         "start_date": start_date,
         "end_date": end_date,
         "generated_at": datetime.now(),
         "schedule_by_day": schedule_by_day
     }
+    tags = [SCHEDULE_TAG, TEACHERS_TAG] + [course_tag(row['course_id']) for row in rows]
+    return report_cache.store(key, result, tags, since, http)
+
+
+# Ведомости успеваемости: одни и те же запросы для одного студента и для пачки
+_STUDENT_INFO_SQL = """
+SELECT s.*, u.username, u.email
+FROM courses.students s
+JOIN courses.users u ON s.user_id = u.id
+WHERE {where}
+ORDER BY s.id
+"""
+
+_STUDENT_COURSES_SQL = """
+SELECT 
+    sce.student_id,
+    c.id as course_id,
+    c.title as course_title,
+    c.description,
+    CONCAT(t.first_name, ' ', t.last_name) as teacher_name,
+    sce.enrollment_date,
+    sce.grade as final_grade,
+    COALESCE(gs.grades_count, 0) as assignments_count,
+    gs.grades_sum / NULLIF(gs.grades_count, 0) as average_grade,
+    gs.min_grade,
+    gs.max_grade,
+    gs.grades_sum
+FROM courses.student_course_enrollment sce
+JOIN courses.courses c ON sce.course_id = c.id
+JOIN courses.teachers t ON c.teacher_id = t.id
+LEFT JOIN courses.course_student_grade_stats gs ON sce.student_id = gs.student_id AND sce.course_id = gs.course_id
+WHERE sce.student_id = ANY($1::int[])
+ORDER BY sce.student_id, sce.enrollment_date DESC
+"""
+
+STATEMENTS_BATCH_LIMIT = 5000
+
+
+def _student_statement(student_info, rows, generated_at: datetime) -> dict:
+    """Собрать ведомость студента из строк _STUDENT_COURSES_SQL"""
+
+    total_assignments = sum(row['assignments_count'] for row in rows)
+    total_sum = sum(row['grades_sum'] or 0 for row in rows)
+
+    courses = []
+    for row in rows:
+        course = dict(row)
+        del course['student_id'], course['grades_sum']
+        courses.append(course)
 
+    return {
+        "student": {
+            "id": student_info['id'],
+            "name": f"{student_info['first_name']} {student_info['last_name']}",
+            "group_number": student_info['group_number'],
+            "username": student_info['username'],
+            "email": student_info['email']
+        },
+        "generated_at": generated_at,
+        "overall_statistics": {
+            "total_courses": len(rows),
+            "total_assignments": total_assignments,
+            "overall_average": float(total_sum / total_assignments) if total_assignments else 0.0
+        },
+        "courses": courses
+    }
 
-@router.get("/student-performance/{student_id}")
-async def get_student_performance_report(student_id: int, conn: asyncpg.Connection = Depends(get_connection)):
+
+@router.get(
+    "/student-performance/{student_id}",
+    dependencies=[Depends(conditional_get("students", "users", "courses", "teachers", "student_course_enrollment", "grades"))]
+)
+async def get_student_performance_report(student_id: int, response: Response, conn: asyncpg.Connection = Depends(get_connection), http: bool = report_cache.HTTP):
     """Ведомость успеваемости студента"""
 
-    student_info = await conn.fetchrow(
-        """
-        SELECT s.*, u.username, u.email
-        FROM courses.students s
-        JOIN courses.users u ON s.user_id = u.id
-        WHERE s.id = $1
-        """,
-        student_id
-    )
+    key = ("student-performance", student_id)
+    cached = report_cache.lookup(response, key, http)
+    if cached is not None:
+        return cached
+    since = report_cache.cache.begin()
+
+    student_info = await conn.fetchrow(_STUDENT_INFO_SQL.format(where="s.id = $1"), student_id)
 
     if not student_info:
         raise HTTPException(
@@ -208,66 +421,98 @@ async def get_student_performance_report(student_id: int, conn: asyncpg.Connecti
             detail="Студент не найден"
         )
 
-    rows = await conn.fetch(
-        """
-        SELECT 
-            c.id as course_id,
-            c.title as course_title,
-            c.description,
-            CONCAT(t.first_name, ' ', t.last_name) as teacher_name,
-            sce.enrollment_date,
-            sce.grade as final_grade,
-            COUNT(g.id) as assignments_count,
-            AVG(g.grade_value) as average_grade,
-            MIN(g.grade_value) as min_grade,
-            MAX(g.grade_value) as max_grade
-        FROM courses.student_course_enrollment sce
-        JOIN courses.courses c ON sce.course_id = c.id
-        JOIN courses.teachers t ON c.teacher_id = t.id
-        LEFT JOIN courses.grades g ON sce.student_id = g.student_id AND sce.course_id = g.course_id
-        WHERE sce.student_id = $1
-        GROUP BY c.id, c.title, c.description, t.first_name, t.last_name, sce.enrollment_date, sce.grade
-        ORDER BY sce.enrollment_date DESC
-        """,
-        student_id
-    )
+    rows = await conn.fetch(_STUDENT_COURSES_SQL, [student_id])
 
-    total_stats = await conn.fetchrow(
-        """
-        SELECT 
-            COUNT(DISTINCT sce.course_id) as total_courses,
-            COUNT(g.id) as total_assignments,
-            AVG(g.grade_value) as overall_average
-        FROM courses.student_course_enrollment sce
-        LEFT JOIN courses.grades g ON sce.student_id = g.student_id AND sce.course_id = g.course_id
-        WHERE sce.student_id = $1
-        """,
-        student_id
+    result = _student_statement(student_info, rows, datetime.now())
+    tags = [student_tag(student_id), TEACHERS_TAG] + [course_tag(row['course_id']) for row in rows]
+    return report_cache.store(key, result, tags, since, http)
+
+
+async def _iter_student_statements(pool: asyncpg.Pool, student_ids: Optional[List[int]], group_number: Optional[str]):
+    """NDJSON: по строке на ведомость, всего два запроса на любую пачку.
+
+    Строки по курсам читаются курсором в порядке student_id и склеиваются
+    со списком студентов на лету, в памяти держится одна ведомость.
+    """
+
+    async with pool.acquire() as conn:
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            if student_ids is not None:
+                students = await conn.fetch(_STUDENT_INFO_SQL.format(where="s.id = ANY($1::int[])"), student_ids)
+            else:
+                students = await conn.fetch(_STUDENT_INFO_SQL.format(where="s.group_number = $1"), group_number)
+
+            generated_at = datetime.now()
+            index = 0
+            rows = []
+            async for row in conn.cursor(_STUDENT_COURSES_SQL, [s['id'] for s in students]):
+                while students[index]['id'] != row['student_id']:
+                    yield _ndjson_line(_student_statement(students[index], rows, generated_at))
+                    rows = []
+                    index += 1
+                rows.append(row)
+
+            for student in students[index:]:
+                yield _ndjson_line(_student_statement(student, rows, generated_at))
+                rows = []
+
+    if student_ids is not None:
+        found = {s['id'] for s in students}
+        for student_id in student_ids:
+            if student_id not in found:
+                yield _ndjson_line({"student_id": student_id, "error": "Студент не найден"})
+
+
+def _ndjson_line(obj) -> bytes:
+    return (json.dumps(jsonable_encoder(obj), ensure_ascii=False) + "\n").encode("utf-8")
+
+
+@router.post("/student-performance/batch")
+async def get_student_performance_batch(batch: schemas.StudentStatementsBatch, pool: asyncpg.Pool = Depends(get_pool)):
+    """Ведомости успеваемости для списка студентов или группы (NDJSON)"""
+
+    if (batch.student_ids is None) == (batch.group_number is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Укажите либо student_ids, либо group_number"
+        )
+
+    student_ids = None
+    if batch.student_ids is not None:
+        student_ids = list(dict.fromkeys(batch.student_ids))
+        if len(student_ids) > STATEMENTS_BATCH_LIMIT:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Не больше {STATEMENTS_BATCH_LIMIT} студентов за запрос"
+            )
+
+    return StreamingResponse(
+        _iter_student_statements(pool, student_ids, batch.group_number),
+        media_type="application/x-ndjson"
     )
 
-    return {
-        "student": {
-            "id": student_info['id'],
-            "name": f"{student_info['first_name']} {student_info['last_name']}",
-            "group_number": student_info['group_number'],
-            "username": student_info['username'],
-            "email": student_info['email']
-        },
-        "generated_at": datetime.now(),
-        "overall_statistics": {
-            "total_courses": total_stats['total_courses'] or 0,
-            "total_assignments": total_stats['total_assignments'] or 0,
-            "overall_average": float(total_stats['overall_average'] or 0)
-        },
-        "courses": [dict(row) for row in rows]
-    }
+
+@router.get("/cache/stats")
+async def get_report_cache_stats():
+    """Счетчики кэша отчетов"""
+
+    return report_cache.cache.stats()
 
 
 @router.get("/export/csv/students/{course_id}")
-async def export_students_csv(course_id: int, conn: asyncpg.Connection = Depends(get_connection)):
+async def export_students_csv(course_id: int, pool: asyncpg.Pool = Depends(get_pool)):
     """Экспорт списка студентов курса в CSV"""
 
-    rows = await conn.fetch(
+    return csv_response(
+        pool,
+        f"students_course_{course_id}.csv",
+        [
+            ("Имя", "first_name"),
+            ("Фамилия", "last_name"),
+            ("Группа", "group_number"),
+            ("Дата записи", "enrollment_date"),
+            ("Итоговая оценка", "final_grade"),
+        ],
         """
         SELECT 
             s.first_name,
@@ -283,20 +528,259 @@ async def export_students_csv(course_id: int, conn: asyncpg.Connection = Depends
         course_id
     )
 
-    output = []
-    output.append("Имя,Фамилия,Группа,Дата записи,Итоговая оценка")
 
-    for row in rows:
-        output.append(f"{row['first_name']},{row['last_name']},{row['group_number']},"
-                      f"{row['enrollment_date']},{row['final_grade'] or ''}")
+@router.get("/export/csv/grades")
+async def export_grades_csv(
+        course_id: Optional[int] = None,
+        student_id: Optional[int] = None,
+        pool: asyncpg.Pool = Depends(get_pool)
+):
+    """Экспорт оценок в CSV (все, по курсу или по студенту)"""
+
+    filename = "grades"
+    if course_id:
+        filename += f"_course_{course_id}"
+    if student_id:
+        filename += f"_student_{student_id}"
+
+    return csv_response(
+        pool,
+        f"{filename}.csv",
+        [
+            ("ID", "id"),
+            ("Курс", "course_title"),
+            ("Имя", "first_name"),
+            ("Фамилия", "last_name"),
+            ("Группа", "group_number"),
+            ("Задание", "assignment_title"),
+            ("Оценка", "grade_value"),
+            ("Дата сдачи", "submission_date"),
+        ],
+        """
+        SELECT g.id, c.title as course_title, s.first_name, s.last_name, s.group_number,
+               g.assignment_title, g.grade_value, g.submission_date
+        FROM courses.grades g
+        JOIN courses.students s ON g.student_id = s.id
+        JOIN courses.courses c ON g.course_id = c.id
+        WHERE ($1::int IS NULL OR g.course_id = $1)
+          AND ($2::int IS NULL OR g.student_id = $2)
+        ORDER BY g.course_id, g.submission_date, g.id
+        """,
+        course_id, student_id
+    )
 
-    return {
-        "filename": f"students_course_{course_id}.csv",
-        "content": "\n".join(output),
-        "content_type": "text/csv"
+
+@router.get("/export/csv/enrollments")
+async def export_enrollments_csv(
+        course_id: Optional[int] = None,
+        student_id: Optional[int] = None,
+        pool: asyncpg.Pool = Depends(get_pool)
+):
+    """Экспорт записей на курсы в CSV"""
+
+    filename = "enrollments"
+    if course_id:
+        filename += f"_course_{course_id}"
+    if student_id:
+        filename += f"_student_{student_id}"
+
+    return csv_response(
+        pool,
+        f"{filename}.csv",
+        [
+            ("Курс", "course_title"),
+            ("Имя", "first_name"),
+            ("Фамилия", "last_name"),
+            ("Группа", "group_number"),
+            ("Дата записи", "enrollment_date"),
+            ("Итоговая оценка", "grade"),
+        ],
+        """
+        SELECT c.title as course_title, s.first_name, s.last_name, s.group_number,
+               sce.enrollment_date, sce.grade
+        FROM courses.student_course_enrollment sce
+        JOIN courses.students s ON sce.student_id = s.id
+        JOIN courses.courses c ON sce.course_id = c.id
+        WHERE ($1::int IS NULL OR sce.course_id = $1)
+          AND ($2::int IS NULL OR sce.student_id = $2)
+        ORDER BY c.title, s.last_name, s.first_name
+        """,
+        course_id, student_id
+    )
+
+@router.get("/gradebook/{course_id}")
+async def export_gradebook(
+        course_id: int,
+        fmt: str = Query("json", alias="format"),
+        conn: asyncpg.Connection = Depends(get_connection),
+        pool: asyncpg.Pool = Depends(get_pool)
+):
+    """Ведомость курса: строка на студента, колонка на задание и итоговая оценка (json, csv, xlsx)"""
+
+    course_info = await conn.fetchrow("SELECT title FROM courses.courses WHERE id = $1", course_id)
+    if not course_info:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Курс не найден"
+        )
+
+    return await gradebook.export(pool, course_id, course_info['title'], fmt)
+
+
+@router.get("/export/columnar/{dataset}")
+async def export_columnar(
+        dataset: str,
+        fmt: str = Query("parquet", alias="format", description="parquet или arrow (IPC stream)"),
+        course_id: Optional[int] = None,
+        student_id: Optional[int] = None,
+        teacher_id: Optional[int] = None,
+        group_number: Optional[str] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        pool: asyncpg.Pool = Depends(get_pool)
+):
+    """Экспорт набора данных (courses, students, grades, schedule, performance) в Parquet/Arrow"""
+
+    params = {
+        "course_id": course_id,
+        "student_id": student_id,
+        "teacher_id": teacher_id,
+        "group_number": group_number,
+        "date_from": date_from,
+        "date_to": date_to,
+    }
+    return await columnar_export.export(pool, dataset, fmt, params)
+
+
+class _CourseParams(BaseModel):
+    course_id: int
+
+
+class _StudentParams(BaseModel):
+    student_id: int
+
+
+class _PeriodParams(BaseModel):
+    start_date: date
+    end_date: date
+
+
+class _NoParams(BaseModel):
+    pass
+
+
+# Отчеты, которые можно поставить в фоновую очередь:
+# тип -> (модель параметров, обработчик, позиционные аргументы из параметров)
+REPORT_JOB_TYPES = {
+    "students-by-course": (_CourseParams, get_students_by_course_report, lambda p: (p.course_id,)),
+    "performance-report": (_CourseParams, get_performance_report, lambda p: (p.course_id,)),
+    "course-report": (_NoParams, get_course_report, lambda p: ()),
+    "schedule-report": (_PeriodParams, get_schedule_report, lambda p: (p.start_date, p.end_date)),
+    "student-performance": (_StudentParams, get_student_performance_report, lambda p: (p.student_id,)),
+}
+
+
+@router.post("/jobs", response_model=schemas.ReportJob, status_code=status.HTTP_202_ACCEPTED)
+async def create_report_job(job: schemas.ReportJobCreate, jobs: report_jobs.ReportJobManager = Depends(get_report_jobs)):
+    """Поставить отчет в фоновую очередь"""
+
+    if job.report not in REPORT_JOB_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Неизвестный отчет. Доступны: {', '.join(REPORT_JOB_TYPES)}"
+        )
+
+    params_model, handler, args_of = REPORT_JOB_TYPES[job.report]
+    try:
+        args = args_of(params_model(**job.params))
+    except ValidationError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Неверные параметры отчета: {e}")
+
+    created = jobs.submit(job.report, job.params, lambda conn: handler(*args, Response(), conn, http=False))
+    return created.to_dict()
+
+
+@router.get("/jobs/{job_id}", response_model=schemas.ReportJob)
+async def get_report_job(job_id: str, jobs: report_jobs.ReportJobManager = Depends(get_report_jobs)):
+    """Статус фонового отчета"""
+
+    return jobs.get(job_id).to_dict()
+
+
+@router.get("/jobs/{job_id}/result")
+async def get_report_job_result(job_id: str, jobs: report_jobs.ReportJobManager = Depends(get_report_jobs)):
+    """Скачать результат фонового отчета"""
+
+    job = jobs.get(job_id)
+    if job.status == report_jobs.EXPIRED:
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="Результат отчета удален по сроку хранения")
+    if job.status == report_jobs.FAILED:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Отчет завершился с ошибкой: {job.error}")
+    if job.status != report_jobs.DONE:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Отчет еще не готов")
+
+    return FileResponse(
+        jobs.result_path(job),
+        media_type="application/json",
+        filename=f"{job.report}_{job.id}.json"
+    )
+
+
+@router.get("/render/{report}", dependencies=[Depends(conditional_get(*data_versions.TABLES))])
+async def render_report(
+        report: str,
+        request: Request,
+        response: Response,
+        fmt: str = Query("xlsx", alias="format"),
+        conn: asyncpg.Connection = Depends(get_connection),
+        renderer: report_render.ReportRenderer = Depends(get_report_renderer)
+):
+    """Отчет в виде XLSX или PDF; параметры отчета передаются в строке запроса"""
+
+    if report not in report_render.LAYOUTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Неизвестный отчет. Доступны: {', '.join(report_render.LAYOUTS)}"
+        )
+    report_render.check_format(fmt)
+
+    params_model, handler, args_of = REPORT_JOB_TYPES[report]
+    params = {name: value for name, value in request.query_params.items() if name != "format"}
+    try:
+        args = args_of(params_model(**params))
+    except ValidationError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Неверные параметры отчета: {e}")
+
+    # Готовый файл кэшируется с теми же тегами, что и сам отчет,
+    # поэтому инвалидация данных сбрасывает и отрендеренные версии
+    render_key = ("render", fmt, report) + args
+    headers = {
+        "Content-Disposition": f'attachment; filename="{report}.{fmt}"',
+        "Cache-Control": "private, no-cache",
+        "ETag": response.headers["ETag"]
     }
+    hit = report_cache.cache.get(render_key)
+    if hit is not None:
+        content, age = hit
+        headers.update({"X-Cache": "HIT", "Age": str(int(age))})
+        return Response(content, media_type=report_render.FORMATS[fmt], headers=headers)
+    since = report_cache.cache.begin()
 
-@router.get("/students-by-course/{course_id}")
+    result = await handler(*args, Response(), conn, http=False)
+    content = await renderer.render(fmt, report, result)
+
+    tags = report_cache.cache.tags_of((report,) + args)
+    if tags is not None:
+        report_cache.cache.set(render_key, content, tags, since)
+
+    headers.update({"X-Cache": "MISS", "Age": "0"})
+    return Response(content, media_type=report_render.FORMATS[fmt], headers=headers)
+
+
+@router.get(
+    "/students-by-course/{course_id}",
+    dependencies=[Depends(conditional_get("courses", "students", "student_course_enrollment", "grades"))]
+)
 async def get_students_by_course_report(course_id: int, conn: asyncpg.Connection = Depends(get_connection)):
     """Отчет: Список студентов по курсу"""
 
@@ -310,13 +794,12 @@ async def get_students_by_course_report(course_id: int, conn: asyncpg.Connection
                 s.group_number,
                 sce.enrollment_date,
                 sce.grade as final_grade,
-                COUNT(g.id) as assignments_count,
-                AVG(g.grade_value) as average_grade
+                COALESCE(gs.grades_count, 0) as assignments_count,
+                gs.grades_sum / NULLIF(gs.grades_count, 0) as average_grade
             FROM courses.student_course_enrollment sce
             JOIN courses.students s ON sce.student_id = s.id
-            LEFT JOIN courses.grades g ON sce.student_id = g.student_id AND sce.course_id = g.course_id
+            LEFT JOIN courses.course_student_grade_stats gs ON sce.student_id = gs.student_id AND sce.course_id = gs.course_id
             WHERE sce.course_id = $1
-            GROUP BY s.id, s.first_name, s.last_name, s.group_number, sce.enrollment_date, sce.grade
             ORDER BY s.last_name, s.first_name
             """,
             course_id
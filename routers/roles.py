@@ -2,7 +2,7 @@ from fastapi import APIRouter, HTTPException, status, Depends
 from typing import List
 import asyncpg
 from schemas import Role
-from dependencies import get_connection
+from dependencies import conditional_get, get_connection
 
 router = APIRouter(
     prefix="/roles",
@@ -11,7 +11,7 @@ router = APIRouter(
 )
 
 
-@router.get("/", response_model=List[Role])
+@router.get("/", response_model=List[Role], dependencies=[Depends(conditional_get("roles"))])
 async def get_all_roles(conn: asyncpg.Connection = Depends(get_connection)):
     """Получить список всех ролей"""
 
@@ -25,7 +25,7 @@ async def get_all_roles(conn: asyncpg.Connection = Depends(get_connection)):
         )
 
 
-@router.get("/{role_id}", response_model=Role)
+@router.get("/{role_id}", response_model=Role, dependencies=[Depends(conditional_get("roles"))])
 async def get_role_by_id(role_id: int, conn: asyncpg.Connection = Depends(get_connection)):
     """Получить роль по ID"""
 
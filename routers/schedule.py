@@ -1,9 +1,16 @@
-from fastapi import APIRouter, HTTPException, Query, status, Depends
+from fastapi import APIRouter, HTTPException, Query, status, Depends, Response
 from typing import List, Optional
 import asyncpg
 from datetime import date
 import schemas
-from dependencies import get_connection
+import bulk
+import pagination
+import fieldsets
+import report_cache
+import constraints
+import schedule_conflicts
+import schedule_series
+from dependencies import conditional_get, get_connection
 
 router = APIRouter(
     prefix="/schedule",
@@ -16,47 +23,173 @@ router = APIRouter(
 async def create_schedule_item(schedule: schemas.ScheduleCreate, conn: asyncpg.Connection = Depends(get_connection)):
     """Создать элемент расписания"""
 
-    async with conn.transaction():
-        course_exists = await conn.fetchval(
-            "SELECT EXISTS(SELECT 1 FROM courses.courses WHERE id = $1)",
-            schedule.course_id
+    if schedule.start_date_time >= schedule.end_date_time:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Время начала должно быть раньше времени окончания"
         )
-        if not course_exists:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Указанный курс не существует"
+
+    # Несуществующий курс - нарушение внешнего ключа с прежним текстом ошибки,
+    # занятость преподавателя - исключающее ограничение (поиск по GiST-индексу)
+    with constraints.translated():
+        try:
+            row = await conn.fetchrow(
+                """
+                INSERT INTO courses.schedule (course_id, start_date_time, end_date_time)
+                VALUES ($1, $2, $3)
+                RETURNING id, course_id, start_date_time, end_date_time
+                """,
+                schedule.course_id, schedule.start_date_time, schedule.end_date_time
             )
+        except asyncpg.exceptions.ExclusionViolationError:
+            # Подробности конфликта - отдельным запросом, только на этом пути
+            await schedule_conflicts.check(conn, [(schedule.course_id, schedule.start_date_time, schedule.end_date_time)])
+            raise
+
+    report_cache.cache.invalidate(report_cache.SCHEDULE_TAG)
+    return dict(row)
 
-        if schedule.start_date_time >= schedule.end_date_time:
+
+@router.post("/bulk", response_model=List[schemas.Schedule], status_code=status.HTTP_201_CREATED)
+async def create_schedule_items_bulk(data: schemas.ScheduleBulkCreate, conn: asyncpg.Connection = Depends(get_connection)):
+    """Создать занятия пачкой (например, расписание на семестр).
+
+    Все занятия проверяются на пересечения у преподавателей одним проходом
+    в памяти - и между собой, и с уже записанным расписанием; при конфликтах
+    ничего не записывается, а в ответе 409 перечислены все конфликты.
+    """
+
+    if not data.items:
+        return []
+    if len(data.items) > bulk.SCHEDULE_BULK_LIMIT:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Не больше {bulk.SCHEDULE_BULK_LIMIT} занятий за запрос"
+        )
+    for number, item in enumerate(data.items):
+        if item.start_date_time >= item.end_date_time:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Время начала должно быть раньше времени окончания"
+                detail=f"Занятие {number}: время начала должно быть раньше времени окончания"
             )
 
-        row = await conn.fetchrow(
-            """
-            INSERT INTO courses.schedule (course_id, start_date_time, end_date_time)
-            VALUES ($1, $2, $3)
-            RETURNING id, course_id, start_date_time, end_date_time
-            """,
-            schedule.course_id, schedule.start_date_time, schedule.end_date_time
+    items = [(item.course_id, item.start_date_time, item.end_date_time) for item in data.items]
+    await schedule_conflicts.check(conn, items)
+
+    with constraints.translated():
+        try:
+            rows = await conn.fetch(
+                """
+                INSERT INTO courses.schedule (course_id, start_date_time, end_date_time)
+                SELECT * FROM unnest($1::int[], $2::timestamp[], $3::timestamp[])
+                RETURNING id, course_id, start_date_time, end_date_time
+                """,
+                [item[0] for item in items], [item[1] for item in items], [item[2] for item in items]
+            )
+        except asyncpg.exceptions.ExclusionViolationError:
+            # Пересекающееся занятие записали между проверкой и записью
+            await schedule_conflicts.check(conn, items)
+            raise
+
+    report_cache.cache.invalidate(report_cache.SCHEDULE_TAG)
+    return [dict(row) for row in rows]
+
+
+@router.post("/series", response_model=schemas.ScheduleSeries, status_code=status.HTTP_201_CREATED)
+async def create_schedule_series(series: schemas.ScheduleSeriesCreate, conn: asyncpg.Connection = Depends(get_connection)):
+    """Создать серию занятий: по дням недели в заданное время на весь период,
+    кроме дат-исключений. Все занятия создаются одним запросом."""
+
+    with constraints.translated():
+        row = await schedule_series.create(conn, series)
+
+    report_cache.cache.invalidate(report_cache.SCHEDULE_TAG)
+    return dict(row)
+
+
+@router.get("/series", response_model=List[schemas.ScheduleSeries])
+async def get_schedule_series_list(course_id: Optional[int] = None, conn: asyncpg.Connection = Depends(get_connection)):
+    """Получить серии занятий (всех курсов или одного)"""
+
+    if course_id is not None:
+        rows = await conn.fetch(schedule_series.SELECT_SQL + " WHERE ss.course_id = $1 ORDER BY ss.id", course_id)
+    else:
+        rows = await conn.fetch(schedule_series.SELECT_SQL + " ORDER BY ss.id")
+    return [dict(row) for row in rows]
+
+
+@router.get("/series/{series_id}", response_model=schemas.ScheduleSeries)
+async def get_schedule_series(series_id: int, conn: asyncpg.Connection = Depends(get_connection)):
+    """Получить серию занятий по ID"""
+
+    row = await conn.fetchrow(schedule_series.SELECT_SQL + " WHERE ss.id = $1", series_id)
+    if not row:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Серия занятий не найдена"
         )
-        return dict(row)
+    return dict(row)
+
 
+@router.put("/series/{series_id}", response_model=schemas.ScheduleSeries)
+async def update_schedule_series(
+        series_id: int,
+        series_update: schemas.ScheduleSeriesUpdate,
+        conn: asyncpg.Connection = Depends(get_connection)
+):
+    """Изменить серию занятий.
+
+    Занятия приводятся к новому шаблону тем же запросом: лишние удаляются,
+    недостающие добавляются, у остальных время берется из шаблона.
+    """
+
+    with constraints.translated():
+        row = await schedule_series.update(conn, series_id, series_update)
+    if not row:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Серия занятий не найдена"
+        )
 
-@router.get("/", response_model=List[schemas.ScheduleWithCourse])
+    report_cache.cache.invalidate(report_cache.SCHEDULE_TAG)
+    return dict(row)
+
+
+@router.delete("/series/{series_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_schedule_series(series_id: int, conn: asyncpg.Connection = Depends(get_connection)):
+    """Удалить серию вместе со всеми ее занятиями"""
+
+    result = await conn.execute("DELETE FROM courses.schedule_series WHERE id = $1", series_id)
+    if result == "DELETE 0":
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Серия занятий не найдена")
+
+    report_cache.cache.invalidate(report_cache.SCHEDULE_TAG)
+
+
+@router.get(
+    "/",
+    response_model=List[schemas.ScheduleWithCourse],
+    dependencies=[Depends(conditional_get("schedule", "courses", "teachers"))]
+)
 async def get_schedule(
+        response: Response,
         skip: int = Query(0, ge=0),
         limit: int = Query(100, le=1000),
+        cursor: Optional[str] = None,
+        with_total: bool = False,
         course_id: Optional[int] = None,
         date_from: Optional[date] = None,
         date_to: Optional[date] = None,
+        fields: Optional[str] = None,
         conn: asyncpg.Connection = Depends(get_connection)
 ):
     """Получить расписание"""
 
-    query = """
-        SELECT s.*, c.title, c.description, c.duration, t.first_name, t.last_name
+    selection = fieldsets.SCHEDULE.parse(fields)
+    columns = fieldsets.SCHEDULE.select(selection, pagination.SCHEDULE)
+
+    query = f"""
+        SELECT {columns}
         FROM courses.schedule s
         JOIN courses.courses c ON s.course_id = c.id
         JOIN courses.teachers t ON c.teacher_id = t.id
@@ -80,36 +213,34 @@ async def get_schedule(
         params.append(date_to)
         param_count += 1
 
-    query += f" ORDER BY s.start_date_time OFFSET ${param_count} LIMIT ${param_count + 1}"
+    if with_total:
+        await pagination.set_total_count(response, conn, query, params)
+
+    if cursor:
+        query += pagination.SCHEDULE.condition(param_count)
+        params.extend(pagination.SCHEDULE.decode(cursor))
+        param_count += len(pagination.SCHEDULE.columns)
+
+    query += f" ORDER BY {pagination.SCHEDULE.order_by} OFFSET ${param_count} LIMIT ${param_count + 1}"
     params.extend([skip, limit])
 
     rows = await conn.fetch(query, *params)
 
-    schedule_items = []
-    for row in rows:
-        schedule_dict = dict(row)
-        schedule_dict['course'] = {
-            'id': row['course_id'],
-            'title': row['title'],
-            'description': row['description'],
-            'duration': row['duration'],
-            'teacher': {
-                'first_name': row['first_name'],
-                'last_name': row['last_name']
-            }
-        }
-        schedule_items.append(schedule_dict)
+    pagination.set_next_cursor(response, pagination.SCHEDULE, rows, limit)
 
-    return schedule_items
+    return fieldsets.SCHEDULE.respond(selection, fieldsets.SCHEDULE.build_all(selection, rows), response)
 
 
 @router.get("/{schedule_id}", response_model=schemas.ScheduleWithCourse)
-async def get_schedule_item(schedule_id: int, conn: asyncpg.Connection = Depends(get_connection)):
+async def get_schedule_item(schedule_id: int, fields: Optional[str] = None, conn: asyncpg.Connection = Depends(get_connection)):
     """Получить элемент расписания по ID"""
 
+    selection = fieldsets.SCHEDULE.parse(fields)
+    columns = fieldsets.SCHEDULE.select(selection)
+
     row = await conn.fetchrow(
-        """
-        SELECT s.*, c.title, c.description, c.duration, t.first_name, t.last_name
+        f"""
+        SELECT {columns}
         FROM courses.schedule s
         JOIN courses.courses c ON s.course_id = c.id
         JOIN courses.teachers t ON c.teacher_id = t.id
@@ -124,35 +255,13 @@ async def get_schedule_item(schedule_id: int, conn: asyncpg.Connection = Depends
             detail="Элемент расписания не найден"
         )
 
-    schedule_dict = dict(row)
-    schedule_dict['course'] = {
-        'id': row['course_id'],
-        'title': row['title'],
-        'description': row['description'],
-        'duration': row['duration'],
-        'teacher': {
-            'first_name': row['first_name'],
-            'last_name': row['last_name']
-        }
-    }
-
-    return schedule_dict
+    return fieldsets.SCHEDULE.respond(selection, fieldsets.SCHEDULE.build(selection, row))
 
 
 @router.put("/{schedule_id}", response_model=schemas.Schedule)
 async def update_schedule_item(schedule_id: int, schedule_update: schemas.ScheduleUpdate, conn: asyncpg.Connection = Depends(get_connection)):
     """Обновить элемент расписания"""
 
-    existing = await conn.fetchrow(
-        "SELECT id FROM courses.schedule WHERE id = $1",
-        schedule_id
-    )
-    if not existing:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Элемент расписания не найден"
-        )
-
     update_fields = []
     params = []
     param_count = 1
@@ -174,22 +283,46 @@ async def update_schedule_item(schedule_id: int, schedule_update: schemas.Schedu
                 detail="Время начала должно быть раньше времени окончания"
             )
 
-    if not update_fields:
+    if update_fields:
+        params.append(schedule_id)
+        # Изменение только одной границы проверяет ограничение schedule_time_order_check
+        with constraints.translated():
+            try:
+                row = await conn.fetchrow(
+                    f"""
+                    UPDATE courses.schedule
+                    SET {', '.join(update_fields)}
+                    WHERE id = ${param_count}
+                    RETURNING *
+                    """,
+                    *params
+                )
+            except asyncpg.exceptions.ExclusionViolationError:
+                current = await conn.fetchrow(
+                    "SELECT course_id, start_date_time, end_date_time FROM courses.schedule WHERE id = $1",
+                    schedule_id
+                )
+                await schedule_conflicts.check(
+                    conn,
+                    [(
+                        current['course_id'],
+                        schedule_update.start_date_time or current['start_date_time'],
+                        schedule_update.end_date_time or current['end_date_time']
+                    )],
+                    exclude_schedule_id=schedule_id
+                )
+                raise
+    else:
         row = await conn.fetchrow("SELECT * FROM courses.schedule WHERE id = $1", schedule_id)
-        return dict(row)
 
-    params.append(schedule_id)
-
-    row = await conn.fetchrow(
-        f"""
-        UPDATE courses.schedule
-        SET {', '.join(update_fields)}
-        WHERE id = ${param_count}
-        RETURNING *
-        """,
-        *params
-    )
+    if not row:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Элемент расписания не найден"
+        )
 
+    if update_fields:
+        report_cache.cache.invalidate(report_cache.SCHEDULE_TAG)
     return dict(row)
 
 
@@ -197,10 +330,14 @@ async def update_schedule_item(schedule_id: int, schedule_update: schemas.Schedu
 async def delete_schedule_item(schedule_id: int, conn: asyncpg.Connection = Depends(get_connection)):
     """Удалить элемент расписания"""
 
-    result = await conn.execute("DELETE FROM courses.schedule WHERE id = $1", schedule_id)
-    if result == "DELETE 0":
+    # Занятие серии не вернется при следующем изменении серии: его день
+    # записывается в исключения тем же запросом
+    removed = await conn.fetchval(schedule_series.DELETE_ITEM_SQL, schedule_id)
+    if not removed:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Элемент расписания не найден")
 
+    report_cache.cache.invalidate(report_cache.SCHEDULE_TAG)
+
 
 @router.get("/daily/{day}")
 async def get_daily_schedule(day: date, conn: asyncpg.Connection = Depends(get_connection)):
@@ -208,7 +345,7 @@ async def get_daily_schedule(day: date, conn: asyncpg.Connection = Depends(get_c
 
     rows = await conn.fetch(
         """
-        SELECT s.*, c.title, c.description, t.first_name, t.last_name
+        SELECT s.id, s.course_id, s.start_date_time, s.end_date_time, c.title, c.description, t.first_name, t.last_name
         FROM courses.schedule s
         JOIN courses.courses c ON s.course_id = c.id
         JOIN courses.teachers t ON c.teacher_id = t.id
@@ -244,7 +381,7 @@ async def get_student_schedule(student_id: int, days_ahead: int = Query(7, ge=1,
 
     rows = await conn.fetch(
         """
-        SELECT DISTINCT s.*, c.title, c.description, t.first_name, t.last_name
+        SELECT DISTINCT s.id, s.course_id, s.start_date_time, s.end_date_time, c.title, c.description, t.first_name, t.last_name
         FROM courses.schedule s
         JOIN courses.courses c ON s.course_id = c.id
         JOIN courses.teachers t ON c.teacher_id = t.id
@@ -283,7 +420,7 @@ async def get_teacher_schedule(teacher_id: int, days_ahead: int = Query(7, ge=1,
 
     rows = await conn.fetch(
         """
-        SELECT s.*, c.title, c.description
+        SELECT s.id, s.course_id, s.start_date_time, s.end_date_time, c.title, c.description
         FROM courses.schedule s
         JOIN courses.courses c ON s.course_id = c.id
         WHERE c.teacher_id = $1 
@@ -1,10 +1,17 @@
-from fastapi import APIRouter, HTTPException, Query, status, Depends
+from fastapi import APIRouter, HTTPException, Query, status, Depends, Response
 from typing import List, Optional
 import asyncpg
 from datetime import datetime
 import schemas
+import pagination
+import fieldsets
+import includes
+import bulk
+import text_search
 from dependencies import get_connection
 from database import hash_password
+import grade_stats
+import report_cache
 
 router = APIRouter(
     prefix="/students",
@@ -102,15 +109,62 @@ async def create_student(student: schemas.StudentCreate, conn: asyncpg.Connectio
         return s
 
 
+async def _get_students_by_ids(
+        conn: asyncpg.Connection,
+        response: Response,
+        ids: List[int],
+        fields: Optional[str],
+        include: Optional[str]
+):
+    """Студенты по списку id одним запросом, в порядке ids"""
+
+    selection = fieldsets.STUDENTS.parse(fields)
+    relations = includes.parse(includes.STUDENTS, include)
+    columns = fieldsets.STUDENTS.select(selection, pagination.STUDENTS)
+
+    try:
+        has_user_id = await table_has_column(conn, 'courses', 'students', 'user_id')
+    except Exception:
+        has_user_id = False
+
+    rows = await conn.fetch(
+        f"""
+        SELECT {columns}
+        FROM courses.students s
+        JOIN courses.users u ON {"s.user_id" if has_user_id else "s.id"} = u.id
+        WHERE s.id = ANY($1::int[])
+        """,
+        ids
+    )
+    rows = bulk.in_order(response, rows, ids)
+
+    items = fieldsets.STUDENTS.build_all(selection, rows)
+    await includes.expand(conn, includes.STUDENTS, relations, [row["id"] for row in rows], items)
+    return fieldsets.STUDENTS.respond(selection, items, response, includes.annotations(includes.STUDENTS, relations))
+
+
 @router.get("/", response_model=List[schemas.StudentWithUser])
 async def get_students(
+        response: Response,
         skip: int = Query(0, ge=0),
         limit: int = Query(100, le=1000),
+        cursor: Optional[str] = None,
+        with_total: bool = False,
         search: Optional[str] = None,
         group_number: Optional[str] = None,
+        fields: Optional[str] = None,
+        include: Optional[str] = None,
+        ids: Optional[str] = None,
         conn: asyncpg.Connection = Depends(get_connection)
 ):
-    """Получить студента"""
+    """Получить студента.
+
+    ids=1,2,3 - только эти студенты, в том же порядке; фильтры и страницы
+    не применяются, ненайденные id - в X-Missing-Ids
+    """
+
+    if ids is not None:
+        return await _get_students_by_ids(conn, response, bulk.parse_ids(ids), fields, include)
 
     try:
         has_user_id = await table_has_column(conn, 'courses', 'students', 'user_id')
@@ -120,16 +174,20 @@ async def get_students(
     params = []
     param_count = 1
 
+    selection = fieldsets.STUDENTS.parse(fields)
+    relations = includes.parse(includes.STUDENTS, include)
+    columns = fieldsets.STUDENTS.select(selection, pagination.STUDENTS)
+
     if has_user_id:
-        query = """
-            SELECT s.*, u.id as user_id, u.username, u.email, u.photo_url, u.role_id, u.registration_date_time
+        query = f"""
+            SELECT {columns}
             FROM courses.students s
             JOIN courses.users u ON s.user_id = u.id
             WHERE 1=1
         """
     else:
-        query = """
-            SELECT s.*, u.id as user_id, u.username, u.email, u.photo_url, u.role_id, u.registration_date_time
+        query = f"""
+            SELECT {columns}
             FROM courses.students s
             JOIN courses.users u ON s.id = u.id
             WHERE 1=1
@@ -145,7 +203,15 @@ async def get_students(
         params.append(group_number)
         param_count += 1
 
-    query += f" ORDER BY s.id OFFSET ${param_count} LIMIT ${param_count + 1}"
+    if with_total:
+        await pagination.set_total_count(response, conn, query, params)
+
+    if cursor:
+        query += pagination.STUDENTS.condition(param_count)
+        params.extend(pagination.STUDENTS.decode(cursor))
+        param_count += len(pagination.STUDENTS.columns)
+
+    query += f" ORDER BY {pagination.STUDENTS.order_by} OFFSET ${param_count} LIMIT ${param_count + 1}"
     params.extend([skip, limit])
 
     try:
@@ -161,28 +227,56 @@ async def get_students(
             students.append(s)
         return students
 
-    students = []
-    for row in rows:
-        student_dict = dict(row)
-        student_dict['user'] = {
-            'id': row.get('user_id'),
-            'username': row.get('username'),
-            'email': row.get('email'),
-            'photo_url': row.get('photo_url'),
-            'role_id': row.get('role_id'),
-            'registration_date_time': row.get('registration_date_time')
-        }
-        students.append(student_dict)
-
-    return students
+    pagination.set_next_cursor(response, pagination.STUDENTS, rows, limit)
+
+    items = fieldsets.STUDENTS.build_all(selection, rows)
+    await includes.expand(conn, includes.STUDENTS, relations, [row["id"] for row in rows], items)
+    return fieldsets.STUDENTS.respond(selection, items, response, includes.annotations(includes.STUDENTS, relations))
+
+
+@router.post("/by-ids", response_model=List[schemas.StudentWithUser])
+async def get_students_by_ids(
+        data: schemas.IdsRequest,
+        response: Response,
+        fields: Optional[str] = None,
+        include: Optional[str] = None,
+        conn: asyncpg.Connection = Depends(get_connection)
+):
+    """Студенты по списку id в теле запроса - для длинных списков, не влезающих в URL"""
+
+    return await _get_students_by_ids(conn, response, bulk.check_ids(data.ids), fields, include)
+
+
+@router.get("/search")
+async def search_students(
+        q: str = Query(..., min_length=1),
+        limit: Optional[int] = Query(None, ge=1, le=100),
+        autocomplete: bool = False,
+        conn: asyncpg.Connection = Depends(get_connection)
+):
+    """Поиск студентов по имени, фамилии, группе и логину.
+
+    autocomplete=true - подсказки по началу строки для поля ввода
+    """
+
+    if autocomplete:
+        return await text_search.autocomplete(conn, "students", q, limit or text_search.AUTOCOMPLETE_LIMIT)
+    return await text_search.search(conn, "students", q, limit or 20)
+
 
 @router.get("/{student_id}", response_model=schemas.StudentWithUser)
 async def get_student(
     student_id: int,
+    fields: Optional[str] = None,
+    include: Optional[str] = None,
     conn: asyncpg.Connection = Depends(get_connection)
 ):
     """Получить студента"""
 
+    selection = fieldsets.STUDENTS.parse(fields)
+    relations = includes.parse(includes.STUDENTS, include)
+    columns = fieldsets.STUDENTS.select(selection)
+
     try:
         has_user_id = await table_has_column(conn, 'courses', 'students', 'user_id')
     except Exception:
@@ -191,14 +285,8 @@ async def get_student(
     try:
         if has_user_id:
             row = await conn.fetchrow(
-                """
-                SELECT s.*, 
-                       u.id AS user_id,
-                       u.username,
-                       u.email,
-                       u.photo_url,
-                       u.role_id,
-                       u.registration_date_time
+                f"""
+                SELECT {columns}
                 FROM courses.students s
                 JOIN courses.users u ON s.user_id = u.id
                 WHERE s.id = $1
@@ -207,14 +295,8 @@ async def get_student(
             )
         else:
             row = await conn.fetchrow(
-                """
-                SELECT s.*, 
-                       u.id AS user_id,
-                       u.username,
-                       u.email,
-                       u.photo_url,
-                       u.role_id,
-                       u.registration_date_time
+                f"""
+                SELECT {columns}
                 FROM courses.students s
                 JOIN courses.users u ON s.id = u.id
                 WHERE s.id = $1
@@ -231,6 +313,8 @@ async def get_student(
             "SELECT * FROM courses.students WHERE id = $1",
             student_id
         )
+        if row:
+            return {**dict(row), "user": None}
 
     if not row:
         raise HTTPException(
@@ -238,22 +322,9 @@ async def get_student(
             detail="Студент не найден"
         )
 
-    res = dict(row)
-
-    res["user"] = (
-        {
-            "id": row.get("user_id"),
-            "username": row.get("username"),
-            "email": row.get("email"),
-            "photo_url": row.get("photo_url"),
-            "role_id": row.get("role_id"),
-            "registration_date_time": row.get("registration_date_time"),
-        }
-        if "username" in row
-        else None
-    )
-
-    return res
+    item = fieldsets.STUDENTS.build(selection, row)
+    await includes.expand(conn, includes.STUDENTS, relations, [student_id], [item])
+    return fieldsets.STUDENTS.respond(selection, item, extra=includes.annotations(includes.STUDENTS, relations))
 
 @router.patch("/{student_id}", response_model=schemas.StudentWithUser)
 async def update_student(
@@ -296,8 +367,10 @@ async def update_student(
             detail="Студент не найден"
         )
 
+    report_cache.cache.invalidate(report_cache.student_tag(student_id))
+
     # ⬇ используем существующий GET
-    return await get_student(student_id, conn)
+    return await get_student(student_id, conn=conn)
 
 
 @router.delete("/{student_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -330,14 +403,25 @@ async def delete_student(student_id: int, conn: asyncpg.Connection = Depends(get
 
             user_id = student_id
 
+        course_ids = await conn.fetch(
+            "SELECT course_id FROM courses.student_course_enrollment WHERE student_id = $1",
+            student_id
+        )
+
         await conn.execute(
             "DELETE FROM courses.students WHERE id = $1",
             student_id
         )
 
+        await grade_stats.student_deleted(conn, student_id, [r['course_id'] for r in course_ids])
+
         await conn.execute(
             "DELETE FROM courses.users WHERE id = $1",
             user_id
         )
 
+    report_cache.cache.invalidate(
+        report_cache.student_tag(student_id),
+        *[report_cache.course_tag(r['course_id']) for r in course_ids]
+    )
     return
\ No newline at end of file
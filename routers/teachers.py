@@ -1,8 +1,14 @@
-from fastapi import APIRouter, HTTPException, Query, status, Depends
+from fastapi import APIRouter, HTTPException, Query, status, Depends, Response
 from typing import List, Optional
 import asyncpg
 from datetime import datetime
 import schemas
+import pagination
+import fieldsets
+import includes
+import bulk
+import text_search
+import report_cache
 from dependencies import get_connection
 from database import hash_password
 
@@ -102,14 +108,66 @@ async def create_teacher(teacher: schemas.TeacherCreate, conn: asyncpg.Connectio
         return teacher_dict
 
 
+async def _get_teachers_by_ids(
+        conn: asyncpg.Connection,
+        response: Response,
+        ids: List[int],
+        fields: Optional[str],
+        include: Optional[str]
+):
+    """Преподаватели по списку id одним запросом, в порядке ids"""
+
+    selection = fieldsets.TEACHERS.parse(fields)
+    relations = includes.parse(includes.TEACHERS, include)
+    columns = fieldsets.TEACHERS.select(selection, pagination.TEACHERS)
+
+    try:
+        has_user_id = await table_has_column(conn, 'courses', 'teachers', 'user_id')
+    except Exception:
+        has_user_id = False
+
+    rows = await conn.fetch(
+        f"""
+        SELECT {columns}
+        FROM courses.teachers t
+        JOIN courses.users u ON {"t.user_id" if has_user_id else "t.id"} = u.id
+        WHERE t.id = ANY($1::int[])
+        """,
+        ids
+    )
+    rows = bulk.in_order(response, rows, ids)
+
+    items = fieldsets.TEACHERS.build_all(selection, rows)
+    await includes.expand(conn, includes.TEACHERS, relations, [row["id"] for row in rows], items)
+    return fieldsets.TEACHERS.respond(selection, items, response, includes.annotations(includes.TEACHERS, relations))
+
+
 @router.get("/", response_model=List[schemas.TeacherWithUser])
 async def get_teachers(
+        response: Response,
         skip: int = Query(0, ge=0),
         limit: int = Query(100, le=1000),
+        cursor: Optional[str] = None,
+        with_total: bool = False,
         search: Optional[str] = None,
+        fields: Optional[str] = None,
+        include: Optional[str] = None,
+        ids: Optional[str] = None,
         conn: asyncpg.Connection = Depends(get_connection)
 ):
-    """Получить преподавателя"""
+    """Получить преподавателя.
+
+    ids=1,2,3 - только эти преподаватели, в том же порядке; фильтры и
+    страницы не применяются, ненайденные id - в X-Missing-Ids
+    """
+
+    if ids is not None:
+        return await _get_teachers_by_ids(conn, response, bulk.parse_ids(ids), fields, include)
+
+    selection = fieldsets.TEACHERS.parse(fields)
+    relations = includes.parse(includes.TEACHERS, include)
+    columns = fieldsets.TEACHERS.select(selection, pagination.TEACHERS)
+
     try:
         has_user_id = await table_has_column(conn, 'courses', 'teachers', 'user_id')
     except Exception:
@@ -119,15 +177,15 @@ async def get_teachers(
     param_count = 1
 
     if has_user_id:
-        query = """
-            SELECT t.*, u.id as user_id, u.username, u.email, u.photo_url, u.role_id, u.registration_date_time
+        query = f"""
+            SELECT {columns}
             FROM courses.teachers t
             JOIN courses.users u ON t.user_id = u.id
             WHERE 1=1
         """
     else:
-        query = """
-            SELECT t.*, u.id as user_id, u.username, u.email, u.photo_url, u.role_id, u.registration_date_time
+        query = f"""
+            SELECT {columns}
             FROM courses.teachers t
             JOIN courses.users u ON t.id = u.id
             WHERE 1=1
@@ -138,7 +196,15 @@ async def get_teachers(
         params.append(f"%{search}%")
         param_count += 1
 
-    query += f" ORDER BY t.id OFFSET ${param_count} LIMIT ${param_count + 1}"
+    if with_total:
+        await pagination.set_total_count(response, conn, query, params)
+
+    if cursor:
+        query += pagination.TEACHERS.condition(param_count)
+        params.extend(pagination.TEACHERS.decode(cursor))
+        param_count += len(pagination.TEACHERS.columns)
+
+    query += f" ORDER BY {pagination.TEACHERS.order_by} OFFSET ${param_count} LIMIT ${param_count + 1}"
     params.extend([skip, limit])
 
     try:
@@ -154,26 +220,51 @@ async def get_teachers(
             teachers.append(t)
         return teachers
 
-    teachers = []
-    for row in rows:
-        t = dict(row)
-        t['user'] = {
-            'id': row.get('user_id'),
-            'username': row.get('username'),
-            'email': row.get('email'),
-            'photo_url': row.get('photo_url'),
-            'role_id': row.get('role_id'),
-            'registration_date_time': row.get('registration_date_time')
-        } if 'username' in row else None
-        teachers.append(t)
+    pagination.set_next_cursor(response, pagination.TEACHERS, rows, limit)
+
+    items = fieldsets.TEACHERS.build_all(selection, rows)
+    await includes.expand(conn, includes.TEACHERS, relations, [row["id"] for row in rows], items)
+    return fieldsets.TEACHERS.respond(selection, items, response, includes.annotations(includes.TEACHERS, relations))
+
+
+@router.post("/by-ids", response_model=List[schemas.TeacherWithUser])
+async def get_teachers_by_ids(
+        data: schemas.IdsRequest,
+        response: Response,
+        fields: Optional[str] = None,
+        include: Optional[str] = None,
+        conn: asyncpg.Connection = Depends(get_connection)
+):
+    """Преподаватели по списку id в теле запроса - для длинных списков, не влезающих в URL"""
+
+    return await _get_teachers_by_ids(conn, response, bulk.check_ids(data.ids), fields, include)
+
 
-    return teachers
+@router.get("/search")
+async def search_teachers(
+        q: str = Query(..., min_length=1),
+        limit: Optional[int] = Query(None, ge=1, le=100),
+        autocomplete: bool = False,
+        conn: asyncpg.Connection = Depends(get_connection)
+):
+    """Поиск преподавателей по имени, фамилии, квалификации и логину.
+
+    autocomplete=true - подсказки по началу строки для поля ввода
+    """
+
+    if autocomplete:
+        return await text_search.autocomplete(conn, "teachers", q, limit or text_search.AUTOCOMPLETE_LIMIT)
+    return await text_search.search(conn, "teachers", q, limit or 20)
 
 
 @router.get("/{teacher_id}", response_model=schemas.TeacherWithUser)
-async def get_teacher(teacher_id: int, conn: asyncpg.Connection = Depends(get_connection)):
+async def get_teacher(teacher_id: int, fields: Optional[str] = None, include: Optional[str] = None, conn: asyncpg.Connection = Depends(get_connection)):
     """Получить преподавателя"""
 
+    selection = fieldsets.TEACHERS.parse(fields)
+    relations = includes.parse(includes.TEACHERS, include)
+    columns = fieldsets.TEACHERS.select(selection)
+
     try:
         has_user_id = await table_has_column(conn, 'courses', 'teachers', 'user_id')
     except Exception:
@@ -182,8 +273,8 @@ async def get_teacher(teacher_id: int, conn: asyncpg.Connection = Depends(get_co
     try:
         if has_user_id:
             row = await conn.fetchrow(
-                """
-                SELECT t.*, u.id as user_id, u.username, u.email, u.photo_url, u.role_id, u.registration_date_time
+                f"""
+                SELECT {columns}
                 FROM courses.teachers t
                 JOIN courses.users u ON t.user_id = u.id
                 WHERE t.id = $1
@@ -192,8 +283,8 @@ async def get_teacher(teacher_id: int, conn: asyncpg.Connection = Depends(get_co
             )
         else:
             row = await conn.fetchrow(
-                """
-                SELECT t.*, u.id as user_id, u.username, u.email, u.photo_url, u.role_id, u.registration_date_time
+                f"""
+                SELECT {columns}
                 FROM courses.teachers t
                 JOIN courses.users u ON t.id = u.id
                 WHERE t.id = $1
@@ -204,21 +295,15 @@ async def get_teacher(teacher_id: int, conn: asyncpg.Connection = Depends(get_co
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Преподаватель не найден")
     except asyncpg.exceptions.UndefinedColumnError:
         row = await conn.fetchrow("SELECT * FROM courses.teachers WHERE id = $1", teacher_id)
+        if row:
+            return {**dict(row), "user": None}
 
     if not row:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Преподаватель не найден")
 
-    res = dict(row)
-    res['user'] = {
-        'id': row.get('user_id'),
-        'username': row.get('username'),
-        'email': row.get('email'),
-        'photo_url': row.get('photo_url'),
-        'role_id': row.get('role_id'),
-        'registration_date_time': row.get('registration_date_time')
-    } if 'username' in row else None
-
-    return res
+    item = fieldsets.TEACHERS.build(selection, row)
+    await includes.expand(conn, includes.TEACHERS, relations, [teacher_id], [item])
+    return fieldsets.TEACHERS.respond(selection, item, extra=includes.annotations(includes.TEACHERS, relations))
 
 @router.patch("/{teacher_id}", response_model=schemas.TeacherWithUser)
 async def update_teacher(
@@ -261,4 +346,5 @@ async def update_teacher(
             detail="Преподаватель не найден"
         )
 
-    return await get_teacher(teacher_id, conn)
\ No newline at end of file
+    report_cache.cache.invalidate(report_cache.TEACHERS_TAG)
+    return await get_teacher(teacher_id, conn=conn)
\ No newline at end of file
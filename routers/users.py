@@ -1,5 +1,7 @@
-from fastapi import APIRouter, HTTPException, Query, status, UploadFile, File, Depends, Request
+from fastapi import APIRouter, HTTPException, Query, status, UploadFile, File, Depends, Request, Response
+from typing import List
 import schemas
+import bulk
 from database import verify_password
 from auth import AuthHandler, _normalize_role
 from datetime import datetime, timedelta
@@ -46,13 +48,22 @@ async def login(login_data: schemas.LoginRequest, conn: asyncpg.Connection = Dep
 
     return {"access_token": access_token, "token_type": "bearer"}
 
-@router.get("/{user_id}")
-async def get_user_by_id(
-    user_id: int,
-    request: Request,
-    conn: asyncpg.Connection = Depends(get_connection)
-):
-    """Получить информацию о пользователе по id."""
+_USER_SQL = """
+    SELECT
+        u.id,
+        u.username,
+        u.email,
+        u.photo_url,
+        u.role_id,
+        r.name AS role_name,
+        u.registration_date_time
+    FROM courses.users u
+    LEFT JOIN courses.roles r ON r.id = u.role_id
+"""
+
+
+async def _authorize(request: Request, conn: asyncpg.Connection, user_ids: List[int]):
+    """Пользователь видит только себя, администратор - всех"""
 
     token = get_token_from_header(request)
     if not token:
@@ -71,35 +82,14 @@ async def get_user_by_id(
     role_name = current_user.get("role_name") or current_user.get("role")
     is_admin = role_name == "admin" or role_name == "Администратор"
 
-    if current_user["id"] != user_id and not is_admin:
+    if any(user_id != current_user["id"] for user_id in user_ids) and not is_admin:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Недостаточно прав"
         )
 
-    row = await conn.fetchrow(
-        """
-        SELECT
-            u.id,
-            u.username,
-            u.email,
-            u.photo_url,
-            u.role_id,
-            r.name AS role_name,
-            u.registration_date_time
-        FROM courses.users u
-        LEFT JOIN courses.roles r ON r.id = u.role_id
-        WHERE u.id = $1
-        """,
-        user_id
-    )
-
-    if not row:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Пользователь не найден"
-        )
 
+def _user_info(row) -> dict:
     user = dict(row)
 
     return {
@@ -112,6 +102,60 @@ async def get_user_by_id(
     }
 
 
+async def _get_users_by_ids(request: Request, response: Response, conn: asyncpg.Connection, ids: List[int]):
+    """Пользователи по списку id одним запросом, в порядке ids"""
+
+    await _authorize(request, conn, ids)
+
+    rows = await conn.fetch(_USER_SQL + " WHERE u.id = ANY($1::int[])", ids)
+    return [_user_info(row) for row in bulk.in_order(response, rows, ids)]
+
+
+@router.get("/")
+async def get_users_by_ids_query(
+    request: Request,
+    response: Response,
+    ids: str = Query(..., description="id через запятую"),
+    conn: asyncpg.Connection = Depends(get_connection)
+):
+    """Информация о пользователях по списку id; ненайденные id - в X-Missing-Ids"""
+
+    return await _get_users_by_ids(request, response, conn, bulk.parse_ids(ids))
+
+
+@router.post("/by-ids")
+async def get_users_by_ids(
+    data: schemas.IdsRequest,
+    request: Request,
+    response: Response,
+    conn: asyncpg.Connection = Depends(get_connection)
+):
+    """То же по списку id в теле запроса - для длинных списков"""
+
+    return await _get_users_by_ids(request, response, conn, bulk.check_ids(data.ids))
+
+
+@router.get("/{user_id}")
+async def get_user_by_id(
+    user_id: int,
+    request: Request,
+    conn: asyncpg.Connection = Depends(get_connection)
+):
+    """Получить информацию о пользователе по id."""
+
+    await _authorize(request, conn, [user_id])
+
+    row = await conn.fetchrow(_USER_SQL + " WHERE u.id = $1", user_id)
+
+    if not row:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Пользователь не найден"
+        )
+
+    return _user_info(row)
+
+
 @router.post("/{user_id}/upload-photo")
 async def upload_user_photo(
         user_id: int,
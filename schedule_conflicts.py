@@ -0,0 +1,235 @@
+import heapq
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Sequence
+import asyncpg
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+import constraints
+import schemas
+
+EXCLUSION_NAME = "schedule_teacher_no_overlap"
+
+# Преподаватель занятия копируется в courses.schedule триггерами: исключающее
+# ограничение видит только колонки своей таблицы. При смене преподавателя
+# курса его занятия переходят к новому преподавателю тем же оператором.
+# CREATE OR REPLACE TRIGGER есть только с PostgreSQL 14, поэтому DROP/CREATE.
+SCHEMA_SQL = """
+ALTER TABLE courses.schedule ADD COLUMN IF NOT EXISTS teacher_id INTEGER;
+
+CREATE OR REPLACE FUNCTION courses.schedule_set_teacher() RETURNS trigger AS $$
+BEGIN
+    NEW.teacher_id := (SELECT teacher_id FROM courses.courses WHERE id = NEW.course_id);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS schedule_set_teacher ON courses.schedule;
+CREATE TRIGGER schedule_set_teacher
+BEFORE INSERT OR UPDATE OF course_id, teacher_id ON courses.schedule
+FOR EACH ROW EXECUTE FUNCTION courses.schedule_set_teacher();
+
+CREATE OR REPLACE FUNCTION courses.course_teacher_changed() RETURNS trigger AS $$
+BEGIN
+    UPDATE courses.schedule SET teacher_id = NEW.teacher_id WHERE course_id = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS courses_teacher_changed ON courses.courses;
+CREATE TRIGGER courses_teacher_changed
+AFTER UPDATE OF teacher_id ON courses.courses
+FOR EACH ROW WHEN (OLD.teacher_id IS DISTINCT FROM NEW.teacher_id)
+EXECUTE FUNCTION courses.course_teacher_changed();
+
+UPDATE courses.schedule s
+SET teacher_id = c.teacher_id
+FROM courses.courses c
+WHERE c.id = s.course_id AND s.teacher_id IS DISTINCT FROM c.teacher_id;
+"""
+
+# Интервал занятия. Новые строки с началом позже конца отвергает
+# schedule_time_order_check, но она NOT VALID, и старые такие строки могут
+# остаться: tsrange(начало, конец) на них падает с DataError. Границы
+# упорядочиваются, и одно выражение годится для ограничения, индекса
+# и поиска конфликтов.
+_RANGE = "tsrange(LEAST({0}start_date_time, {0}end_date_time), GREATEST({0}start_date_time, {0}end_date_time))"
+
+# Пересечение занятий одного преподавателя запрещает GiST-индекс ограничения:
+# проверка одной записи - поиск по индексу, а не просмотр расписания.
+# Равенство преподавателя записано через int4range, чтобы не требовать btree_gist.
+_EXCLUSION_SQL = f"""
+ALTER TABLE courses.schedule ADD CONSTRAINT {EXCLUSION_NAME} EXCLUDE USING gist (
+    int4range(teacher_id, teacher_id, '[]') WITH =,
+    {_RANGE.format("")} WITH &&
+)
+"""
+# Если ограничение не создать (в данных уже есть пересечения), поиск
+# конфликтов все равно идет по такому же индексу
+_INDEX_SQL = f"""
+CREATE INDEX IF NOT EXISTS schedule_teacher_time_idx ON courses.schedule
+USING gist (int4range(teacher_id, teacher_id, '[]'), {_RANGE.format("")})
+"""
+
+# Расписание преподавателей за период одним запросом. Строки с id IS NULL -
+# преподаватели запрошенных курсов, остальные - их занятия в окне $2..$3.
+_BUSY_SQL = f"""
+WITH teachers AS (
+    SELECT id AS course_id, teacher_id FROM courses.courses WHERE id = ANY($1::int[])
+)
+SELECT NULL::int AS id, course_id, teacher_id, NULL::timestamp AS start_date_time, NULL::timestamp AS end_date_time
+FROM teachers
+UNION ALL
+SELECT s.id, s.course_id, s.teacher_id, s.start_date_time, s.end_date_time
+FROM courses.schedule s
+WHERE s.teacher_id IN (SELECT teacher_id FROM teachers)
+  AND {_RANGE.format("s.")} && tsrange($2, $3)
+  AND ($4::int IS NULL OR s.series_id IS DISTINCT FROM $4)
+  AND ($5::int IS NULL OR s.id <> $5)
+"""
+
+
+class Slot(NamedTuple):
+    """Занятие для проверки: новое (item - номер в запросе) или уже записанное (schedule_id)"""
+
+    teacher_id: int
+    course_id: int
+    start_date_time: datetime
+    end_date_time: datetime
+    item: Optional[int] = None
+    schedule_id: Optional[int] = None
+
+
+async def ensure_schema(conn: asyncpg.Connection) -> bool:
+    """Колонка teacher_id, триггеры и ограничение; False - в расписании уже есть пересечения.
+
+    Вызывается после constraints.ensure_constraints: тогда строки с началом
+    позже конца могут быть только старыми, а их интервал берется с
+    упорядоченными границами и запуск не прерывает.
+    """
+
+    column_exists = await conn.fetchval(
+        """
+        SELECT EXISTS(
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = 'courses' AND table_name = 'schedule' AND column_name = 'teacher_id'
+        )
+        """
+    )
+    if not column_exists:
+        async with conn.transaction():
+            await conn.execute(SCHEMA_SQL)
+
+    exists = await conn.fetchval("SELECT EXISTS(SELECT 1 FROM pg_constraint WHERE conname = $1)", EXCLUSION_NAME)
+    if exists:
+        return True
+    try:
+        await conn.execute(_EXCLUSION_SQL)
+    except asyncpg.exceptions.ExclusionViolationError:
+        await conn.execute(_INDEX_SQL)
+        return False
+    return True
+
+
+def overlaps(slots: Sequence[Slot]) -> List[tuple]:
+    """Пары пересекающихся занятий одного преподавателя за один проход.
+
+    Занятия каждого преподавателя сортируются по началу; в куче по времени
+    окончания держатся еще идущие занятия. Каждое следующее пересекается
+    ровно с теми, что остались в куче. Пары из двух уже записанных занятий
+    не возвращаются - это не конфликт новой записи.
+    """
+
+    by_teacher: Dict[int, List[Slot]] = defaultdict(list)
+    for slot in slots:
+        by_teacher[slot.teacher_id].append(slot)
+
+    pairs = []
+    for teacher_slots in by_teacher.values():
+        teacher_slots.sort(key=lambda slot: (slot.start_date_time, slot.end_date_time))
+        active: list = []
+        for number, slot in enumerate(teacher_slots):
+            while active and active[0][0] <= slot.start_date_time:
+                heapq.heappop(active)
+            for _, _, other in active:
+                if slot.item is not None or other.item is not None:
+                    pairs.append((slot, other) if slot.item is not None else (other, slot))
+            heapq.heappush(active, (slot.end_date_time, number, slot))
+    return pairs
+
+
+async def find(
+        conn: asyncpg.Connection,
+        items: Sequence[tuple],
+        exclude_series_id: Optional[int] = None,
+        exclude_schedule_id: Optional[int] = None
+) -> List[dict]:
+    """Конфликты новых занятий (course_id, начало, конец) между собой и с расписанием.
+
+    Один запрос за расписанием преподавателей на весь период и проверка
+    в памяти. Занятия несуществующих курсов пропускаются - их отвергнет
+    внешний ключ при записи.
+    """
+
+    if not items:
+        return []
+
+    rows = await conn.fetch(
+        _BUSY_SQL,
+        list({item[0] for item in items}),
+        min(item[1] for item in items),
+        max(item[2] for item in items),
+        exclude_series_id,
+        exclude_schedule_id
+    )
+    teachers = {row["course_id"]: row["teacher_id"] for row in rows if row["id"] is None}
+
+    # Границы старых строк упорядочиваются так же, как в _RANGE
+    slots = [
+        Slot(
+            row["teacher_id"], row["course_id"],
+            *sorted((row["start_date_time"], row["end_date_time"])),
+            schedule_id=row["id"]
+        )
+        for row in rows if row["id"] is not None
+    ]
+    slots += [
+        Slot(teachers[course_id], course_id, start, end, item=number)
+        for number, (course_id, start, end) in enumerate(items) if course_id in teachers
+    ]
+
+    return [
+        schemas.ScheduleConflict(
+            teacher_id=slot.teacher_id,
+            course_id=slot.course_id,
+            start_date_time=slot.start_date_time,
+            end_date_time=slot.end_date_time,
+            item=slot.item,
+            conflicting_schedule_id=other.schedule_id,
+            conflicting_item=other.item,
+            conflicting_course_id=other.course_id,
+            conflicting_start_date_time=other.start_date_time,
+            conflicting_end_date_time=other.end_date_time
+        ).model_dump()
+        for slot, other in sorted(overlaps(slots), key=lambda pair: (pair[0].item, pair[1].start_date_time))
+    ]
+
+
+def error(conflicts: List[dict]) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=jsonable_encoder({"message": constraints.CONFLICTS[EXCLUSION_NAME], "conflicts": conflicts})
+    )
+
+
+async def check(
+        conn: asyncpg.Connection,
+        items: Sequence[tuple],
+        exclude_series_id: Optional[int] = None,
+        exclude_schedule_id: Optional[int] = None
+):
+    """409 со списком конфликтов, если новые занятия пересекаются"""
+
+    conflicts = await find(conn, items, exclude_series_id, exclude_schedule_id)
+    if conflicts:
+        raise error(conflicts)
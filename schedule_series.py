@@ -0,0 +1,231 @@
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, List, Optional, Tuple
+import asyncpg
+from fastapi import HTTPException, status
+import constraints
+import schedule_conflicts
+
+# Самая длинная серия в днях: больше года занятий одним запросом не создается
+SERIES_MAX_DAYS = 366
+
+# Серия - шаблон (дни недели, время, период, даты-исключения); занятия
+# серии - обычные строки courses.schedule со ссылкой series_id. Удаление
+# серии каскадом удаляет и ее занятия. Нарушения ограничений переводятся
+# в 400 через constraints.MESSAGES.
+SCHEMA_SQL = f"""
+CREATE TABLE IF NOT EXISTS courses.schedule_series (
+    id SERIAL PRIMARY KEY,
+    course_id INTEGER NOT NULL,
+    weekdays SMALLINT[] NOT NULL,
+    start_time TIME NOT NULL,
+    end_time TIME NOT NULL,
+    date_from DATE NOT NULL,
+    date_to DATE NOT NULL,
+    exception_dates DATE[] NOT NULL DEFAULT '{{}}',
+    CONSTRAINT schedule_series_course_id_fkey
+        FOREIGN KEY (course_id) REFERENCES courses.courses(id) ON DELETE CASCADE,
+    CONSTRAINT schedule_series_weekdays_check
+        CHECK (cardinality(weekdays) > 0 AND weekdays <@ ARRAY[1, 2, 3, 4, 5, 6, 7]::smallint[]),
+    CONSTRAINT schedule_series_time_order_check CHECK (start_time < end_time),
+    CONSTRAINT schedule_series_date_order_check CHECK (date_from <= date_to),
+    CONSTRAINT schedule_series_length_check CHECK (date_to - date_from < {SERIES_MAX_DAYS})
+);
+
+CREATE INDEX IF NOT EXISTS schedule_series_course_id_idx ON courses.schedule_series (course_id);
+
+ALTER TABLE courses.schedule
+    ADD COLUMN IF NOT EXISTS series_id INTEGER REFERENCES courses.schedule_series(id) ON DELETE CASCADE;
+
+CREATE INDEX IF NOT EXISTS schedule_series_id_idx ON courses.schedule (series_id) WHERE series_id IS NOT NULL;
+"""
+
+# Занятия, которые должны быть у серии из CTE series. Даты разворачивает
+# occurrences(): по тому же списку занятия проверяются на конфликты
+# преподавателя, и в базу пишется ровно то, что было проверено.
+_WANTED_CTE = """
+wanted AS (
+    SELECT s.id AS series_id, s.course_id, o.start_date_time, o.end_date_time
+    FROM series s
+    CROSS JOIN unnest($1::timestamp[], $2::timestamp[]) AS o(start_date_time, end_date_time)
+)
+"""
+
+# Серия и все ее занятия - один оператор
+_CREATE_SQL = f"""
+WITH series AS (
+    INSERT INTO courses.schedule_series
+        (course_id, weekdays, start_time, end_time, date_from, date_to, exception_dates)
+    VALUES ($3, $4, $5, $6, $7, $8, $9)
+    RETURNING *
+),
+{_WANTED_CTE},
+added AS (
+    INSERT INTO courses.schedule (course_id, start_date_time, end_date_time, series_id)
+    SELECT course_id, start_date_time, end_date_time, series_id FROM wanted
+    RETURNING id
+)
+SELECT s.*, (SELECT COUNT(*) FROM added)::int AS occurrences FROM series s
+"""
+
+# Изменение шаблона - тоже один оператор: занятия на дни, которых больше
+# нет в серии, удаляются, на новые дни - добавляются, остальные получают
+# время из шаблона. Занятие узнается по дню начала, id у него сохраняется.
+_UPDATE_SQL = """
+WITH series AS (
+    UPDATE courses.schedule_series
+    SET weekdays = $3, start_time = $4, end_time = $5, date_from = $6, date_to = $7, exception_dates = $8
+    WHERE id = $9
+    RETURNING *
+),
+""" + _WANTED_CTE + """,
+removed AS (
+    DELETE FROM courses.schedule sc
+    USING series s
+    WHERE sc.series_id = s.id
+      AND NOT EXISTS(
+          SELECT 1 FROM wanted w WHERE w.start_date_time::date = sc.start_date_time::date
+      )
+    RETURNING sc.id
+),
+moved AS (
+    UPDATE courses.schedule sc
+    SET start_date_time = w.start_date_time, end_date_time = w.end_date_time
+    FROM wanted w
+    WHERE sc.series_id = w.series_id
+      AND sc.start_date_time::date = w.start_date_time::date
+      AND (sc.start_date_time, sc.end_date_time) IS DISTINCT FROM (w.start_date_time, w.end_date_time)
+    RETURNING sc.id
+),
+added AS (
+    INSERT INTO courses.schedule (course_id, start_date_time, end_date_time, series_id)
+    SELECT w.course_id, w.start_date_time, w.end_date_time, w.series_id
+    FROM wanted w
+    WHERE NOT EXISTS(
+        SELECT 1 FROM courses.schedule sc
+        WHERE sc.series_id = w.series_id AND sc.start_date_time::date = w.start_date_time::date
+    )
+    RETURNING id
+)
+SELECT s.*, (SELECT COUNT(*) FROM wanted)::int AS occurrences FROM series s
+"""
+
+SELECT_SQL = """
+SELECT ss.*, (SELECT COUNT(*) FROM courses.schedule sc WHERE sc.series_id = ss.id)::int AS occurrences
+FROM courses.schedule_series ss
+"""
+
+# Удаление одного занятия серии: его день попадает в исключения, чтобы
+# следующее изменение шаблона не вернуло занятие обратно
+DELETE_ITEM_SQL = """
+WITH removed AS (
+    DELETE FROM courses.schedule WHERE id = $1 RETURNING series_id, start_date_time
+),
+excluded AS (
+    UPDATE courses.schedule_series ss
+    SET exception_dates = array_append(ss.exception_dates, r.start_date_time::date)
+    FROM removed r
+    WHERE ss.id = r.series_id AND r.start_date_time::date <> ALL(ss.exception_dates)
+)
+SELECT COUNT(*) FROM removed
+"""
+
+
+async def ensure_schema(conn: asyncpg.Connection) -> bool:
+    """Создать таблицу серий и колонку schedule.series_id, если их нет"""
+
+    exists = await conn.fetchval("SELECT to_regclass('courses.schedule_series') IS NOT NULL")
+    if exists:
+        return False
+
+    async with conn.transaction():
+        await conn.execute(SCHEMA_SQL)
+    return True
+
+
+def weekdays(days: Iterable[int]) -> List[int]:
+    """Дни недели без повторов, по порядку"""
+
+    return sorted(set(days))
+
+
+def exception_dates(dates: Iterable[date]) -> List[date]:
+    return sorted(set(dates))
+
+
+def occurrences(
+        days: Iterable[int],
+        start_time: time,
+        end_time: time,
+        date_from: date,
+        date_to: date,
+        skipped: Iterable[date]
+) -> List[Tuple[datetime, datetime]]:
+    """Начало и конец каждого занятия серии"""
+
+    if (date_to - date_from).days >= SERIES_MAX_DAYS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=constraints.MESSAGES["schedule_series_length_check"]
+        )
+
+    days = set(days)
+    skipped = set(skipped)
+    start_time = start_time.replace(tzinfo=None)
+    end_time = end_time.replace(tzinfo=None)
+
+    result = []
+    day = date_from
+    while day <= date_to:
+        if day.isoweekday() in days and day not in skipped:
+            result.append((datetime.combine(day, start_time), datetime.combine(day, end_time)))
+        day += timedelta(days=1)
+    return result
+
+
+async def _write(conn: asyncpg.Connection, sql: str, course_id: int, items: list, *params, series_id: Optional[int] = None):
+    """Проверить занятия на конфликты преподавателя и записать их одним запросом"""
+
+    slots = [(course_id, start, end) for start, end in items]
+    await schedule_conflicts.check(conn, slots, exclude_series_id=series_id)
+    try:
+        return await conn.fetchrow(sql, [item[0] for item in items], [item[1] for item in items], *params)
+    except asyncpg.exceptions.ExclusionViolationError:
+        # Пересекающееся занятие записали между проверкой и записью
+        await schedule_conflicts.check(conn, slots, exclude_series_id=series_id)
+        raise
+
+
+async def create(conn: asyncpg.Connection, series) -> asyncpg.Record:
+    """Создать серию и все ее занятия одним запросом"""
+
+    template = (
+        weekdays(series.weekdays), series.start_time, series.end_time,
+        series.date_from, series.date_to, exception_dates(series.exception_dates)
+    )
+    return await _write(conn, _CREATE_SQL, series.course_id, occurrences(*template), series.course_id, *template)
+
+
+async def update(conn: asyncpg.Connection, series_id: int, series_update) -> Optional[asyncpg.Record]:
+    """Изменить шаблон серии и привести к нему занятия одним запросом.
+
+    None - серия не найдена. Без изменяемых полей занятия не трогаются.
+    """
+
+    row = await conn.fetchrow(SELECT_SQL + " WHERE ss.id = $1", series_id)
+    if not row:
+        return None
+
+    changes = series_update.model_dump(exclude_none=True)
+    if not changes:
+        return row
+
+    current = dict(row)
+    current.update(changes)
+    template = (
+        weekdays(current["weekdays"]), current["start_time"], current["end_time"],
+        current["date_from"], current["date_to"], exception_dates(current["exception_dates"])
+    )
+    return await _write(
+        conn, _UPDATE_SQL, row["course_id"], occurrences(*template), *template, series_id,
+        series_id=series_id
+    )
@@ -1,7 +1,7 @@
 from pydantic import BaseModel, EmailStr
 from enum import Enum
 from typing import List, Optional, Dict, Any
-from datetime import datetime, date
+from datetime import datetime, date, time
 
 
 class RoleEnum(str, Enum):
@@ -152,6 +152,15 @@ class CourseWithTeacher(Course):
     teacher: Teacher
 
 
+class CourseStatistics(BaseModel):
+    course_id: int
+    total_students: int
+    total_assignments: int
+    average_grade: float
+    min_grade: float
+    max_grade: float
+
+
 class EnrollmentBase(BaseModel):
     student_id: int
     course_id: int
@@ -165,6 +174,25 @@ class EnrollmentCreate(EnrollmentBase):
         extra = "ignore"
 
 
+class BulkEnrollmentCreate(BaseModel):
+    course_ids: List[int]
+    student_ids: Optional[List[int]] = None
+    group_number: Optional[str] = None
+    enrollment_date: Optional[date] = None
+
+
+class EnrollmentPair(BaseModel):
+    student_id: int
+    course_id: int
+
+
+class BulkEnrollmentReport(BaseModel):
+    created: List[EnrollmentPair]
+    skipped: List[EnrollmentPair]
+    missing_student_ids: List[int]
+    missing_course_ids: List[int]
+
+
 class EnrollmentUpdate(BaseModel):
     grade: Optional[float] = None
 
@@ -214,6 +242,18 @@ class GradeWithDetails(Grade):
     course: Course
 
 
+class GradeImportError(BaseModel):
+    row: int
+    errors: List[str]
+
+
+class GradeImportReport(BaseModel):
+    total: int
+    inserted: int
+    rejected: int
+    errors: List[GradeImportError]
+
+
 class AttachmentBase(BaseModel):
     filename: str
     file_type: str
@@ -269,6 +309,57 @@ class ScheduleWithCourse(Schedule):
     course: Course
 
 
+class ScheduleBulkCreate(BaseModel):
+    items: List[ScheduleCreate]
+
+
+class ScheduleConflict(BaseModel):
+    teacher_id: int
+    course_id: int
+    start_date_time: datetime
+    end_date_time: datetime
+    # Номер занятия в запросе (с 0); для одиночной записи - 0
+    item: Optional[int] = None
+    # С чем пересеклось: записанное занятие или другое занятие того же запроса
+    conflicting_schedule_id: Optional[int] = None
+    conflicting_item: Optional[int] = None
+    conflicting_course_id: int
+    conflicting_start_date_time: datetime
+    conflicting_end_date_time: datetime
+
+
+class ScheduleSeriesBase(BaseModel):
+    course_id: int
+    # Дни недели по ISO: 1 - понедельник, 7 - воскресенье
+    weekdays: List[int]
+    start_time: time
+    end_time: time
+    date_from: date
+    date_to: date
+    exception_dates: List[date] = []
+
+
+class ScheduleSeriesCreate(ScheduleSeriesBase):
+    pass
+
+
+class ScheduleSeriesUpdate(BaseModel):
+    weekdays: Optional[List[int]] = None
+    start_time: Optional[time] = None
+    end_time: Optional[time] = None
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    exception_dates: Optional[List[date]] = None
+
+
+class ScheduleSeries(ScheduleSeriesBase):
+    id: int
+    occurrences: int
+
+    class Config:
+        from_attributes = True
+
+
 class StudentPerformanceReport(BaseModel):
     student_id: int
     student_name: str
@@ -295,6 +386,32 @@ class ScheduleReport(BaseModel):
     courses: List[Dict[str, Any]]
 
 
+class StudentStatementsBatch(BaseModel):
+    student_ids: Optional[List[int]] = None
+    group_number: Optional[str] = None
+
+
+class IdsRequest(BaseModel):
+    ids: List[int]
+
+
+class ReportJobCreate(BaseModel):
+    report: str
+    params: Dict[str, Any] = {}
+
+
+class ReportJob(BaseModel):
+    id: str
+    report: str
+    params: Dict[str, Any]
+    status: str
+    error: Optional[str] = None
+    result_size: Optional[int] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
 class LoginRequest(BaseModel):
     username: str
     password: str
@@ -0,0 +1,130 @@
+"""FAST_JSON_RESPONSES: ответ в обход pydantic должен совпадать с ним байт в байт"""
+
+import typing
+from datetime import date, datetime, timezone
+from decimal import Decimal
+import pytest
+from pydantic import EmailStr
+import fast_json
+import fieldsets
+
+FIELDSETS = {
+    "USER": fieldsets.USER,
+    "STUDENT": fieldsets.STUDENT,
+    "TEACHER": fieldsets.TEACHER,
+    "COURSE": fieldsets.COURSE,
+    "STUDENTS": fieldsets.STUDENTS,
+    "TEACHERS": fieldsets.TEACHERS,
+    "COURSES": fieldsets.COURSES,
+    "GRADES": fieldsets.GRADES,
+    "ENROLLMENTS": fieldsets.ENROLLMENTS,
+    "SCHEDULE": fieldsets.SCHEDULE,
+}
+
+# Значения того вида, в котором их отдает asyncpg: numeric - Decimal,
+# timestamp - datetime без зоны, timestamptz - с зоной
+VARIANTS = {
+    "values": {
+        int: 7,
+        str: "Иванов \"Ваня\" \\ </script>\t\n😀",
+        EmailStr: "ivanov@example.ru",
+        float: Decimal("4.50"),
+        datetime: datetime(2024, 2, 29, 13, 5, 7, 123456),
+        date: date(2024, 2, 29),
+    },
+    "round": {
+        int: 0,
+        str: "",
+        EmailStr: "a@b.ru",
+        float: Decimal("5"),
+        datetime: datetime(2024, 1, 1),
+        date: date(1999, 12, 31),
+    },
+    "aware": {
+        int: -1,
+        str: "x",
+        EmailStr: "a@b.ru",
+        float: 0.1,
+        datetime: datetime(2024, 6, 1, 8, 30, tzinfo=timezone.utc),
+        date: date(2024, 6, 1),
+    },
+    "nulls": None,
+}
+
+
+def _value(annotation, variant: str):
+    args = typing.get_args(annotation)
+    if type(None) in args:
+        if variant == "nulls":
+            return None
+        annotation = next(arg for arg in args if arg is not type(None))
+    return VARIANTS[variant if variant != "nulls" else "values"][annotation]
+
+
+def _row(fieldset: fieldsets.Fieldset, selection, variant: str) -> list:
+    """Значения столбцов в порядке fieldset.select(selection)"""
+
+    row = []
+    for name, sub in selection.items():
+        if sub is None:
+            row.append(_value(fieldset.model.model_fields[name].annotation, variant))
+        else:
+            row.extend(_row(fieldset.nested[name], sub, variant))
+    return row
+
+
+def _fields(fieldset: fieldsets.Fieldset) -> list:
+    """Значения ?fields=: все поля, поля в обратном порядке, части вложенных объектов"""
+
+    columns = [name for name in fieldset.model.model_fields if name in fieldset.columns]
+    cases = [None, ",".join(reversed(columns)), columns[-1]]
+    for name, nested in fieldset.nested.items():
+        nested_columns = [sub for sub in nested.model.model_fields if sub in nested.columns]
+        cases.append(f"{name}.{nested_columns[-1]},{columns[0]},{name}.{nested_columns[0]}")
+        cases.append(f"{name},{columns[-1]}")
+    return cases
+
+
+CASES = [
+    pytest.param(fieldset, fields, variant, id=f"{name}-{fields or 'all'}-{variant}")
+    for name, fieldset in FIELDSETS.items()
+    for fields in _fields(fieldset)
+    for variant in VARIANTS
+]
+
+
+@pytest.fixture(params=["orjson", "json"])
+def encoder(request, monkeypatch):
+    if request.param == "orjson":
+        if fast_json.orjson is None:
+            pytest.skip("orjson не установлен")
+    else:
+        monkeypatch.setattr(fast_json, "orjson", None)
+    return request.param
+
+
+def _body(monkeypatch, fast: bool, fieldset, selection, content) -> bytes:
+    monkeypatch.setattr(fast_json, "FAST_JSON_RESPONSES", fast)
+    return fieldset.respond(selection, content).body
+
+
+@pytest.mark.parametrize("fieldset, fields, variant", CASES)
+def test_fast_path_matches_pydantic(monkeypatch, encoder, fieldset, fields, variant):
+    selection = fieldset.parse(fields)
+    item = fieldset.build(selection, _row(fieldset, selection, variant))
+    items = fieldset.build_all(selection, [_row(fieldset, selection, variant), _row(fieldset, selection, "values")])
+
+    for content in (item, items, []):
+        expected = _body(monkeypatch, False, fieldset, selection, content)
+        assert _body(monkeypatch, True, fieldset, selection, content) == expected
+
+
+def test_fields_order_does_not_change_body(monkeypatch):
+    selection = fieldsets.GRADES.parse("course.title,grade_value,student.last_name,id")
+    reordered = fieldsets.GRADES.parse("id,student.last_name,grade_value,course.title")
+    assert list(selection) == list(reordered)
+
+    row = _row(fieldsets.GRADES, selection, "values")
+    first = _body(monkeypatch, True, fieldsets.GRADES, selection, fieldsets.GRADES.build(selection, row))
+    second = _body(monkeypatch, True, fieldsets.GRADES, reordered, fieldsets.GRADES.build(reordered, row))
+    assert first == second
@@ -0,0 +1,70 @@
+"""Изменяющие обработчики: одно обращение к базе и прежние ответы.
+
+Сценарии и счетчик обращений - из benchmarks/write_round_trips.py. Нужна
+база из DATABASE_URL: приложение запускается целиком (lifespan готовит
+схему), данные сценария создаются во внешней транзакции и откатываются.
+Без базы тесты пропускаются.
+"""
+
+import os
+import pytest
+from fastapi.testclient import TestClient
+from benchmarks import write_round_trips
+
+# Ответ каждого сценария: тот же код и текст, что до записи одним запросом
+EXPECTED = {
+    "create_grade": "ok",
+    "create_grade: нет студента": "400 Указанный студент не существует",
+    "update_grade": "ok",
+    "update_grade: название": "ok",
+    "update_grade: нет оценки": "404 Оценка не найдена",
+    "enroll_student": "ok",
+    "enroll_student: уже записан": "400 Студент уже записан на этот курс",
+    "update_grade (enrollments)": "ok",
+    "update_grade (enrollments): нет записи": "404 Запись на курс не найдена",
+    "update_course": "ok",
+    "update_course: нет преподавателя": "400 Указанный преподаватель не существует",
+    "create_schedule_item": "ok",
+    "create_schedule_item: нет курса": "400 Указанный курс не существует",
+    "update_schedule_item": "ok",
+    "update_schedule_item: нет элемента": "404 Элемент расписания не найден",
+    # Раньше проходило без проверки, теперь - как при изменении обеих границ
+    "update_schedule_item: конец раньше начала": "400 Время начала должно быть раньше времени окончания",
+}
+
+
+@pytest.fixture(scope="module")
+def client():
+    if not os.getenv("DATABASE_URL"):
+        pytest.skip("DATABASE_URL не задан")
+
+    from main import app
+    try:
+        with TestClient(app) as client:
+            yield client
+    except (OSError, ConnectionError) as e:
+        pytest.skip(f"База недоступна: {e}")
+
+
+async def _measure(pool, name: str) -> tuple:
+    async with pool.acquire() as conn:
+        tr = conn.transaction()
+        await tr.start()
+        try:
+            ids = await write_round_trips.seed(conn)
+            call = dict(write_round_trips.scenarios(ids))[name]
+            return await write_round_trips.run(conn, call)
+        finally:
+            await tr.rollback()
+
+
+def test_every_scenario_is_checked():
+    assert set(EXPECTED) == set(write_round_trips.BASELINE)
+
+
+@pytest.mark.parametrize("name", list(EXPECTED))
+def test_write_is_one_round_trip(client, name):
+    round_trips, outcome = client.portal.call(_measure, client.app.state.pool, name)
+
+    assert outcome == EXPECTED[name]
+    assert round_trips == 1
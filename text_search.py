@@ -0,0 +1,226 @@
+import re
+from typing import List, Optional
+import asyncpg
+
+AUTOCOMPLETE_LIMIT = 10
+# Сколько совпадений ранжируется: короткий префикс вроде "и" подходит под
+# большую часть таблицы, и считать ts_rank для всех строк слишком дорого.
+SEARCH_CANDIDATES = 1000
+
+# Документы полнотекстового поиска. Конфигурация 'simple' не стеммит и не
+# выкидывает стоп-слова: имена и логины ищутся как есть, на любом языке.
+# {t} - префикс алиаса таблицы; в индексах подставляется пустая строка,
+# чтобы выражение индекса совпадало с выражением в запросах.
+_STUDENT_DOC = "to_tsvector('simple', {t}first_name || ' ' || {t}last_name || ' ' || {t}group_number)"
+_TEACHER_DOC = "to_tsvector('simple', {t}first_name || ' ' || {t}last_name || ' ' || {t}qualification)"
+_USER_DOC = "to_tsvector('simple', {t}username)"
+_COURSE_DOC = (
+    "(setweight(to_tsvector('simple', {t}title), 'A')"
+    " || setweight(to_tsvector('simple', coalesce({t}description, '')), 'B'))"
+)
+
+# Подписи для автодополнения: поиск по префиксу идет по btree-индексам
+# (text_pattern_ops) и останавливается, набрав нужное число строк
+_LAST_FIRST = "lower({t}last_name || ' ' || {t}first_name)"
+_FIRST_LAST = "lower({t}first_name || ' ' || {t}last_name)"
+_USERNAME = "lower({t}username)"
+_TITLE = "lower({t}title)"
+
+_INDEXES = [
+    f"CREATE INDEX IF NOT EXISTS students_search_idx ON courses.students USING gin ({_STUDENT_DOC.format(t='')})",
+    f"CREATE INDEX IF NOT EXISTS teachers_search_idx ON courses.teachers USING gin ({_TEACHER_DOC.format(t='')})",
+    f"CREATE INDEX IF NOT EXISTS users_search_idx ON courses.users USING gin ({_USER_DOC.format(t='')})",
+    f"CREATE INDEX IF NOT EXISTS courses_search_idx ON courses.courses USING gin ({_COURSE_DOC.format(t='')})",
+    f"CREATE INDEX IF NOT EXISTS students_last_first_idx ON courses.students ({_LAST_FIRST.format(t='')} text_pattern_ops)",
+    f"CREATE INDEX IF NOT EXISTS students_first_last_idx ON courses.students ({_FIRST_LAST.format(t='')} text_pattern_ops)",
+    f"CREATE INDEX IF NOT EXISTS teachers_last_first_idx ON courses.teachers ({_LAST_FIRST.format(t='')} text_pattern_ops)",
+    f"CREATE INDEX IF NOT EXISTS teachers_first_last_idx ON courses.teachers ({_FIRST_LAST.format(t='')} text_pattern_ops)",
+    f"CREATE INDEX IF NOT EXISTS users_username_prefix_idx ON courses.users ({_USERNAME.format(t='')} text_pattern_ops)",
+    f"CREATE INDEX IF NOT EXISTS courses_title_prefix_idx ON courses.courses ({_TITLE.format(t='')} text_pattern_ops)",
+    # Для поиска по логину: от найденного пользователя к студенту/преподавателю
+    "CREATE INDEX IF NOT EXISTS students_user_id_idx ON courses.students (user_id)",
+    "CREATE INDEX IF NOT EXISTS teachers_user_id_idx ON courses.teachers (user_id)",
+]
+
+
+# Фильтр search= в списках ищет подстроку (ILIKE '%...%'), а не начало
+# слова, как /search. Такое условие обслуживает только триграммный индекс
+# pg_trgm; без расширения фильтр работает просмотром таблицы, как раньше.
+_TRIGRAM_COLUMNS = [
+    ("students", "first_name"),
+    ("students", "last_name"),
+    ("teachers", "first_name"),
+    ("teachers", "last_name"),
+    ("teachers", "qualification"),
+    ("users", "username"),
+    ("courses", "title"),
+    ("courses", "description"),
+]
+
+
+async def ensure_indexes(conn: asyncpg.Connection) -> bool:
+    """Индексы поиска; False - pg_trgm недоступно и триграммные индексы не созданы"""
+
+    for statement in _INDEXES:
+        await conn.execute(statement)
+
+    available = await conn.fetchval("SELECT EXISTS(SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm')")
+    if not available:
+        return False
+    try:
+        await conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    except asyncpg.exceptions.InsufficientPrivilegeError:
+        return False
+
+    for table, column in _TRIGRAM_COLUMNS:
+        await conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_{column}_trgm_idx ON courses.{table} USING gin ({column} gin_trgm_ops)"
+        )
+    return True
+
+
+def to_query(text: Optional[str]) -> Optional[str]:
+    """Текст из строки поиска -> tsquery: все слова обязательны, каждое как префикс.
+
+    Берутся только буквы и цифры, поэтому пользовательский ввод не может
+    сломать синтаксис tsquery. None, если искать нечего.
+    """
+
+    terms = re.findall(r"[^\W_]+", (text or "").lower())
+    if not terms:
+        return None
+    return " & ".join(f"{term}:*" for term in terms)
+
+
+def _like_prefix(text: str) -> str:
+    escaped = text.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "%"
+
+
+# Каждая ветка читает свой GIN-индекс; условие OR через JOIN индексом не
+# обслуживается. Дубликаты не мешают: результат используется в IN или DISTINCT.
+_MATCH_IDS = {
+    "students": (
+        "SELECT id FROM courses.students WHERE {student_doc} @@ to_tsquery('simple', ${n})"
+        " UNION ALL SELECT st.id FROM courses.students st JOIN courses.users u ON st.user_id = u.id"
+        " WHERE {user_doc} @@ to_tsquery('simple', ${n})"
+    ),
+    "teachers": (
+        "SELECT id FROM courses.teachers WHERE {teacher_doc} @@ to_tsquery('simple', ${n})"
+        " UNION ALL SELECT te.id FROM courses.teachers te JOIN courses.users u ON te.user_id = u.id"
+        " WHERE {user_doc} @@ to_tsquery('simple', ${n})"
+    ),
+    "courses": "SELECT id FROM courses.courses WHERE {course_doc} @@ to_tsquery('simple', ${n})",
+}
+
+
+def _match_ids(entity: str, param: int) -> str:
+    """Подзапрос id сущностей, подходящих под tsquery в параметре $param"""
+
+    return _MATCH_IDS[entity].format(
+        n=param,
+        student_doc=_STUDENT_DOC.format(t=""),
+        teacher_doc=_TEACHER_DOC.format(t=""),
+        user_doc=_USER_DOC.format(t="u."),
+        course_doc=_COURSE_DOC.format(t=""),
+    )
+
+
+_SEARCH_SQL = {
+    "students": """
+        SELECT s.id, s.first_name, s.last_name, s.group_number, u.username,
+               ts_rank({student_doc}, q) + COALESCE(ts_rank({user_doc}, q), 0) AS rank
+        FROM (SELECT DISTINCT id FROM ({ids} LIMIT {candidates}) c) m
+        JOIN courses.students s ON s.id = m.id
+        LEFT JOIN courses.users u ON s.user_id = u.id,
+             to_tsquery('simple', $1) q
+        ORDER BY rank DESC, s.last_name, s.first_name, s.id
+        LIMIT $2
+    """,
+    "teachers": """
+        SELECT t.id, t.first_name, t.last_name, t.qualification, u.username,
+               ts_rank({teacher_doc}, q) + COALESCE(ts_rank({user_doc}, q), 0) AS rank
+        FROM (SELECT DISTINCT id FROM ({ids} LIMIT {candidates}) c) m
+        JOIN courses.teachers t ON t.id = m.id
+        LEFT JOIN courses.users u ON t.user_id = u.id,
+             to_tsquery('simple', $1) q
+        ORDER BY rank DESC, t.last_name, t.first_name, t.id
+        LIMIT $2
+    """,
+    "courses": """
+        SELECT c.id, c.title, c.teacher_id,
+               ts_rank({course_doc}, q) AS rank
+        FROM (SELECT DISTINCT id FROM ({ids} LIMIT {candidates}) c) m
+        JOIN courses.courses c ON c.id = m.id,
+             to_tsquery('simple', $1) q
+        ORDER BY rank DESC, c.title, c.id
+        LIMIT $2
+    """,
+}
+
+# Автодополнение: каждая ветка - упорядоченный обход btree-индекса с LIMIT.
+# USING ~<~ - порядок text_pattern_ops, иначе индекс не годится для ORDER BY.
+_PERSON_AUTOCOMPLETE_SQL = """
+    SELECT id, label FROM (
+        (SELECT id, {last_first} AS key, last_name || ' ' || first_name AS label
+         FROM courses.{table} WHERE {last_first} LIKE lower($1) ORDER BY {last_first} USING ~<~ LIMIT $2)
+        UNION
+        (SELECT id, {first_last}, last_name || ' ' || first_name
+         FROM courses.{table} WHERE {first_last} LIKE lower($1) ORDER BY {first_last} USING ~<~ LIMIT $2)
+        UNION
+        (SELECT p.id, {username}, p.last_name || ' ' || p.first_name
+         FROM courses.users u JOIN courses.{table} p ON p.user_id = u.id
+         WHERE {username} LIKE lower($1) ORDER BY {username} USING ~<~ LIMIT $2)
+    ) found
+    GROUP BY id, label
+    ORDER BY MIN(key), id
+    LIMIT $2
+"""
+
+_AUTOCOMPLETE_SQL = {
+    "students": _PERSON_AUTOCOMPLETE_SQL.format(
+        table="students", last_first=_LAST_FIRST.format(t=""), first_last=_FIRST_LAST.format(t=""),
+        username=_USERNAME.format(t="u.")
+    ),
+    "teachers": _PERSON_AUTOCOMPLETE_SQL.format(
+        table="teachers", last_first=_LAST_FIRST.format(t=""), first_last=_FIRST_LAST.format(t=""),
+        username=_USERNAME.format(t="u.")
+    ),
+    "courses": f"""
+        SELECT id, title AS label
+        FROM courses.courses
+        WHERE {_TITLE.format(t='')} LIKE lower($1)
+        ORDER BY {_TITLE.format(t='')} USING ~<~, id
+        LIMIT $2
+    """,
+}
+
+
+async def search(conn: asyncpg.Connection, entity: str, text: str, limit: int) -> List[dict]:
+    """Полнотекстовый поиск с ранжированием: все слова, каждое по префиксу"""
+
+    query = to_query(text)
+    if query is None:
+        return []
+
+    sql = _SEARCH_SQL[entity].format(
+        ids=_match_ids(entity, 1),
+        candidates=SEARCH_CANDIDATES,
+        student_doc=_STUDENT_DOC.format(t="s."),
+        teacher_doc=_TEACHER_DOC.format(t="t."),
+        user_doc=_USER_DOC.format(t="u."),
+        course_doc=_COURSE_DOC.format(t="c."),
+    )
+    return [dict(row) for row in await conn.fetch(sql, query, limit)]
+
+
+async def autocomplete(conn: asyncpg.Connection, entity: str, text: str, limit: int) -> List[dict]:
+    """Подсказки по началу строки: "фамилия имя", "имя фамилия" или логин.
+
+    Только id и подпись, по алфавиту. Работает за время, не зависящее от
+    того, сколько строк подходит под короткий префикс.
+    """
+
+    if not text.strip():
+        return []
+    return [dict(row) for row in await conn.fetch(_AUTOCOMPLETE_SQL[entity], _like_prefix(text), limit)]